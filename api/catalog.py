@@ -0,0 +1,163 @@
+import json
+import time
+import hashlib
+import importlib
+import threading
+from functools import lru_cache
+
+from dbs import get_sql_server_pool, get_freetds_pool
+from utils.functions_catalog import load_catalog_snapshot, fetch_table_stats
+from utils.functions_pgsql import process_column, normalize_name
+from api.jobs import MIGRATION_SCRIPTS
+
+# Instâncias acessadas pelo DSN do FreeTDS (as demais pelo ODBC Driver 17)
+FREETDS_INSTANCES = {'BD01_CREFs'}
+
+
+@lru_cache(maxsize=1)
+def known_sources():
+    """(database, instance) of every base configured in the migration scripts (`BASES_PARA_MIGRAR`)."""
+    sources = set()
+    for module_name in MIGRATION_SCRIPTS.values():
+        module = importlib.import_module(module_name)
+        sources.update((base[0], base[3]) for base in module.BASES_PARA_MIGRAR)
+    return frozenset(sources)
+
+
+def get_source_pool(database, instance):
+    if instance in FREETDS_INSTANCES:
+        return get_freetds_pool(database, instance, max_size=4)
+    return get_sql_server_pool(database, instance, max_size=4)
+
+
+def load_catalog_entry(database, instance):
+    """
+    Read the catalog of a source database, with the PostgreSQL name and
+    type of every column and the estimated size of every table.
+
+    Returns:
+        dict: 'version', 'loaded_at', 'etag', 'tables' ({name: summary})
+        and 'columns' ({name: [column]}).
+    """
+    with get_source_pool(database, instance).connection(timeout=30) as conn:
+        catalog = load_catalog_snapshot(conn)
+        stats = fetch_table_stats(conn)
+
+    tables = {}
+    columns = {}
+    for table_name in catalog.table_names():
+        table_columns = []
+        for column_name, column_info in catalog.columns(table_name).items():
+            column = {
+                'name': column_name,
+                'type': column_info['type'],
+                'length': column_info.get('length'),
+                'precision': column_info.get('precision'),
+                'scale': column_info.get('scale'),
+                'nullable': column_info.get('nullable', True),
+                'default': column_info.get('default'),
+                'pgsql_name': None,
+                'pgsql_type': None,
+                'error': None,
+            }
+            try:
+                processed_column = process_column(column_name, column_info)
+                column['pgsql_name'] = processed_column['normalized_name'].strip('"')
+                column['pgsql_type'] = processed_column['pgsql_data_type']
+            except ValueError as e:
+                # Tipo sem mapeamento: a tabela não pode ser migrada como está
+                column['error'] = str(e)
+            table_columns.append(column)
+
+        table_stats = stats.get(table_name, {})
+        columns[table_name] = table_columns
+        tables[table_name] = {
+            'name': table_name,
+            'pgsql_name': normalize_name(table_name),
+            'columns': len(table_columns),
+            'key_columns': catalog.key_columns(table_name),
+            'unmapped_columns': [column['name'] for column in table_columns if column['error']],
+            'rows': table_stats.get('rows', 0),
+            'reserved_bytes': table_stats.get('reserved_bytes', 0),
+            'used_bytes': table_stats.get('used_bytes', 0),
+        }
+
+    content = json.dumps({'version': catalog.version, 'tables': tables, 'columns': columns}, sort_keys=True, default=str)
+    return {
+        'database': database,
+        'instance': instance,
+        'version': catalog.version,
+        'loaded_at': time.time(),
+        # Mesmo conteúdo, mesmo ETag: uma recarga sem mudanças ainda responde 304
+        'etag': '"' + hashlib.sha1(content.encode('utf-8')).hexdigest() + '"',
+        'tables': tables,
+        'columns': columns,
+    }
+
+
+class CatalogCache:
+    """
+    Catalog of each source database (see `load_catalog_entry`), kept for
+    `ttl` seconds and shared by every request.
+
+    Only one request loads a given database at a time; the others wait
+    for it instead of querying the same server.
+    """
+
+    def __init__(self, ttl=300, load=load_catalog_entry):
+        self.ttl = ttl
+        self.load = load
+        self.entries = {}
+        self.loading_locks = {}
+        self.lock = threading.Lock()
+
+    def _fresh(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            loading_lock = self.loading_locks.setdefault(key, threading.Lock())
+        if entry is not None and time.time() - entry['loaded_at'] < self.ttl:
+            return entry, loading_lock
+        return None, loading_lock
+
+    def get(self, database, instance):
+        key = (instance, database)
+        entry, loading_lock = self._fresh(key)
+        if entry is not None:
+            return entry
+        with loading_lock:
+            entry, _ = self._fresh(key)
+            if entry is None:
+                entry = self.load(database, instance)
+                with self.lock:
+                    self.entries[key] = entry
+        return entry
+
+    def invalidate(self, database=None, instance=None):
+        """Drop cached catalogs, all of them or those matching `database`/`instance`."""
+        with self.lock:
+            keys = [
+                key for key in self.entries
+                if (instance is None or key[0] == instance) and (database is None or key[1] == database)
+            ]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+
+def etag_matches(if_none_match, etag):
+    """Check an `If-None-Match` header against an ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [value.strip() for value in if_none_match.split(',')]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def paginate(items, offset=0, limit=100):
+    return {
+        'total': len(items),
+        'offset': offset,
+        'limit': limit,
+        'items': items[offset:offset + limit],
+    }
@@ -0,0 +1,234 @@
+import time
+import uuid
+import threading
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.functions_metrics import MigrationMetrics
+from utils.functions_parallel import run_migrations
+
+# Scripts de migração que podem ser executados pela API
+MIGRATION_SCRIPTS = {
+    'confef': 'migra_confef',
+    'crefs': 'migra_crefs',
+    'crefs_registro': 'migra_crefs_registro',
+    'crefs_arrecadacao': 'migra_crefs_arrecadacao',
+}
+
+# Estados finais de um job
+FINISHED_STATUSES = {'done', 'failed', 'cancelled'}
+
+
+class MigrationCancelled(Exception):
+    pass
+
+
+class JobMetrics(MigrationMetrics):
+    """
+    Metrics of one base of a job: every event is published to the job,
+    and a cancelled job stops at the next table or batch.
+    """
+
+    def __init__(self, job, base_origem=None, schema=None, log_path=None):
+        super().__init__(base_origem, schema, log_path)
+        self.job = job
+
+    def on_event(self, event):
+        self.job.publish(event)
+
+    def start_table(self, table_name):
+        self.job.raise_if_cancelled()
+        super().start_table(table_name)
+
+    def record_batch(self, table_name, rows, size, seconds, faixa=''):
+        super().record_batch(table_name, rows, size, seconds, faixa)
+        self.job.raise_if_cancelled()
+
+
+class MigrationJob:
+    """
+    A migration started from the API: one or more bases of a script,
+    optionally restricted to some tables.
+
+    Events (job status, tables started and finished, batches) are kept in
+    order; their index is the SSE event id, so a client can resume a
+    stream with `Last-Event-ID`.
+    """
+
+    def __init__(self, script, bases, tables=None, options=None, parallel=1):
+        self.id = uuid.uuid4().hex
+        self.script = script
+        self.bases = bases
+        self.tables = tables
+        self.options = options or {}
+        self.parallel = parallel
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.summaries = []
+        self.metrics = []
+        self.events = []
+        self.lock = threading.Lock()
+        self.cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def publish(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def events_since(self, index):
+        with self.lock:
+            return self.events[index:]
+
+    def set_status(self, status, error=None):
+        self.error = error
+        self.publish({'event': 'job', 'status': status, 'error': error, 'ts': time.time()})
+        # O status final é gravado depois do último evento: quem lê o stream não perde nada
+        self.status = status
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    def raise_if_cancelled(self):
+        if self.cancel_requested.is_set():
+            raise MigrationCancelled(f"Job {self.id} cancelled")
+
+    def make_metrics(self, base_origem, schema, log_path=None):
+        metrics = JobMetrics(self, base_origem, schema, log_path)
+        self.metrics.append(metrics)
+        return metrics
+
+    def to_dict(self):
+        tables = {}
+        for metrics in list(self.metrics):
+            for table_name, stats in metrics.slowest_tables():
+                tables[f"{metrics.base_origem}.{table_name}"] = {
+                    'status': stats['status'], 'rows': stats['rows'], 'bytes': stats['bytes'],
+                    'duration': stats['duration'], 'seconds': stats['seconds'],
+                }
+        return {
+            'id': self.id,
+            'script': self.script,
+            'bases': [base[0] for base in self.bases],
+            'tables_requested': self.tables,
+            'options': self.options,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'summaries': [
+                {**summary, 'failures': {table: str(error) for table, error in summary['failures'].items()}}
+                for summary in self.summaries
+            ],
+            'tables': tables,
+        }
+
+
+def select_bases(bases_para_migrar, bases=None, schemas=None, copy_data=True):
+    """
+    Pick the bases of a script by source base name and/or target schema
+    (e.g. the state, 'rj'), all of them when neither is given.
+
+    Returns:
+        list: `(base_origem, base_destino, schema, instancia, copy_data)` tuples.
+    """
+    selected = []
+    for base in bases_para_migrar:
+        base_origem, base_destino, schema, instancia = base[:4]
+        if bases and base_origem not in bases:
+            continue
+        if schemas and schema not in schemas:
+            continue
+        base_copy_data = base[4] if len(base) > 4 else True
+        selected.append((base_origem, base_destino, schema, instancia, copy_data and base_copy_data))
+    return selected
+
+
+class JobManager:
+    """
+    Runs migration jobs on a dedicated thread pool, off the event loop,
+    and keeps them (finished ones included) for status queries.
+    """
+
+    def __init__(self, max_jobs=2, metrics_dir='logs'):
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='migration-job')
+        self.metrics_dir = metrics_dir
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, script, bases=None, schemas=None, tables=None, copy_data=True, parallel=1, **options):
+        """
+        Queue a migration job.
+
+        Args:
+            script: Key of `MIGRATION_SCRIPTS`.
+            bases: Source bases to migrate; all bases of the script by default.
+            schemas: Target schemas (states) to migrate.
+            tables: Only these tables of each base.
+            copy_data: Copy the data, not just create the tables.
+            parallel: Bases migrated at the same time.
+            **options: Passed to `migrar` (workers, partitions, resume, ...).
+
+        Raises:
+            ValueError: Unknown script, or no base matching the selection.
+        """
+        if script not in MIGRATION_SCRIPTS:
+            raise ValueError(f"Unknown script: '{script}'")
+        module = importlib.import_module(MIGRATION_SCRIPTS[script])
+        selected = select_bases(module.BASES_PARA_MIGRAR, bases, schemas, copy_data)
+        if not selected:
+            raise ValueError("No base matches the selection")
+
+        job = MigrationJob(script, selected, tables, options, parallel)
+        with self.lock:
+            self.jobs[job.id] = job
+        job.publish({'event': 'job', 'status': 'queued', 'ts': job.created_at})
+        self.executor.submit(self._run, job, module)
+        return job
+
+    def _run(self, job, module):
+        if job.cancel_requested.is_set():
+            job.finished_at = time.time()
+            job.set_status('cancelled')
+            return
+        job.started_at = time.time()
+        job.set_status('running')
+        try:
+            options = dict(job.options)
+            if job.tables is not None:
+                options['tables'] = job.tables
+            job.summaries = run_migrations(module.migrar, job.bases, max_parallel=job.parallel,
+                                           metrics_dir=self.metrics_dir, metrics_class=job.make_metrics, **options)
+        except Exception as e:
+            job.finished_at = time.time()
+            job.set_status('failed', str(e))
+            return
+        job.finished_at = time.time()
+        if job.cancel_requested.is_set():
+            job.set_status('cancelled')
+        elif any(summary['failures'] for summary in job.summaries):
+            job.set_status('failed', "Some tables failed")
+        else:
+            job.set_status('done')
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """Ask a job to stop; it stops at its next table or batch."""
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+            job.publish({'event': 'job', 'status': 'cancelling', 'ts': time.time()})
+        return job
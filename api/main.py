@@ -1,12 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from pydantic import BaseModel
+from typing import Dict, List, Optional
 
 import sys
 import os
+import json
+import asyncio
 
 # Adicionar o diretório raiz ao sys.path
 sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
 
-from dbs import get_freetds_connection, get_postgresql_connection, get_sql_server_connection
+from api.jobs import JobManager
+from api.catalog import CatalogCache, etag_matches, paginate, known_sources
 import uvicorn
 
 
@@ -16,21 +22,166 @@ base_origem = "CONFEF_SDP"
 base_destino = "efcontrol_eventos"
 instancia_origem = "BD02_CONFEF"
 
-# Conectar ao SQL Server
-sql_server_conn = get_sql_server_connection(base_origem, instancia_origem)
-    
-# Conectar ao PostgreSQL
-postgresql_conn = get_postgresql_connection(base_destino)
+# Catálogo das bases de origem, recarregado no máximo a cada 5 minutos
+catalog_cache = CatalogCache(ttl=300)
 
+
+def require_known_source(instance, database):
+    """404 for anything but a configured base: instance and database go into the ODBC connection string."""
+    if (database, instance) != (base_origem, instancia_origem) and (database, instance) not in known_sources():
+        raise HTTPException(status_code=404, detail=f"Unknown source database {instance}/{database}")
+
+
+def cached_response(request, entry, build):
+    """Answer 304 when the client already has this version of the catalog, else the JSON built by `build`."""
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+
+# Endpoints com driver bloqueante são `def`: o FastAPI os executa no thread pool
 @app.get("/tables")
-async def list_tables():
+def list_tables():
     try:
-        with sql_server_conn as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE' AND LEN(TABLE_NAME) <= 7")
-            tables = [row.TABLE_NAME for row in cursor.fetchall()]
-        return {"tables": tables}
+        entry = catalog_cache.get(base_origem, instancia_origem)
+        return {"tables": [table_name for table_name in entry["tables"] if len(table_name) <= 7]}
     except Exception as e:
         return {"error": str(e)}
 
+
+@app.get("/catalog/{instance}/{database}/tables")
+def list_catalog_tables(instance: str, database: str, request: Request, offset: int = Query(0, ge=0),
+                        limit: int = Query(100, ge=1, le=1000), search: Optional[str] = None,
+                        sort: str = "name"):
+    """Tables of a source database with estimated rows and size, paginated."""
+    if sort not in ("name", "rows", "reserved_bytes"):
+        raise HTTPException(status_code=400, detail=f"Invalid sort: '{sort}'")
+    require_known_source(instance, database)
+    entry = catalog_cache.get(database, instance)
+
+    def build():
+        tables = list(entry["tables"].values())
+        if search:
+            tables = [table for table in tables if search.lower() in table["name"].lower()]
+        if sort != "name":
+            tables.sort(key=lambda table: table[sort], reverse=True)
+        return {"database": database, "instance": instance, "version": entry["version"],
+                **paginate(tables, offset, limit)}
+
+    return cached_response(request, entry, build)
+
+
+@app.get("/catalog/{instance}/{database}/tables/{table_name}/columns")
+def list_catalog_columns(instance: str, database: str, table_name: str, request: Request):
+    """Columns of a table with the PostgreSQL name and type they are migrated to."""
+    require_known_source(instance, database)
+    entry = catalog_cache.get(database, instance)
+    if table_name not in entry["columns"]:
+        raise HTTPException(status_code=404, detail=f"Table {table_name} not found in {database}")
+    return cached_response(request, entry, lambda: {
+        "table": entry["tables"][table_name],
+        "columns": entry["columns"][table_name],
+    })
+
+
+@app.post("/catalog/{instance}/{database}/invalidate")
+def invalidate_catalog(instance: str, database: str):
+    """Forget the cached catalog of a database, e.g. after a DDL change on the source."""
+    require_known_source(instance, database)
+    return {"invalidated": catalog_cache.invalidate(database, instance)}
+
+# Migrações rodam num pool de threads próprio, fora do event loop
+job_manager = JobManager(max_jobs=2)
+
+
+class JobRequest(BaseModel):
+    script: str = "crefs"
+    bases: Optional[List[str]] = None
+    schemas: Optional[List[str]] = None
+    tables: Optional[List[str]] = None
+    copy_data: bool = True
+    parallel: int = 1
+    workers: int = 1
+    partitions: int = 1
+    resume: bool = False
+    incremental: bool = False
+    updated_at_column: Optional[str] = None
+    staged: bool = False
+    verify: bool = False
+    # Id de cada base (por base_origem) nas tabelas de controle objetos/campos
+    base_dados_ids: Optional[Dict[str, int]] = None
+
+
+def get_job_or_404(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+def create_job(job_request: JobRequest):
+    """Start a migration in the background and return its id right away."""
+    try:
+        job = job_manager.submit(
+            job_request.script, bases=job_request.bases, schemas=job_request.schemas, tables=job_request.tables,
+            copy_data=job_request.copy_data, parallel=job_request.parallel, workers=job_request.workers,
+            partitions=job_request.partitions, resume=job_request.resume, incremental=job_request.incremental,
+            updated_at_column=job_request.updated_at_column, staged=job_request.staged,
+            verify=job_request.verify, base_dados_ids=job_request.base_dados_ids,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": [
+        {"id": job.id, "script": job.script, "status": job.status, "created_at": job.created_at}
+        for job in job_manager.list()
+    ]}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return get_job_or_404(job_id).to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel", status_code=202)
+def cancel_job(job_id: str):
+    job = get_job_or_404(job_id)
+    job_manager.cancel(job_id)
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Stream the events of a job as Server-Sent Events until it finishes.
+    A reconnecting client resumes after the id sent in `Last-Event-ID`.
+    """
+    job = get_job_or_404(job_id)
+    last_event_id = request.headers.get("last-event-id")
+    start = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+    async def stream():
+        index = start
+        while True:
+            # Lê o status antes dos eventos: o último evento é publicado antes do status final
+            finished = job.finished
+            events = job.events_since(index)
+            for event in events:
+                yield f"id: {index}\nevent: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+                index += 1
+            if finished and not events:
+                break
+            if await request.is_disconnected():
+                break
+            if not events:
+                await asyncio.sleep(0.5)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
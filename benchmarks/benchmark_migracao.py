@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Adicionar o diretório raiz ao sys.path
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_sqlserver import FakeTable, FakeSqlServerConnection, RecordingPostgresConnection
+
+
+def get_postgresql_target(dsn):
+    """Connect to a local PostgreSQL whose cursors time their own load calls."""
+    import psycopg2
+    import psycopg2.extensions
+
+    class TimedCursor(psycopg2.extensions.cursor):
+        def copy_expert(self, sql, file, size=8192):
+            started = time.perf_counter()
+            try:
+                return super().copy_expert(sql, file, size)
+            finally:
+                self.connection.stats['load_seconds'] += time.perf_counter() - started
+
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                self.connection.stats['load_seconds'] += time.perf_counter() - started
+
+    class TimedConnection(psycopg2.extensions.connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.stats = {'load_seconds': 0.0}
+            self.cursor_factory = TimedCursor
+
+    return psycopg2.connect(dsn, connection_factory=TimedConnection)
+
+
+def run_scenario(scenario):
+    """
+    Copy one synthetic table with `copy_table_data` and measure it.
+
+    Runs in its own process (see `main`), so the peak RSS belongs to this
+    scenario only.
+    """
+    from utils.functions_pgsql import copy_table_data, generate_pgsql_table_ddl, normalize_name
+    from utils.functions_metrics import MigrationMetrics
+
+    table = FakeTable(rows=scenario['rows'], text_width=scenario['text_width'], blob_size=scenario['blob_size'],
+                      nul_ratio=scenario['nul_ratio'], keyed=scenario['keyed'])
+    source = FakeSqlServerConnection(table, latency=scenario['latency_ms'] / 1000)
+
+    if scenario['pg_dsn']:
+        target = get_postgresql_target(scenario['pg_dsn'])
+        schema = 'benchmark'
+        with target.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+            cursor.execute(f"DROP TABLE IF EXISTS {schema}.{normalize_name(table.name)};")
+            cursor.execute(generate_pgsql_table_ddl(source, table.name, schema))
+        target.commit()
+    else:
+        target = RecordingPostgresConnection(latency=scenario['latency_ms'] / 1000)
+        schema = 'benchmark'
+
+    source.stats['fetch_seconds'] = 0.0
+    source.stats['bytes'] = 0
+    metrics = MigrationMetrics()
+    started = time.perf_counter()
+    copy_table_data(source, target, table.name, schema, batch_size=scenario['batch_size'],
+                    load_mode=scenario['load_mode'], prefetch=scenario['prefetch'], metrics=metrics)
+    elapsed = time.perf_counter() - started
+    target.close()
+
+    # Fases medidas pelo próprio copiador em cada lote: no caminho de LOB, leitura dos pedaços
+    # e conversão acontecem dentro do COPY e não sairiam do que sobra de fetch e carga
+    seconds = metrics.tables[table.name]['seconds']
+    megabytes = source.stats['bytes'] / (1024 * 1024)
+    return {
+        **{key: value for key, value in scenario.items() if key != 'pg_dsn'},
+        'target': 'postgresql' if scenario['pg_dsn'] else 'recorded',
+        'seconds': elapsed,
+        'rows_per_second': scenario['rows'] / elapsed if elapsed else None,
+        'mb_per_second': megabytes / elapsed if elapsed else None,
+        'source_mb': megabytes,
+        # ru_maxrss é em KB no Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'fetch_seconds': seconds['fetch'],
+        'load_seconds': seconds['load'] + seconds['commit'],
+        'transform_seconds': seconds['transform'],
+    }
+
+
+def print_results(results):
+    print(f"{'Mode':<8} {'Batch':>7} {'Prefetch':>8} {'Rows/s':>10} {'MB/s':>8} {'RSS MB':>8} {'Fetch':>8} {'Transf.':>8} {'Load':>8}")
+    for result in results:
+        print(
+            f"{result['load_mode']:<8} {result['batch_size'] or 'auto':>7} {result['prefetch']:>8} {result['rows_per_second']:>10.0f} "
+            f"{result['mb_per_second']:>8.2f} {result['peak_rss_mb']:>8.1f} {result['fetch_seconds']:>7.2f}s "
+            f"{result['transform_seconds']:>7.2f}s {result['load_seconds']:>7.2f}s"
+        )
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de copy_table_data com origem sintética")
+    parser.add_argument("--rows", type=int, default=100000, help="Linhas da tabela sintética")
+    parser.add_argument("--text-width", type=int, default=200, help="Tamanho da coluna text (0 remove)")
+    parser.add_argument("--blob-size", type=int, default=0, help="Tamanho em bytes da coluna image (0 remove)")
+    parser.add_argument("--nul-ratio", type=float, default=0.01, help="Fração de linhas com caracteres NUL")
+    parser.add_argument("--keyless", action="store_true", help="Tabela sem chave (extração por cursor único)")
+    parser.add_argument("--load-modes", default="copy,insert", help="Estratégias de carga, separadas por vírgula")
+    parser.add_argument("--batch-sizes", default="auto,1000,5000,20000",
+                        help="Tamanhos de lote, separados por vírgula ('auto' para o ajuste automático)")
+    parser.add_argument("--prefetch", default="0,2", help="Lotes lidos à frente da carga, separados por vírgula")
+    parser.add_argument("--latency-ms", type=float, default=0,
+                        help="Latência simulada por lote na origem e na carga registrada")
+    parser.add_argument("--pg-dsn", default=os.environ.get("BENCHMARK_PG_DSN"),
+                        help="DSN de um PostgreSQL local; sem ele a carga é só registrada")
+    parser.add_argument("--output", default="benchmark_results.json", help="Arquivo JSON com os resultados")
+    args = parser.parse_args()
+
+    scenarios = [
+        {
+            'rows': args.rows,
+            'text_width': args.text_width,
+            'blob_size': args.blob_size,
+            'nul_ratio': args.nul_ratio,
+            'keyed': not args.keyless,
+            'load_mode': load_mode,
+            'batch_size': None if batch_size == 'auto' else int(batch_size),
+            'prefetch': int(prefetch),
+            'latency_ms': args.latency_ms,
+            'pg_dsn': args.pg_dsn,
+        }
+        for load_mode in args.load_modes.split(',')
+        for batch_size in args.batch_sizes.split(',')
+        for prefetch in args.prefetch.split(',')
+    ]
+
+    # Um processo novo por cenário para o pico de RSS não vazar entre eles
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for scenario in scenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(run_scenario, scenario).result())
+
+    print_results(results)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_revision': get_git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
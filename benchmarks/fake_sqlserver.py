@@ -0,0 +1,284 @@
+import re
+import time
+import random
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+
+class FakeTable:
+    """
+    Synthetic SQL Server table used as a stand-in for the CREF databases.
+
+    Rows are generated on demand from a fixed seed, so every run reads the
+    same data without holding the table in memory.
+
+    Args:
+        rows: Number of rows.
+        text_width: Length of the wide `text` column (0 to drop it).
+        blob_size: Size in bytes of the `image` column (0 to drop it).
+        nul_ratio: Fraction of rows whose strings carry NUL characters.
+        keyed: Whether the table has a primary key (keyset extraction) or
+            not (single cursor extraction).
+    """
+
+    def __init__(self, name='BENCH01', rows=100000, text_width=200, blob_size=0, nul_ratio=0.01, keyed=True):
+        self.name = name
+        self.rows = rows
+        self.keyed = keyed
+        self.nul_ratio = nul_ratio
+        self.columns = [
+            ('id', 'int', 4, False),
+            ('codigo', 'varchar', 20, True),
+            ('nome', 'nvarchar', 200, True),
+            ('valor', 'money', 8, True),
+            ('ativo', 'bit', 1, True),
+            ('criado', 'datetime', 8, True),
+        ]
+        if text_width:
+            self.columns.append(('descricao', 'text', 16, True))
+        if blob_size:
+            self.columns.append(('foto', 'image', 16, True))
+
+        generator = random.Random(42)
+        self.texts = [
+            ''.join(generator.choice('abcdefghij \t\n\\') for _ in range(text_width))
+            for _ in range(64)
+        ]
+        self.blobs = [generator.randbytes(blob_size) for _ in range(8)] if blob_size else []
+        self.start_date = datetime(2000, 1, 1)
+
+    def row(self, row_id):
+        """Build the row with the given id (1-based)."""
+        nul = '\x00' if (row_id * 7919) % 1000 < self.nul_ratio * 1000 else ''
+        values = [
+            row_id,
+            f"C{row_id:08d}{nul}",
+            f"Profissional {row_id} da Silva{nul}",
+            Decimal(row_id % 100000) / 100,
+            row_id % 2 == 0,
+            self.start_date + timedelta(minutes=row_id),
+        ]
+        if self.texts:
+            values.append(self.texts[row_id % len(self.texts)])
+        if self.blobs:
+            values.append(self.blobs[row_id % len(self.blobs)])
+        return tuple(values)
+
+    def catalog_columns(self):
+        """Rows in the shape of `CATALOG_COLUMNS_QUERY`."""
+        return [
+            (self.name, name, data_type, max_length, 0, 0, nullable, None, position)
+            for position, (name, data_type, max_length, nullable) in enumerate(self.columns, start=1)
+        ]
+
+    def catalog_indexes(self):
+        """Rows in the shape of `CATALOG_INDEXES_QUERY`."""
+        if not self.keyed:
+            return []
+        return [(self.name, f"PK_{self.name}", 1, True, True, False, 'id', False, 1, False, False)]
+
+
+def row_size(row):
+    """Approximate size in bytes of a row as read from the source."""
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif value is not None:
+            size += 8
+    return size
+
+
+class FakeSqlServerConnection:
+    """
+    Minimal pyodbc-compatible connection serving a `FakeTable`.
+
+    Understands only the queries the migration issues: the catalog
+    snapshot queries, keyset pages (`SELECT TOP (n) ... ORDER BY`), a
+    full streaming SELECT, and the large-object pages and `SUBSTRING`
+    chunk reads of `functions_lob`. Time spent producing rows and the bytes read are
+    accumulated in `stats`. `latency` seconds are slept on every fetch to
+    stand in for the network round trip and server time.
+    """
+
+    def __init__(self, table, latency=0.0):
+        self.table = table
+        self.latency = latency
+        self.stats = {'fetch_seconds': 0.0, 'bytes': 0}
+
+    def cursor(self):
+        return FakeSqlServerCursor(self)
+
+    def close(self):
+        pass
+
+
+class FakeSqlServerCursor:
+    TOP_PATTERN = re.compile(r"SELECT TOP \((\d+)\)")
+    INLINE_LOB_PATTERN = re.compile(r"CASE WHEN DATALENGTH\(\[(\w+)\]\) <= (\d+)")
+    SUBSTRING_PATTERN = re.compile(r"SELECT SUBSTRING\(\[(\w+)\], \?, \?\)")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.table = connection.table
+        self.ids = iter(())
+        self.static_rows = None
+        self.inline_lobs = []
+
+    def column_position(self, column_name):
+        return [name for name, _, _, _ in self.table.columns].index(column_name)
+
+    def execute(self, query, *params):
+        self.static_rows = None
+        # Colunas grandes da página: (posição, limite para vir na página)
+        self.inline_lobs = [
+            (self.column_position(name), int(limit)) for name, limit in self.INLINE_LOB_PATTERN.findall(query)
+        ]
+        substring = self.SUBSTRING_PATTERN.search(query)
+        if substring:
+            offset, length, row_id = params
+            started = time.perf_counter()
+            if self.connection.latency:
+                time.sleep(self.connection.latency)
+            value = self.table.row(row_id)[self.column_position(substring.group(1))]
+            chunk = value[offset - 1:offset - 1 + length] if value is not None else None
+            self.static_rows = [(chunk,)]
+            self.connection.stats['bytes'] += len(chunk) if chunk else 0
+            self.connection.stats['fetch_seconds'] += time.perf_counter() - started
+        elif 'DB_NAME()' in query:
+            self.static_rows = [('bench', 'v1', 1)]
+        elif 'sys.default_constraints' in query:
+            self.static_rows = self.table.catalog_columns()
+        elif 'sys.index_columns' in query:
+            self.static_rows = self.table.catalog_indexes()
+        else:
+            top = self.TOP_PATTERN.search(query)
+            if top:
+                # Página do keyset: o último parâmetro é a última chave lida
+                start = params[-1] if 'WHERE' in query and params else 0
+                stop = min(start + int(top.group(1)), self.table.rows)
+                self.ids = iter(range(start + 1, stop + 1))
+            else:
+                self.ids = iter(range(1, self.table.rows + 1))
+        return self
+
+    def _take(self, count):
+        started = time.perf_counter()
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+        rows = []
+        for row_id in self.ids:
+            row = self.table.row(row_id)
+            if self.inline_lobs:
+                # Valores acima do limite ficam fora da página; o DATALENGTH vai no fim
+                values = list(row)
+                lengths = []
+                for position, limit in self.inline_lobs:
+                    value = row[position]
+                    length = len(value.encode('utf-16-le')) if isinstance(value, str) and \
+                        self.table.columns[position][1] == 'ntext' else (len(value) if value is not None else None)
+                    if length is not None and length > limit:
+                        values[position] = None
+                    lengths.append(length)
+                row = tuple(values + lengths)
+            rows.append(row)
+            self.connection.stats['bytes'] += row_size(row)
+            if count is not None and len(rows) >= count:
+                break
+        self.connection.stats['fetch_seconds'] += time.perf_counter() - started
+        return rows
+
+    def fetchone(self):
+        if self.static_rows is not None:
+            return self.static_rows[0] if self.static_rows else None
+        rows = self._take(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        if self.static_rows is not None:
+            return list(self.static_rows)
+        return self._take(None)
+
+    def fetchmany(self, size):
+        return self._take(size)
+
+    def close(self):
+        pass
+
+
+class RecordingPostgresConnection:
+    """
+    Stand-in for a psycopg2 connection when no PostgreSQL is available.
+
+    COPY payloads are read to the end and INSERT statements are kept only
+    as sizes, so the load side costs what the client does, without a
+    server. Time spent loading is accumulated in `stats`, including
+    `latency` seconds slept per statement to stand in for the server.
+    """
+
+    encoding = 'UTF8'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.stats = {'load_seconds': 0.0, 'bytes': 0, 'statements': 0}
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        # Lê em blocos como o psycopg2, sem montar o payload inteiro
+        while True:
+            data = file.read(size)
+            if not data:
+                break
+            self.connection.stats['bytes'] += len(data.encode('utf-8'))
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+        self.connection.stats['statements'] += 1
+        self.connection.stats['load_seconds'] += time.perf_counter() - started
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        self.connection.stats['bytes'] += len(query)
+        if self.connection.latency and query.lstrip().upper().startswith('INSERT'):
+            time.sleep(self.connection.latency)
+        self.connection.stats['statements'] += 1
+        self.connection.stats['load_seconds'] += time.perf_counter() - started
+
+    def mogrify(self, template, args):
+        # Usado por execute_values: adapta os valores como o psycopg2 faria
+        from psycopg2.extensions import adapt
+        quoted = []
+        for value in args:
+            adapted = adapt(value)
+            if hasattr(adapted, 'encoding'):
+                adapted.encoding = 'utf8'
+            quoted.append(adapted.getquoted())
+        return template % tuple(quoted)
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
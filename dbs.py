@@ -1,7 +1,283 @@
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
 import pyodbc
 import psycopg2
 
-def get_freetds_connection(database, instance):
+
+class PooledConnection:
+    """
+    Connection checked out of a `ConnectionPool`.
+
+    Behaves like the driver connection it wraps, except that `close()`
+    gives it back to the pool instead of closing it, so code written for
+    plain connections (`conn.close()` in a `finally`) works unchanged.
+    """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise AttributeError(f"Connection already returned to the pool: {name}")
+        return getattr(self._connection, name)
+
+    def close(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection)
+
+    def discard(self):
+        """Close the underlying connection instead of returning it (e.g. after a network error)."""
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection, discard=True)
+
+
+class ConnectionLimit:
+    """
+    Cap on the connections open at once across several pools, e.g. every
+    database of one SQL Server instance. When the cap is reached, idle
+    connections of the other pools are closed before waiting for one to
+    be given back.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.pools = []
+        self.condition = threading.Condition()
+
+    def reserve(self, deadline=None):
+        """
+        Take a slot for a new connection.
+
+        Raises:
+            TimeoutError: When no slot frees up before `deadline` (time.monotonic()).
+        """
+        while True:
+            with self.condition:
+                if self.size < self.max_size:
+                    self.size += 1
+                    return
+                pools = list(self.pools)
+            # Limite atingido: libera as conexões paradas dos outros pools antes de esperar
+            if any([pool.close_idle() for pool in pools]):
+                continue
+            with self.condition:
+                if self.size < self.max_size:
+                    continue
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No connection slot available (max_size={self.max_size})")
+                self.condition.wait(remaining)
+
+    def release(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of connections to one database.
+
+    Idle connections are reused; one idle for more than `check_after`
+    seconds is checked with `SELECT 1` before being handed out and
+    replaced when the check fails. Connections are rolled back when
+    given back, and dropped when that fails, so a dead socket never
+    returns to the pool. At most `max_size` connections are open at a
+    time, and at most the cap of `limit` across the pools sharing it;
+    `acquire` waits for one to be given back beyond that.
+
+    Args:
+        connect: Callable opening a new driver connection.
+        max_size: Maximum open connections.
+        check_after: Idle seconds after which a connection is checked.
+        limit: `ConnectionLimit` shared with the other pools of the same server.
+    """
+
+    def __init__(self, connect, max_size=32, check_after=30, limit=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.check_after = check_after
+        self.limit = limit
+        self.idle = []
+        self.size = 0
+        self.condition = threading.Condition()
+        if limit is not None:
+            with limit.condition:
+                limit.pools.append(self)
+
+    def _is_alive(self, connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        if self.limit is not None:
+            self.limit.release()
+
+    def acquire(self, timeout=None):
+        """
+        Check out a connection, opening one when none is idle.
+
+        Raises:
+            TimeoutError: When no connection is available within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No connection available after {timeout}s (max_size={self.max_size})")
+                    self.condition.wait(remaining)
+                if self.idle:
+                    connection, idle_since = self.idle.pop()
+                else:
+                    connection, idle_since = None, None
+                    # Reserva a vaga antes de conectar, fora do lock
+                    self.size += 1
+
+            if connection is None:
+                try:
+                    if self.limit is not None:
+                        self.limit.reserve(deadline)
+                    try:
+                        return PooledConnection(self, self.connect())
+                    except Exception:
+                        if self.limit is not None:
+                            self.limit.release()
+                        raise
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+
+            if time.monotonic() - idle_since < self.check_after or self._is_alive(connection):
+                return PooledConnection(self, connection)
+            # Conexão caiu enquanto estava parada: descarta e tenta de novo
+            self.release(connection, discard=True)
+
+    def release(self, connection, discard=False):
+        """Give a connection back, or close it when `discard` or when it can't be reset."""
+        if not discard:
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close(connection)
+        with self.condition:
+            if discard:
+                self.size -= 1
+            else:
+                self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection for a `with` block; it is discarded when the block fails and it is dead."""
+        pooled = self.acquire(timeout)
+        try:
+            yield pooled
+        except Exception:
+            if pooled._connection is not None and not self._is_alive(pooled._connection):
+                pooled.discard()
+            raise
+        finally:
+            pooled.close()
+
+    def close_idle(self, older_than=0):
+        """
+        Close the connections idle for more than `older_than` seconds.
+
+        Returns:
+            int: Connections closed.
+        """
+        cutoff = time.monotonic() - older_than
+        with self.condition:
+            idle = [entry for entry in self.idle if entry[1] <= cutoff]
+            self.idle = [entry for entry in self.idle if entry[1] > cutoff]
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for connection, _ in idle:
+            self._close(connection)
+        return len(idle)
+
+    def close_all(self):
+        """Close the idle connections; the ones checked out are closed when given back."""
+        self.close_idle()
+
+
+# Espera máxima por uma conexão: um pool esgotado falha a tabela em vez de travar a migração
+ACQUIRE_TIMEOUT = 300
+# Conexões paradas há mais que isso são fechadas, para não segurar sessões entre bases
+IDLE_TIMEOUT = 120
+# Máximo de conexões abertas por servidor (instância SQL Server ou host PostgreSQL), somando todas as bases
+SERVER_MAX_CONNECTIONS = 64
+
+_pools = {}
+_limits = {}
+_pools_lock = threading.Lock()
+_reaper = None
+
+
+def _reap_idle_connections():
+    while True:
+        time.sleep(IDLE_TIMEOUT / 2)
+        with _pools_lock:
+            pools = list(_pools.values())
+        for pool in pools:
+            pool.close_idle(IDLE_TIMEOUT)
+
+
+def get_pool(kind, database, instance, connect, max_size=32, server=None):
+    """
+    Get the pool of a database, creating it on first use. Pools of the
+    same `server` share a cap of `SERVER_MAX_CONNECTIONS`.
+    """
+    global _reaper
+    key = (kind, instance, database)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            limit = None
+            if server is not None:
+                limit = _limits.get(server)
+                if limit is None:
+                    limit = _limits[server] = ConnectionLimit(SERVER_MAX_CONNECTIONS)
+            pool = _pools[key] = ConnectionPool(connect, max_size, limit=limit)
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reap_idle_connections, name='pool-reaper', daemon=True)
+            _reaper.start()
+        return pool
+
+
+@atexit.register
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+def open_freetds_connection(database, instance):
     connection_string = (
         f"DSN={instance};"
         f"DATABASE={database};"
@@ -10,7 +286,7 @@ def get_freetds_connection(database, instance):
     )
     return pyodbc.connect(connection_string)
 
-def get_sql_server_connection(database,instance):
+def open_sql_server_connection(database,instance):
     connection_string = f"""
     DRIVER={{ODBC Driver 17 for SQL Server}};
     SERVER=192.168.0.80\\{instance};
@@ -20,10 +296,34 @@ def get_sql_server_connection(database,instance):
     """
     return pyodbc.connect(connection_string)
 
-def get_postgresql_connection(database):
+def open_postgresql_connection(database):
     return psycopg2.connect(
         host="192.168.0.5",
         user="informatica",
         password="yqT7<}Z4K>Nb",
         database=database
-    )
\ No newline at end of file
+    )
+
+# FreeTDS e ODBC chegam à mesma instância: dividem o mesmo limite
+def get_freetds_pool(database, instance, max_size=32):
+    return get_pool('freetds', database, instance, lambda: open_freetds_connection(database, instance), max_size,
+                    server=('sqlserver', instance))
+
+def get_sql_server_pool(database, instance, max_size=32):
+    return get_pool('sqlserver', database, instance, lambda: open_sql_server_connection(database, instance), max_size,
+                    server=('sqlserver', instance))
+
+def get_postgresql_pool(database, max_size=32):
+    return get_pool('postgresql', database, None, lambda: open_postgresql_connection(database), max_size,
+                    server=('postgresql', None))
+
+# As funções abaixo devolvem conexões do pool: close() devolve a conexão
+# ao pool em vez de fechá-la
+def get_freetds_connection(database, instance):
+    return get_freetds_pool(database, instance).acquire(ACQUIRE_TIMEOUT)
+
+def get_sql_server_connection(database,instance):
+    return get_sql_server_pool(database, instance).acquire(ACQUIRE_TIMEOUT)
+
+def get_postgresql_connection(database):
+    return get_postgresql_pool(database).acquire(ACQUIRE_TIMEOUT)
@@ -1,12 +1,22 @@
 import sys
 import os
+import argparse
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'utils')))
 
-from utils.functions_pgsql import get_short_tables, create_pgsql_tables
+from utils.functions_pgsql import get_short_tables, create_pgsql_tables, LARGE_TABLES
+from utils.functions_planner import plan_migration
+from utils.functions_columnar import run_columnar_stage
+from utils.functions_parallel import run_migrations
+from utils.functions_batch import parse_batch_sizes
+from utils.functions_registry import parse_base_dados_ids
+from utils.functions_verify import verify_tables, print_verification_report
 from dbs import get_sql_server_connection, get_postgresql_connection, get_freetds_connection
 
-def migrar(base_origem, base_destino, schema, instancia_origem):
+def migrar(base_origem, base_destino, schema, instancia_origem, copy_data=True, workers=1, partitions=1, resume=False,
+           incremental=False, updated_at_column=None, staged=False, metrics=None, batch_sizes=None,
+           tables=None, verify=False, base_dados_ids=None, dry_run=False,
+           columnar=None, columnar_dir='staging'):
     """
     Migra tabelas de uma base de dados do SQL Server para o PostgreSQL.
 
@@ -14,53 +24,132 @@ def migrar(base_origem, base_destino, schema, instancia_origem):
         base_origem (str): Nome da base de dados no SQL Server.
         base_destino (str): Nome da base de dados no PostgreSQL.
         schema (str): Esquema no PostgreSQL onde as tabelas serão criadas.
+        copy_data (bool): Copia os dados além de criar as tabelas.
+        workers (int): Número de tabelas migradas em paralelo, cada uma com suas próprias conexões.
+        partitions (int): Número de faixas copiadas em paralelo nas tabelas grandes (LARGE_TABLES).
+        resume (bool): Retoma uma migração interrompida a partir dos checkpoints gravados.
+        incremental (bool): Sincroniza só as linhas alteradas desde a última execução.
+        updated_at_column (str): Coluna de data de alteração usada no modo incremental
+            quando a tabela não tem Change Tracking nem rowversion.
+        staged (bool): Carrega em tabela UNLOGGED no schema de staging e troca pela tabela final
+            já com chaves e índices.
+        metrics (MigrationMetrics): Coleta os tempos por tabela e por lote (fetch, transform, load, commit).
+        batch_sizes (dict): Tamanho de lote fixo por tabela; as demais têm o lote ajustado automaticamente.
+        tables (list): Migra só estas tabelas em vez de todas as tabelas curtas da base.
+        verify (bool): Confere contagem e checksum de cada tabela nos dois servidores após a cópia.
+        base_dados_ids (dict): Id de cada base (por base_origem) nas tabelas de controle objetos/campos;
+            as bases sem id não são sincronizadas.
+        dry_run (bool): Só mostra o plano (tabelas, tamanhos e duração estimada), sem migrar nada.
+        columnar (str): Staging em Parquet no disco: 'extract' só lê o SQL Server e grava os arquivos,
+            'load' só carrega os arquivos no PostgreSQL. Sem ele, migra direto.
+        columnar_dir (str): Diretório dos arquivos Parquet (um subdiretório por base).
+
+    Returns:
+        dict: Resumo da migração (linhas, bytes e tabelas com falha).
     """
+    if columnar is not None:
+        # Cada etapa usa um só servidor: extrair na janela da origem e carregar quantas vezes for preciso
+        return run_columnar_stage(columnar, columnar_dir, base_origem, schema,
+                                  lambda: get_freetds_connection(base_origem, instancia_origem),
+                                  lambda: get_postgresql_connection(base_destino),
+                                  tables, copy_data, workers, metrics, batch_sizes)
+
     # Conectar ao SQL Server
     sql_server_conn = get_freetds_connection(base_origem, instancia_origem)
     
     # Conectar ao PostgreSQL
     postgresql_conn = get_postgresql_connection(base_destino)
 
+    def connect():
+        return get_freetds_connection(base_origem, instancia_origem), get_postgresql_connection(base_destino)
+
     try:
         # Obter as tabelas curtas da base de origem
-        short_tables = get_short_tables(sql_server_conn)
+        short_tables = get_short_tables(sql_server_conn) if tables is None else tables
+
+        # Planejar: tamanho e duração estimada de cada tabela, as maiores primeiro
+        plan = plan_migration(sql_server_conn, short_tables, base_origem, schema, workers, copy_data,
+                              LARGE_TABLES, partitions, metrics=metrics)
+        if dry_run:
+            plan.print_plan()
+            return {'rows': 0, 'bytes': 0, 'failures': {}, 'projected': plan.projected_seconds}
 
         # Criar tabelas e migrar dados
-        create_pgsql_tables(sql_server_conn, postgresql_conn, short_tables, schema)
+        summary = create_pgsql_tables(sql_server_conn, postgresql_conn, short_tables, schema, copy_data,
+                                      workers=workers, connect=connect, partitions=partitions,
+                                      resume=resume, incremental=incremental, updated_at_column=updated_at_column,
+                                      staged=staged, metrics=metrics, batch_sizes=batch_sizes,
+                                      base_dados_id=(base_dados_ids or {}).get(base_origem), plan=plan)
+        if verify and copy_data:
+            # Só as faixas divergentes são subdivididas e comparadas de novo
+            summary['verification'] = verify_tables(sql_server_conn, postgresql_conn, short_tables, schema,
+                                                    workers=workers, connect=connect)
+            print_verification_report(summary['verification'])
+        return summary
 
     finally:
         # Fechar conexões
         sql_server_conn.close()
         postgresql_conn.close()
 
+# (base_origem, base_destino, schema, instancia[, copy_data])
+BASES_PARA_MIGRAR = [
+    ("CREF_RJ_SCF", "efcontrol_registro", "rj", "BD01_CREFs"),
+    ("CREF_RS_SCF", "efcontrol_registro", "rs", "BD01_CREFs"),
+    ("CREF_SC_SCF", "efcontrol_registro", "sc", "BD01_CREFs"),
+    ("CREF_SP_SCF", "efcontrol_registro", "sp", "BD01_CREFs"),
+    ("CREF_CE_SCF", "efcontrol_registro", "ce", "BD01_CREFs"),
+    ("CREF_MG_SCF", "efcontrol_registro", "mg", "BD01_CREFs"),
+    ("CREF_DF_SCF", "efcontrol_registro", "df", "BD01_CREFs"),
+    ("CREF_AM_SCF", "efcontrol_registro", "am", "BD01_CREFs"),
+    ("CREF_PR_SCF", "efcontrol_registro", "pr", "BD01_CREFs"),
+    ("CREF_PB_SCF", "efcontrol_registro", "pb", "BD01_CREFs"),
+    ("CREF_MS_SCF", "efcontrol_registro", "ms", "BD01_CREFs"),
+    ("CREF_PE_SCF", "efcontrol_registro", "pe", "BD01_CREFs"),
+    ("CREF_BA_SCF", "efcontrol_registro", "ba", "BD01_CREFs"),
+    ("CREF_GO_SCF", "efcontrol_registro", "go", "BD01_CREFs"),
+    ("CREF_PI_SCF", "efcontrol_registro", "pi", "BD01_CREFs"),
+    ("CREF_RN_SCF", "efcontrol_registro", "rn", "BD01_CREFs"),
+    ("CREF_MT_SCF", "efcontrol_registro", "mt", "BD01_CREFs"),
+    ("CREF_PA_SCF", "efcontrol_registro", "pa", "BD01_CREFs"),
+    ("CREF_AL_SCF", "efcontrol_registro", "al", "BD01_CREFs"),
+    ("CREF_SE_SCF", "efcontrol_registro", "se", "BD01_CREFs"),
+    ("CREF_MA_SCF", "efcontrol_registro", "ma", "BD01_CREFs"),
+    ("CREF_ES_SCF", "efcontrol_registro", "es", "BD01_CREFs"),
+]
+
 # Exemplo de uso
 if __name__ == "__main__":
-    bases_para_migrar = [
-        ("CREF_RJ_SCF", "efcontrol_registro", "rj", "BD01_CREFs"),
-        ("CREF_RS_SCF", "efcontrol_registro", "rs", "BD01_CREFs"),
-        ("CREF_SC_SCF", "efcontrol_registro", "sc", "BD01_CREFs"),
-        ("CREF_SP_SCF", "efcontrol_registro", "sp", "BD01_CREFs"),
-        ("CREF_CE_SCF", "efcontrol_registro", "ce", "BD01_CREFs"),
-        ("CREF_MG_SCF", "efcontrol_registro", "mg", "BD01_CREFs"),
-        ("CREF_DF_SCF", "efcontrol_registro", "df", "BD01_CREFs"),
-        ("CREF_AM_SCF", "efcontrol_registro", "am", "BD01_CREFs"),
-        ("CREF_PR_SCF", "efcontrol_registro", "pr", "BD01_CREFs"),
-        ("CREF_PB_SCF", "efcontrol_registro", "pb", "BD01_CREFs"),
-        ("CREF_MS_SCF", "efcontrol_registro", "ms", "BD01_CREFs"),
-        ("CREF_PE_SCF", "efcontrol_registro", "pe", "BD01_CREFs"),
-        ("CREF_BA_SCF", "efcontrol_registro", "ba", "BD01_CREFs"),
-        ("CREF_GO_SCF", "efcontrol_registro", "go", "BD01_CREFs"),
-        ("CREF_PI_SCF", "efcontrol_registro", "pi", "BD01_CREFs"),
-        ("CREF_RN_SCF", "efcontrol_registro", "rn", "BD01_CREFs"),
-        ("CREF_MT_SCF", "efcontrol_registro", "mt", "BD01_CREFs"),
-        ("CREF_PA_SCF", "efcontrol_registro", "pa", "BD01_CREFs"),
-        ("CREF_AL_SCF", "efcontrol_registro", "al", "BD01_CREFs"),
-        ("CREF_SE_SCF", "efcontrol_registro", "se", "BD01_CREFs"),
-        ("CREF_MA_SCF", "efcontrol_registro", "ma", "BD01_CREFs"),
-        ("CREF_ES_SCF", "efcontrol_registro", "es", "BD01_CREFs"),
-    ]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="Número de tabelas migradas em paralelo")
+    parser.add_argument("--partitions", type=int, default=1, help="Número de faixas por tabela grande copiadas em paralelo")
+    parser.add_argument("--resume", action="store_true", help="Retoma a migração a partir dos checkpoints")
+    parser.add_argument("--incremental", action="store_true", help="Sincroniza só as linhas alteradas")
+    parser.add_argument("--updated-at-column", help="Coluna de data de alteração usada no modo incremental")
+    parser.add_argument("--batch-size", action="append", metavar="TABELA=LINHAS",
+                        help="Tamanho de lote fixo para uma tabela (pode repetir)")
+    parser.add_argument("--staged", action="store_true", help="Carga UNLOGGED em staging com chaves e índices criados no final")
+    parser.add_argument("--verify", action="store_true", help="Confere contagem e checksum das tabelas migradas nos dois servidores")
+    parser.add_argument("--dry-run", action="store_true", help="Só mostra o plano de cada base (tabelas, tamanhos e duração estimada), sem migrar")
+    parser.add_argument("--columnar", choices=["extract", "load"],
+                        help="Staging em Parquet: 'extract' grava as tabelas em disco, 'load' carrega do disco no PostgreSQL")
+    parser.add_argument("--columnar-dir", default="staging", help="Diretório dos arquivos Parquet do --columnar")
+    parser.add_argument("--base-dados-id", action="append", metavar="BASE=ID",
+                        help="Id de uma base nas tabelas de controle objetos/campos (pode repetir)")
+    parser.add_argument("--parallel", type=int, default=1, help="Número de bases migradas em paralelo")
+    parser.add_argument("--max-sqlserver-sessions", type=int, default=8, help="Máximo de sessões simultâneas por instância SQL Server")
+    parser.add_argument("--max-pgsql-sessions", type=int, default=8, help="Máximo de sessões simultâneas por base PostgreSQL")
+    parser.add_argument("--metrics-dir", default="logs", help="Diretório dos logs JSON-lines de métricas por base")
+    parser.add_argument("--metrics-port", type=int, help="Porta do endpoint /metrics no formato Prometheus")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="Endereço do endpoint /metrics (0.0.0.0 expõe em todas as interfaces)")
+    args = parser.parse_args()
 
-    for base_origem, base_destino, schema, instancia in bases_para_migrar:
-        print(f"Migrando dados de {base_origem} para {base_destino}...")
-        migrar(base_origem, base_destino, schema, instancia)
-        print(f"Migração de {base_origem} para {base_destino} concluída.")
\ No newline at end of file
+    run_migrations(migrar, BASES_PARA_MIGRAR, max_parallel=args.parallel,
+                   max_sql_server_sessions=args.max_sqlserver_sessions, max_pgsql_sessions=args.max_pgsql_sessions,
+                   metrics_dir=args.metrics_dir, metrics_port=args.metrics_port, metrics_host=args.metrics_host,
+                   workers=args.workers, partitions=args.partitions, resume=args.resume,
+                   incremental=args.incremental, updated_at_column=args.updated_at_column,
+                   staged=args.staged, batch_sizes=parse_batch_sizes(args.batch_size),
+                   verify=args.verify, base_dados_ids=parse_base_dados_ids(args.base_dados_id), dry_run=args.dry_run,
+                   columnar=args.columnar, columnar_dir=args.columnar_dir)
@@ -0,0 +1,111 @@
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'utils')))
+
+from utils.functions_pgsql import get_short_tables
+from utils.functions_fanout import Sink, SinkConnections, fanout_create_tables, load_manifest
+from utils.functions_parallel import run_migrations, close_connections
+from utils.functions_batch import parse_batch_sizes
+from dbs import get_postgresql_connection, get_freetds_connection
+
+def migrar(base_origem, base_destino, schema, instancia_origem, sinks=None, workers=1, metrics=None,
+           batch_sizes=None, tables=None):
+    """
+    Migra tabelas de uma base do SQL Server para várias bases do PostgreSQL
+    de uma vez, lendo cada tabela da origem uma única vez.
+
+    Args:
+        base_origem (str): Nome da base de dados no SQL Server.
+        base_destino (str): Bases de destino separadas por vírgula (só para logs e limites de sessões).
+        schema (str): Esquema no PostgreSQL onde as tabelas serão criadas, em todos os destinos.
+        sinks (list): Destinos (`Sink`), cada um com seu filtro de tabelas e `copy_data`.
+        workers (int): Número de tabelas migradas em paralelo, cada uma com suas próprias conexões.
+        metrics (MigrationMetrics): Coleta os tempos por tabela e por lote.
+        batch_sizes (dict): Tamanho de lote fixo por tabela; as demais têm o lote ajustado automaticamente.
+        tables (list): Migra só estas tabelas em vez de todas as tabelas curtas da base.
+
+    Returns:
+        dict: Resumo da migração (linhas lidas, bytes e tabelas com falha).
+    """
+    def connect_sinks():
+        connections = SinkConnections()
+        try:
+            for sink in sinks:
+                connections[sink.base_destino] = get_postgresql_connection(sink.base_destino)
+        except Exception:
+            connections.close()
+            raise
+        return connections
+
+    def connect():
+        return get_freetds_connection(base_origem, instancia_origem), connect_sinks()
+
+    sql_server_conn, sink_conns = connect()
+    try:
+        short_tables = get_short_tables(sql_server_conn) if tables is None else tables
+        return fanout_create_tables(sql_server_conn, sink_conns, short_tables, schema, sinks, workers=workers,
+                                    connect=connect, metrics=metrics, batch_sizes=batch_sizes)
+    finally:
+        close_connections((sql_server_conn, sink_conns))
+
+# Mesmas bases de migra_crefs_registro.py e migra_crefs_arrecadacao.py, lidas
+# uma vez só para os dois destinos
+MANIFEST = {
+    # (base_origem, schema, instancia)
+    'bases': [
+        ("CREF_RJ_SCF", "rj", "BD01_CREFs"),
+        ("CREF_RS_SCF", "rs", "BD01_CREFs"),
+        ("CREF_SC_SCF", "sc", "BD01_CREFs"),
+        ("CREF_SP_SCF", "sp", "BD01_CREFs"),
+        ("CREF_CE_SCF", "ce", "BD01_CREFs"),
+        ("CREF_MG_SCF", "mg", "BD01_CREFs"),
+        ("CREF_DF_SCF", "df", "BD01_CREFs"),
+        ("CREF_AM_SCF", "am", "BD01_CREFs"),
+        ("CREF_PR_SCF", "pr", "BD01_CREFs"),
+        ("CREF_PB_SCF", "pb", "BD01_CREFs"),
+        ("CREF_MS_SCF", "ms", "BD01_CREFs"),
+        ("CREF_PE_SCF", "pe", "BD01_CREFs"),
+        ("CREF_BA_SCF", "ba", "BD01_CREFs"),
+        ("CREF_GO_SCF", "go", "BD01_CREFs"),
+        ("CREF_PI_SCF", "pi", "BD01_CREFs"),
+        ("CREF_RN_SCF", "rn", "BD01_CREFs"),
+        ("CREF_MT_SCF", "mt", "BD01_CREFs"),
+        ("CREF_PA_SCF", "pa", "BD01_CREFs"),
+        ("CREF_AL_SCF", "al", "BD01_CREFs"),
+        ("CREF_SE_SCF", "se", "BD01_CREFs"),
+        ("CREF_MA_SCF", "ma", "BD01_CREFs"),
+        ("CREF_ES_SCF", "es", "BD01_CREFs"),
+    ],
+    'sinks': [
+        Sink("efcontrol_registro"),
+        Sink("efcontrol_arrecadacao"),
+    ],
+}
+
+# Exemplo de uso
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", help="Arquivo JSON com 'bases' e 'sinks' (padrão: MANIFEST deste script)")
+    parser.add_argument("--workers", type=int, default=1, help="Número de tabelas migradas em paralelo")
+    parser.add_argument("--batch-size", action="append", metavar="TABELA=LINHAS",
+                        help="Tamanho de lote fixo para uma tabela (pode repetir)")
+    parser.add_argument("--parallel", type=int, default=1, help="Número de bases migradas em paralelo")
+    parser.add_argument("--max-sqlserver-sessions", type=int, default=8, help="Máximo de sessões simultâneas por instância SQL Server")
+    parser.add_argument("--max-pgsql-sessions", type=int, default=8, help="Máximo de sessões simultâneas por base PostgreSQL")
+    parser.add_argument("--metrics-dir", default="logs", help="Diretório dos logs JSON-lines de métricas por base")
+    parser.add_argument("--metrics-port", type=int, help="Porta do endpoint /metrics no formato Prometheus")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="Endereço do endpoint /metrics (0.0.0.0 expõe em todas as interfaces)")
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest) if args.manifest else MANIFEST
+    sinks = manifest['sinks']
+    base_destino = ','.join(sink.base_destino for sink in sinks)
+    bases = [(base_origem, base_destino, schema, instancia) for base_origem, schema, instancia in manifest['bases']]
+
+    run_migrations(migrar, bases, max_parallel=args.parallel,
+                   max_sql_server_sessions=args.max_sqlserver_sessions, max_pgsql_sessions=args.max_pgsql_sessions,
+                   metrics_dir=args.metrics_dir, metrics_port=args.metrics_port, metrics_host=args.metrics_host,
+                   sinks=sinks, workers=args.workers, batch_sizes=parse_batch_sizes(args.batch_size))
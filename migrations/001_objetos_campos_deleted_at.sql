@@ -0,0 +1,7 @@
+-- Exclusão lógica em objetos/campos: tabelas e colunas que sumiram da origem
+-- ficam marcadas em deleted_at (ver utils/functions_registry.py).
+-- Aplicar uma vez em cada base de destino, antes de sincronizar o catálogo.
+BEGIN;
+ALTER TABLE objetos ADD COLUMN IF NOT EXISTS deleted_at timestamp;
+ALTER TABLE campos ADD COLUMN IF NOT EXISTS deleted_at timestamp;
+COMMIT;
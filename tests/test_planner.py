@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.functions_metrics import MigrationMetrics
+from utils.functions_planner import load_table_history
+
+
+def test_load_table_history_reads_metrics_log(tmp_path):
+    log_path = tmp_path / "migracao_CREF_SP_SCF_sp_20261018T120000.jsonl"
+    metrics = MigrationMetrics("CREF_SP_SCF", "sp", str(log_path))
+    metrics.start_table("TAB001")
+    metrics.record_batch("TAB001", 100, 4096, {'fetch': 0.1, 'transform': 0.1, 'load': 0.1})
+    metrics.finish_table("TAB001", 2.5)
+    metrics.start_table("TAB002")
+    metrics.finish_table("TAB002", 1.0, error=RuntimeError("boom"))
+    metrics.close()
+
+    history = load_table_history(str(tmp_path), "CREF_SP_SCF", "sp")
+
+    assert history == {"TAB001": {'rows': 100, 'duration': 2.5}}
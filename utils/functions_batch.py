@@ -0,0 +1,148 @@
+import threading
+
+# Tamanho em bytes dos tipos de tamanho fixo do SQL Server
+FIXED_TYPE_SIZES = {
+    'bigint': 8, 'int': 4, 'smallint': 2, 'tinyint': 1, 'bit': 1,
+    'decimal': 17, 'numeric': 17, 'money': 8, 'smallmoney': 4, 'float': 8, 'real': 4,
+    'date': 3, 'time': 5, 'datetime': 8, 'datetime2': 8, 'smalldatetime': 4, 'datetimeoffset': 10,
+    'uniqueidentifier': 16, 'timestamp': 8, 'rowversion': 8,
+}
+
+# Estimativa por valor dos tipos sem limite (text, ntext, image, xml, (max)),
+# até que os tamanhos reais sejam medidos
+LOB_VALUE_ESTIMATE = 64 * 1024
+
+# Tamanhos de lote permitidos (série 1-2-5): poucos valores distintos de TOP (n)
+# mantêm o cache de planos do SQL Server pequeno
+BATCH_SIZE_STEPS = [
+    step * scale
+    for scale in (10, 100, 1000, 10000, 100000)
+    for step in (1, 2, 5)
+]
+
+
+def estimate_row_size(columns):
+    """
+    Estimate the size in bytes of a row from the column metadata of the
+    catalog, before any row was read.
+    """
+    size = 0
+    for column_info in columns.values():
+        column_type = column_info['type'].lower()
+        length = column_info.get('length')
+        if column_type in FIXED_TYPE_SIZES:
+            size += FIXED_TYPE_SIZES[column_type]
+        elif length is None or length == -1 or length > LOB_VALUE_ESTIMATE:
+            size += LOB_VALUE_ESTIMATE
+        else:
+            # Strings vêm para o Python como str: conta 2 bytes por caractere nos tipos unicode
+            size += length * 2 if column_type in {'nchar', 'nvarchar'} else length
+    return max(size, 1)
+
+
+def sample_row_size(rows, sample=20):
+    """Measure the average size in bytes of the first rows of a batch."""
+    sample_rows = rows[:sample]
+    if not sample_rows:
+        return None
+    size = 0
+    for row in sample_rows:
+        for value in row:
+            if isinstance(value, (str, bytes, bytearray)):
+                size += len(value)
+            elif value is not None:
+                size += 8
+    return max(size / len(sample_rows), 1)
+
+
+def round_batch_size(size, min_size, max_size):
+    """Round down to the nearest of `BATCH_SIZE_STEPS`, within the limits."""
+    size = min(max(size, min_size), max_size)
+    steps = [step for step in BATCH_SIZE_STEPS if min_size <= step <= size]
+    return steps[-1] if steps else int(min_size)
+
+
+class AdaptiveBatchSize:
+    """
+    Batch size of a table copy, tuned while the table is read.
+
+    The first size comes from a byte budget and the row width estimated
+    from the catalog (see `estimate_row_size`). After every batch,
+    `observe` replaces the estimate with the measured row width and
+    moves the size one step toward `target_seconds` per batch, never
+    above the byte budget.
+
+    Sizes are rounded to `BATCH_SIZE_STEPS`. The size is read by the
+    reader thread and updated by the writer, so updates hold a lock.
+
+    Args:
+        columns: Column details as returned by `get_table_columns`.
+        fixed: A fixed batch size (e.g. a per-table override); disables tuning.
+        byte_budget: Maximum bytes per batch.
+        target_seconds: Desired time to fetch and load one batch.
+    """
+
+    def __init__(self, columns, fixed=None, byte_budget=16 * 1024 * 1024, target_seconds=1.0, min_size=100,
+                 max_size=50000):
+        self.fixed = fixed is not None
+        self.byte_budget = byte_budget
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.row_size = estimate_row_size(columns)
+        self.measured = False
+        self.lock = threading.Lock()
+        if self.fixed:
+            self.size = int(fixed)
+        else:
+            self.size = round_batch_size(self.byte_budget // self.row_size, min_size, max_size)
+
+    def observe(self, rows, size, seconds):
+        """
+        Tune the size after a batch.
+
+        Args:
+            rows: The rows of the batch.
+            size: Bytes loaded (COPY payload size), or 0 when unknown.
+            seconds: Time spent fetching and loading the batch.
+        """
+        if self.fixed or not rows:
+            return
+        row_size = size / len(rows) if size else sample_row_size(rows)
+        with self.lock:
+            # Média móvel: um lote com valores atípicos não derruba o tamanho sozinho
+            self.row_size = row_size if not self.measured else 0.7 * self.row_size + 0.3 * row_size
+            self.measured = True
+            new_size = self.size
+            if seconds > 0:
+                # Um passo por lote na direção da latência alvo
+                target = round_batch_size(int(len(rows) * self.target_seconds / seconds), self.min_size, self.max_size)
+                if target > new_size:
+                    new_size = next((step for step in BATCH_SIZE_STEPS if step > new_size), new_size)
+                elif target < new_size:
+                    new_size = max([step for step in BATCH_SIZE_STEPS if step < new_size] or [new_size])
+            # O orçamento de bytes vale sempre, mesmo que precise cair vários passos
+            budget = self.byte_budget / self.row_size
+            self.size = round_batch_size(int(min(new_size, budget)), self.min_size, self.max_size)
+
+    def __int__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"{self.size}{'' if self.fixed else ' (auto)'}"
+
+
+def parse_batch_sizes(values):
+    """
+    Parse `TABLE=ROWS` command line overrides into `{table: rows}`.
+
+    Raises:
+        ValueError: When an entry is not in the `TABLE=ROWS` form.
+    """
+    batch_sizes = {}
+    for value in values or []:
+        table_name, separator, rows = value.partition('=')
+        if not separator or not rows.strip().isdigit():
+            raise ValueError(f"Invalid batch size '{value}', expected TABLE=ROWS")
+        batch_sizes[table_name.strip()] = int(rows)
+    return batch_sizes
@@ -0,0 +1,238 @@
+import os
+import json
+import threading
+
+CATALOG_VERSION_QUERY = """
+SELECT DB_NAME(), CONVERT(varchar(33), MAX(modify_date), 126), COUNT(*)
+FROM sys.objects
+"""
+
+CATALOG_COLUMNS_QUERY = """
+SELECT t.name, c.name, TYPE_NAME(c.system_type_id), c.max_length, c.precision, c.scale,
+       c.is_nullable, dc.definition, c.column_id
+FROM sys.tables t
+JOIN sys.schemas s ON s.schema_id = t.schema_id
+JOIN sys.columns c ON c.object_id = t.object_id
+LEFT JOIN sys.default_constraints dc ON dc.object_id = c.default_object_id
+WHERE s.name = ?
+ORDER BY t.name, c.column_id
+"""
+
+CATALOG_INDEXES_QUERY = """
+SELECT t.name, i.name, i.index_id, i.is_primary_key, i.is_unique, i.has_filter,
+       c.name, c.is_nullable, ic.key_ordinal, ic.is_descending_key, ic.is_included_column
+FROM sys.indexes i
+JOIN sys.tables t ON t.object_id = i.object_id
+JOIN sys.schemas s ON s.schema_id = t.schema_id
+JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+WHERE s.name = ? AND i.type > 0 AND i.is_hypothetical = 0
+ORDER BY t.name, i.index_id, ic.key_ordinal, ic.index_column_id
+"""
+
+TABLE_STATS_QUERY = """
+SELECT t.name,
+       SUM(CASE WHEN ps.index_id IN (0, 1) THEN ps.row_count ELSE 0 END),
+       SUM(ps.reserved_page_count) * 8192,
+       SUM(ps.used_page_count) * 8192
+FROM sys.tables t
+JOIN sys.schemas s ON s.schema_id = t.schema_id
+JOIN sys.dm_db_partition_stats ps ON ps.object_id = t.object_id
+WHERE s.name = ?
+GROUP BY t.name
+"""
+
+# Tamanho em caracteres como o information_schema reporta para os tipos LOB
+LOB_CHARACTER_LENGTHS = {'text': 2147483647, 'ntext': 1073741823, 'image': 2147483647, 'xml': -1}
+CHARACTER_TYPES = {'char', 'varchar', 'binary', 'varbinary'}
+UNICODE_CHARACTER_TYPES = {'nchar', 'nvarchar'}
+NUMERIC_TYPES = {'decimal', 'numeric'}
+
+
+def character_length(data_type, max_length):
+    """Convert `sys.columns.max_length` (bytes) into information_schema's character length."""
+    if data_type in LOB_CHARACTER_LENGTHS:
+        return LOB_CHARACTER_LENGTHS[data_type]
+    if data_type in CHARACTER_TYPES:
+        return max_length
+    if data_type in UNICODE_CHARACTER_TYPES:
+        return max_length if max_length == -1 else max_length // 2
+    return None
+
+
+class CatalogSnapshot:
+    """
+    In-memory copy of the SQL Server catalog of one schema: columns,
+    primary keys and indexes of every table, loaded in a few set-based
+    queries instead of one round trip per table.
+    """
+
+    def __init__(self, database, table_schema, version, tables, indexes):
+        self.database = database
+        self.table_schema = table_schema
+        self.version = version
+        self.tables = tables
+        self.indexes = indexes
+
+    def table_names(self):
+        return sorted(self.tables)
+
+    def columns(self, table_name):
+        """
+        Get column details in ordinal order, in the format returned by
+        `get_table_columns`: `{name: {'type', 'length', 'precision',
+        'scale', 'nullable', 'default', 'ordinal'}}`.
+        """
+        return self.tables.get(table_name, {})
+
+    def table_indexes(self, table_name):
+        """Get the indexes of a table, primary key first."""
+        return self.indexes.get(table_name, [])
+
+    def key_columns(self, table_name):
+        """
+        Get the columns of the primary key, or of the first unique index
+        whose columns are all NOT NULL. Empty when there is no usable key.
+        """
+        for index in self.table_indexes(table_name):
+            if not (index['primary_key'] or index['unique']) or index['filtered']:
+                continue
+            if not any(column['nullable'] for column in index['columns']):
+                return [column['name'] for column in index['columns']]
+        return []
+
+    def to_dict(self):
+        return {
+            'database': self.database,
+            'table_schema': self.table_schema,
+            'version': self.version,
+            'tables': self.tables,
+            'indexes': self.indexes,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['database'], data['table_schema'], data['version'], data['tables'], data['indexes'])
+
+
+def get_catalog_version(sql_server_conn):
+    """Get the database name and a version that changes with any DDL on it."""
+    cursor = sql_server_conn.cursor()
+    cursor.execute(CATALOG_VERSION_QUERY)
+    database, last_modified, object_count = cursor.fetchone()
+    cursor.close()
+    return database, f"{last_modified}/{object_count}"
+
+
+def fetch_catalog_snapshot(sql_server_conn, database, version, table_schema='dbo'):
+    """Read columns and indexes of every table of a schema from `sys.*`."""
+    cursor = sql_server_conn.cursor()
+
+    tables = {}
+    cursor.execute(CATALOG_COLUMNS_QUERY, table_schema)
+    for (table_name, column_name, data_type, max_length, precision, scale,
+         is_nullable, default, column_id) in cursor.fetchall():
+        tables.setdefault(table_name, {})[column_name] = {
+            'type': data_type,
+            'length': character_length(data_type, max_length),
+            'precision': precision if data_type in NUMERIC_TYPES else None,
+            'scale': scale if data_type in NUMERIC_TYPES else None,
+            'nullable': bool(is_nullable),
+            'default': default,
+            'ordinal': column_id,
+        }
+
+    indexes = {}
+    cursor.execute(CATALOG_INDEXES_QUERY, table_schema)
+    current = {}
+    for (table_name, index_name, index_id, is_primary_key, is_unique, has_filter,
+         column_name, is_nullable, key_ordinal, is_descending, is_included) in cursor.fetchall():
+        if current.get('table') != table_name or current.get('index_id') != index_id:
+            current = {
+                'table': table_name,
+                'index_id': index_id,
+                'name': index_name,
+                'primary_key': bool(is_primary_key),
+                'unique': bool(is_unique),
+                'filtered': bool(has_filter),
+                'columns': [],
+                'included': [],
+            }
+            indexes.setdefault(table_name, []).append(current)
+        if is_included:
+            current['included'].append(column_name)
+        else:
+            current['columns'].append({
+                'name': column_name,
+                'nullable': bool(is_nullable),
+                'descending': bool(is_descending),
+            })
+    cursor.close()
+
+    for table_indexes in indexes.values():
+        table_indexes.sort(key=lambda index: (not index['primary_key'], index['index_id']))
+
+    return CatalogSnapshot(database, table_schema, version, tables, indexes)
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def catalog_cache_path(cache_dir, database, table_schema):
+    return os.path.join(cache_dir, f"catalog_{database}_{table_schema}.json")
+
+
+def load_catalog_snapshot(sql_server_conn, table_schema='dbo', cache_dir=None):
+    """
+    Get the catalog snapshot of a database, reusing it while its schema
+    does not change.
+
+    Snapshots are kept in memory per database and version; with
+    `cache_dir` they are also persisted to a local JSON file, so a new
+    process only pays the version query.
+    """
+    database, version = get_catalog_version(sql_server_conn)
+    key = (database, table_schema)
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    snapshot = None
+    path = catalog_cache_path(cache_dir, database, table_schema) if cache_dir else None
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            cached = CatalogSnapshot.from_dict(json.load(f))
+        if cached.version == version:
+            snapshot = cached
+
+    if snapshot is None:
+        snapshot = fetch_catalog_snapshot(sql_server_conn, database, version, table_schema)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot.to_dict(), f, default=str)
+
+    with _snapshots_lock:
+        _snapshots[key] = snapshot
+    return snapshot
+
+
+def fetch_table_stats(sql_server_conn, table_schema='dbo'):
+    """
+    Get the estimated row count and size of every table of a schema from
+    `sys.dm_db_partition_stats`, without scanning any table.
+
+    Returns:
+        dict: `{table: {'rows', 'reserved_bytes', 'used_bytes'}}`
+    """
+    cursor = sql_server_conn.cursor()
+    cursor.execute(TABLE_STATS_QUERY, table_schema)
+    stats = {
+        table_name: {'rows': int(rows or 0), 'reserved_bytes': int(reserved or 0), 'used_bytes': int(used or 0)}
+        for table_name, rows, reserved, used in cursor.fetchall()
+    }
+    cursor.close()
+    return stats
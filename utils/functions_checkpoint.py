@@ -0,0 +1,126 @@
+import json
+import uuid
+from decimal import Decimal
+from datetime import date, datetime, time
+
+CHECKPOINT_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS migracao_checkpoints (
+    base_origem varchar(128) NOT NULL,
+    schema_destino varchar(63) NOT NULL,
+    tabela varchar(128) NOT NULL,
+    faixa text NOT NULL DEFAULT '',
+    status varchar(16) NOT NULL,
+    linhas bigint NOT NULL DEFAULT 0,
+    ultima_chave text,
+    updated_at timestamp NOT NULL DEFAULT now(),
+    PRIMARY KEY (base_origem, schema_destino, tabela, faixa)
+);
+"""
+
+# Tipos de chave que podem ser gravados no checkpoint e lidos de volta
+KEY_TYPES = {
+    'datetime': (datetime, datetime.isoformat, datetime.fromisoformat),
+    'date': (date, date.isoformat, date.fromisoformat),
+    'time': (time, time.isoformat, time.fromisoformat),
+    'decimal': (Decimal, str, Decimal),
+    'uuid': (uuid.UUID, str, uuid.UUID),
+    'bytes': (bytes, bytes.hex, bytes.fromhex),
+}
+
+
+def encode_key(values):
+    """Serialize the last copied key (a list of column values) to JSON."""
+    encoded = []
+    for value in values:
+        for tag, (value_type, to_text, _) in KEY_TYPES.items():
+            # datetime é subclasse de date: a ordem de KEY_TYPES resolve isso
+            if isinstance(value, value_type):
+                encoded.append({tag: to_text(value)})
+                break
+        else:
+            encoded.append(value)
+    return json.dumps(encoded)
+
+
+def decode_key(text):
+    """Read back a key serialized by `encode_key`."""
+    if text is None:
+        return None
+    values = []
+    for value in json.loads(text):
+        if isinstance(value, dict):
+            (tag, raw), = value.items()
+            value = KEY_TYPES[tag][2](raw)
+        values.append(value)
+    return values
+
+
+class CheckpointJournal:
+    """
+    Per-table (and per-range) progress of a migration, kept in the
+    `migracao_checkpoints` control table of the target database.
+
+    Batch checkpoints are written with the cursor that loaded the batch,
+    so they commit in the same transaction as the rows they describe.
+    The journal holds no connection: each worker passes its own.
+
+    States: 'created' (DDL done), 'copying' (with the last committed key
+    when the table has one), 'copied' (every row of the table or range
+    committed) and 'done' (table finished, staged finalize included).
+    """
+
+    def __init__(self, base_origem, schema):
+        self.base_origem = base_origem
+        self.schema = schema
+
+    def ensure_table(self, postgresql_conn):
+        with postgresql_conn.cursor() as cursor:
+            # Evita corrida no CREATE TABLE IF NOT EXISTS entre migrações paralelas
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('migracao_checkpoints'));")
+            cursor.execute(CHECKPOINT_TABLE_DDL)
+        postgresql_conn.commit()
+
+    def reset(self, postgresql_conn):
+        """Forget the progress of this base and schema (full rerun)."""
+        with postgresql_conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM migracao_checkpoints WHERE base_origem = %s AND schema_destino = %s;",
+                (self.base_origem, self.schema)
+            )
+        postgresql_conn.commit()
+
+    def get(self, postgresql_conn, table_name, faixa=''):
+        """
+        Get the checkpoint of a table or range.
+
+        Returns:
+            dict or None: {'status', 'rows', 'last_key'}
+        """
+        with postgresql_conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT status, linhas, ultima_chave FROM migracao_checkpoints
+                WHERE base_origem = %s AND schema_destino = %s AND tabela = %s AND faixa = %s;
+                """,
+                (self.base_origem, self.schema, table_name, faixa)
+            )
+            row = cursor.fetchone()
+        postgresql_conn.commit()
+        if row is None:
+            return None
+        status, rows, last_key = row
+        return {'status': status, 'rows': rows, 'last_key': decode_key(last_key)}
+
+    def save(self, cursor, table_name, status, rows=0, last_key=None, faixa=''):
+        """Record a checkpoint; the caller commits it together with its data."""
+        cursor.execute(
+            """
+            INSERT INTO migracao_checkpoints (base_origem, schema_destino, tabela, faixa, status, linhas, ultima_chave, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT (base_origem, schema_destino, tabela, faixa)
+            DO UPDATE SET status = EXCLUDED.status, linhas = EXCLUDED.linhas,
+                          ultima_chave = EXCLUDED.ultima_chave, updated_at = now();
+            """,
+            (self.base_origem, self.schema, table_name, faixa, status, rows,
+             encode_key(last_key) if last_key is not None else None)
+        )
@@ -0,0 +1,421 @@
+import io
+import os
+import json
+import time
+import shutil
+from contextlib import closing
+from datetime import datetime
+
+from tqdm import tqdm
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional: só o staging em disco precisa dele
+    pa = pq = None
+
+from utils.functions_copy import build_copy_query, compile_copy_encoder, CHARACTER_SQL_SERVER_TYPES
+from utils.functions_extract import iter_table_batches, prefetch_batches
+from utils.functions_parallel import run_with_connection_pool
+from utils.functions_catalog import load_catalog_snapshot
+from utils.functions_metrics import MigrationMetrics
+from utils.functions_batch import AdaptiveBatchSize
+from utils.functions_pgsql import (get_table_columns, build_pgsql_table_ddl, build_drop_table_query, process_column,
+                                   normalize_name, get_short_tables, summarize_table_results, LARGE_TABLES,
+                                   TABLE_BATCH_SIZES)
+
+MANIFEST_FILE = 'manifest.json'
+# Extração em andamento e extração anterior durante a troca: nunca são carregadas
+PENDING_SUFFIX = '.tmp'
+REPLACED_SUFFIX = '.old'
+# Linhas acumuladas por row group do Parquet (ou o teto de bytes, o que vier antes)
+ROW_GROUP_ROWS = 128 * 1024
+ROW_GROUP_BYTES = 64 * 1024 * 1024
+# Linhas por arquivo: tabelas grandes viram vários arquivos, carregados em sequência
+FILE_ROWS = 4 * 1024 * 1024
+# Linhas lidas de volta do Parquet por lote de COPY
+LOAD_BATCH_ROWS = 20000
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Columnar staging requires pyarrow (pip install pyarrow)")
+
+
+def arrow_type(column_name, column_info):
+    """
+    Arrow type of a column, from the PostgreSQL type `process_column`
+    maps it to. Types without an exact Arrow match are kept as text.
+    """
+    pgsql_data_type = process_column(column_name, column_info)['pgsql_data_type']
+    base_type = pgsql_data_type.split('(')[0]
+    if base_type in {'numeric', 'decimal'}:
+        precision = column_info.get('precision')
+        scale = column_info.get('scale') or 0
+        if precision and 0 < precision <= 38:
+            return pa.decimal128(precision, scale)
+        return pa.large_string()
+    arrow_types = {
+        'bigint': pa.int64(),
+        'int': pa.int32(),
+        'smallint': pa.int16(),
+        'boolean': pa.bool_(),
+        'real': pa.float32(),
+        'double precision': pa.float64(),
+        'date': pa.date32(),
+        'timestamp': pa.timestamp('us'),
+        'time': pa.time64('us'),
+        'bytea': pa.large_binary(),
+    }
+    return arrow_types.get(base_type, pa.large_string())
+
+
+def build_arrow_schema(columns):
+    """Arrow schema of a table, one field per column in ordinal order."""
+    require_pyarrow()
+    return pa.schema([
+        pa.field(column_name, arrow_type(column_name, column_info), nullable=column_info.get('nullable', True))
+        for column_name, column_info in columns.items()
+    ])
+
+
+def rows_to_record_batch(schema, columns, rows):
+    """Convert a batch of pyodbc rows into an Arrow record batch of `schema`."""
+    arrays = []
+    for field, column_info, values in zip(schema, columns.values(), zip(*rows)):
+        if pa.types.is_large_string(field.type) and column_info['type'].lower() not in CHARACTER_SQL_SERVER_TYPES:
+            # uniqueidentifier, datetimeoffset, numeric sem precisão...: guardados como texto
+            values = [None if value is None else str(value) for value in values]
+        try:
+            arrays.append(pa.array(values, type=field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Driver devolveu outro tipo (ex.: datas como texto no FreeTDS antigo): converte pelo texto
+            text = pa.array([None if value is None else str(value) for value in values], type=pa.large_string())
+            arrays.append(text.cast(field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ParquetChunkWriter:
+    """
+    Write record batches of a table as compressed Parquet files of at most
+    `file_rows` rows (`part-00000.parquet`, ...), grouping batches into row
+    groups of `row_group_rows` rows or `row_group_bytes` bytes.
+    """
+
+    def __init__(self, table_dir, schema, compression='zstd', row_group_rows=ROW_GROUP_ROWS,
+                 row_group_bytes=ROW_GROUP_BYTES, file_rows=FILE_ROWS):
+        self.table_dir = table_dir
+        self.schema = schema
+        self.compression = compression
+        self.row_group_rows = row_group_rows
+        self.row_group_bytes = row_group_bytes
+        self.file_rows = file_rows
+        self.files = []
+        self.writer = None
+        self.file_row_count = 0
+        self.pending = []
+        self.pending_rows = 0
+        self.pending_bytes = 0
+
+    def _flush(self):
+        if not self.pending:
+            return
+        if self.writer is None:
+            file_name = f"part-{len(self.files):05d}.parquet"
+            self.writer = pq.ParquetWriter(os.path.join(self.table_dir, file_name), self.schema,
+                                           compression=self.compression)
+            self.files.append(file_name)
+        self.writer.write_table(pa.Table.from_batches(self.pending, schema=self.schema),
+                                row_group_size=self.pending_rows)
+        self.file_row_count += self.pending_rows
+        self.pending, self.pending_rows, self.pending_bytes = [], 0, 0
+        if self.file_row_count >= self.file_rows:
+            self.writer.close()
+            self.writer, self.file_row_count = None, 0
+
+    def write(self, record_batch):
+        self.pending.append(record_batch)
+        self.pending_rows += record_batch.num_rows
+        self.pending_bytes += record_batch.nbytes
+        if self.pending_rows >= self.row_group_rows or self.pending_bytes >= self.row_group_bytes:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        return self.files
+
+
+def read_manifest(table_dir):
+    with open(os.path.join(table_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def list_staged_tables(stage_dir):
+    """Tables of a base with a complete extract (a manifest) in `stage_dir`."""
+    if not os.path.isdir(stage_dir):
+        return []
+    return sorted(name for name in os.listdir(stage_dir)
+                  if not name.endswith((PENDING_SUFFIX, REPLACED_SUFFIX))
+                  and os.path.isfile(os.path.join(stage_dir, name, MANIFEST_FILE)))
+
+
+def stage_table(sql_server_conn, table_name, stage_dir, catalog=None, metrics=None, batch_size=None, copy_data=True,
+                compression='zstd', prefetch=2):
+    """
+    Extract a table into compressed Parquet files in `stage_dir/<table>`,
+    with the Arrow types of its PostgreSQL columns (see `arrow_type`).
+
+    The extract is written to `<table>.tmp` and renamed over the previous
+    one only once complete, so a failed extract leaves the last good one
+    in place. The manifest (columns, files and row count) is written
+    last: a table without one was not fully extracted. As in `copy_table_data` without
+    partitions, the data of `LARGE_TABLES` isn't extracted.
+
+    Returns:
+        dict: 'rows' extracted and 'bytes' of Parquet files.
+    """
+    require_pyarrow()
+    metrics = metrics or MigrationMetrics()
+    columns = get_table_columns(sql_server_conn, table_name, catalog)
+    table_dir = os.path.join(stage_dir, table_name)
+    # Sobras de uma extração interrompida
+    pending_dir = table_dir + PENDING_SUFFIX
+    replaced_dir = table_dir + REPLACED_SUFFIX
+    shutil.rmtree(pending_dir, ignore_errors=True)
+    shutil.rmtree(replaced_dir, ignore_errors=True)
+    os.makedirs(pending_dir)
+
+    schema = build_arrow_schema(columns)
+    writer = ParquetChunkWriter(pending_dir, schema, compression)
+    staged_rows = 0
+    try:
+        if copy_data and table_name in LARGE_TABLES:
+            print(f"Skipping data extract for table {table_name}")
+        elif copy_data:
+            if not isinstance(batch_size, AdaptiveBatchSize):
+                batch_size = AdaptiveBatchSize(columns, fixed=batch_size)
+            batches = prefetch_batches(iter_table_batches(sql_server_conn, table_name, list(columns), batch_size,
+                                                          catalog=catalog), prefetch)
+            with closing(batches):
+                for rows, fetch_seconds in batches:
+                    started = time.perf_counter()
+                    record_batch = rows_to_record_batch(schema, columns, rows)
+                    transformed = time.perf_counter()
+                    writer.write(record_batch)
+                    written = time.perf_counter()
+
+                    staged_rows += len(rows)
+                    metrics.record_batch(table_name, len(rows), record_batch.nbytes, {
+                        'fetch': fetch_seconds,
+                        'transform': transformed - started,
+                        'load': written - transformed,
+                    })
+                    batch_size.observe(rows, record_batch.nbytes, fetch_seconds + written - started)
+                    tqdm.write(f"Extracted {staged_rows} rows for {table_name} (batch {len(rows)}, next {batch_size!r})")
+        files = writer.close()
+
+        staged_bytes = sum(os.path.getsize(os.path.join(pending_dir, file_name)) for file_name in files)
+        manifest = {
+            'table': table_name,
+            'columns': columns,
+            'files': files,
+            'rows': staged_rows,
+            'bytes': staged_bytes,
+            'compression': compression,
+            'extracted_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with open(os.path.join(pending_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, default=str, indent=2)
+    except Exception:
+        shutil.rmtree(pending_dir, ignore_errors=True)
+        raise
+
+    # Troca a extração anterior pela nova só agora, com dois renames
+    if os.path.isdir(table_dir):
+        os.rename(table_dir, replaced_dir)
+    os.rename(pending_dir, table_dir)
+    shutil.rmtree(replaced_dir, ignore_errors=True)
+    return {'rows': staged_rows, 'bytes': staged_bytes}
+
+
+def load_staged_table(postgresql_conn, table_name, schema, stage_dir, metrics=None, batch_rows=LOAD_BATCH_ROWS):
+    """
+    Load a table extracted by `stage_table` into PostgreSQL, without
+    touching SQL Server: the table is recreated from the columns in its
+    manifest and its Parquet files are read back memory-mapped and copied.
+    The DROP, CREATE and COPY run in one transaction: a failed load leaves
+    the table as it was, and a load can be replayed any number of times.
+
+    Returns:
+        dict: 'rows' loaded and 'bytes' of COPY payload.
+    """
+    require_pyarrow()
+    metrics = metrics or MigrationMetrics()
+    table_dir = os.path.join(stage_dir, table_name)
+    if not os.path.isfile(os.path.join(table_dir, MANIFEST_FILE)):
+        raise RuntimeError(f"Table {table_name} has no complete extract in {stage_dir}")
+    manifest = read_manifest(table_dir)
+    columns = manifest['columns']
+
+    normalized_table_name = normalize_name(table_name)
+    dest_columns = ', '.join([process_column(col, info)['normalized_name'] for col, info in columns.items()])
+    copy_query = build_copy_query(schema, normalized_table_name, dest_columns)
+    encode_rows = compile_copy_encoder(columns)
+
+    loaded_rows = 0
+    loaded_bytes = 0
+    try:
+        with postgresql_conn.cursor() as cursor:
+            with metrics.phase(table_name, 'ddl'):
+                cursor.execute(build_drop_table_query(schema, table_name))
+                cursor.execute(build_pgsql_table_ddl(table_name, columns, schema))
+            for file_name in manifest['files']:
+                parquet_file = pq.ParquetFile(os.path.join(table_dir, file_name), memory_map=True)
+                batches = parquet_file.iter_batches(batch_size=batch_rows)
+                while True:
+                    started = time.perf_counter()
+                    record_batch = next(batches, None)
+                    if record_batch is None:
+                        break
+                    fetched = time.perf_counter()
+                    rows = list(zip(*[array.to_pylist() for array in record_batch.columns]))
+                    payload = encode_rows(rows)
+                    transformed = time.perf_counter()
+                    cursor.copy_expert(copy_query, io.StringIO(payload))
+                    loaded = time.perf_counter()
+
+                    loaded_rows += len(rows)
+                    loaded_bytes += len(payload)
+                    metrics.record_batch(table_name, len(rows), len(payload), {
+                        'fetch': fetched - started,
+                        'transform': transformed - fetched,
+                        'load': loaded - transformed,
+                    }, file_name)
+        if loaded_rows != manifest['rows']:
+            raise RuntimeError(f"Table {table_name}: loaded {loaded_rows} rows, extract has {manifest['rows']}")
+        with metrics.phase(table_name, 'commit'):
+            postgresql_conn.commit()
+    except Exception:
+        postgresql_conn.rollback()
+        raise
+    print(f"Table {table_name} loaded from {table_dir}: {loaded_rows} rows.")
+    return {'rows': loaded_rows, 'bytes': loaded_bytes}
+
+
+def run_table_tasks(table_names, migrate, conn, connect, workers, metrics, desc):
+    """Run `migrate(conn, table_name)` for every table, timed in `metrics`, on `workers` connections."""
+    def task(worker_conn, table_name):
+        metrics.start_table(table_name)
+        started = time.perf_counter()
+        try:
+            stats = migrate(worker_conn, table_name)
+        except Exception as e:
+            metrics.finish_table(table_name, time.perf_counter() - started, e)
+            raise
+        metrics.finish_table(table_name, time.perf_counter() - started)
+        return stats
+
+    if workers <= 1:
+        results = {}
+        for table_name in tqdm(table_names, desc=desc, unit="table"):
+            results[table_name] = task(conn, table_name)
+        return summarize_table_results(results, {})
+
+    if connect is None:
+        raise ValueError("A connection factory is required when workers > 1")
+
+    def pool_task(worker_conn, _, table_name):
+        return task(worker_conn, table_name)
+
+    # Cada etapa usa um só servidor: o par de conexões do pool leva só uma
+    results, failures = run_with_connection_pool(table_names, pool_task, lambda: (connect(), None), workers,
+                                                 desc=desc, unit="table")
+    return summarize_table_results(results, failures)
+
+
+def stage_tables(sql_server_conn, table_names, stage_dir, workers=1, connect=None, catalog=None, metrics=None,
+                 batch_sizes=None, copy_data=True):
+    """
+    Extract tables from SQL Server into Parquet files in `stage_dir` (see
+    `stage_table`), without a PostgreSQL connection.
+
+    Args:
+        workers: Tables extracted concurrently; with more than one,
+            `connect` must return a new SQL Server connection.
+        batch_sizes: Fixed batch size per table, on top of `TABLE_BATCH_SIZES`.
+
+    Returns:
+        dict: Summary with extracted 'rows', Parquet 'bytes' and 'failures'.
+    """
+    require_pyarrow()
+    metrics = metrics or MigrationMetrics()
+    if catalog is None:
+        with metrics.phase(None, 'catalog'):
+            catalog = load_catalog_snapshot(sql_server_conn)
+    os.makedirs(stage_dir, exist_ok=True)
+    table_batch_sizes = {**TABLE_BATCH_SIZES, **(batch_sizes or {})}
+
+    def migrate(worker_sql_server_conn, table_name):
+        return stage_table(worker_sql_server_conn, table_name, stage_dir, catalog, metrics,
+                           table_batch_sizes.get(table_name), copy_data)
+
+    return run_table_tasks(table_names, migrate, sql_server_conn, connect, workers, metrics, "Extracting tables")
+
+
+def load_staged_tables(postgresql_conn, schema, stage_dir, table_names=None, workers=1, connect=None, metrics=None):
+    """
+    Load tables extracted by `stage_tables` into PostgreSQL (see
+    `load_staged_table`), without a SQL Server connection.
+
+    Args:
+        table_names: Tables to load; by default every table with a
+            complete extract in `stage_dir`.
+        workers: Tables loaded concurrently; with more than one, `connect`
+            must return a new PostgreSQL connection.
+
+    Returns:
+        dict: Summary with loaded 'rows' and 'bytes', and 'failures'.
+    """
+    require_pyarrow()
+    metrics = metrics or MigrationMetrics()
+    if table_names is None:
+        table_names = list_staged_tables(stage_dir)
+    with postgresql_conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+    postgresql_conn.commit()
+
+    def migrate(worker_postgresql_conn, table_name):
+        return load_staged_table(worker_postgresql_conn, table_name, schema, stage_dir, metrics)
+
+    return run_table_tasks(table_names, migrate, postgresql_conn, connect, workers, metrics, "Loading tables")
+
+
+def run_columnar_stage(stage, stage_dir, base_origem, schema, connect_sql_server, connect_postgresql, tables=None,
+                       copy_data=True, workers=1, metrics=None, batch_sizes=None):
+    """
+    Run one step of a migration staged on disk: 'extract' the tables of
+    a base to `stage_dir/<base_origem>` using only SQL Server, or 'load'
+    them from there using only PostgreSQL.
+
+    Returns:
+        dict: Summary of the step, as `create_pgsql_tables`.
+    """
+    base_dir = os.path.join(stage_dir, base_origem)
+    if stage == 'extract':
+        conn = connect_sql_server()
+        try:
+            table_names = get_short_tables(conn) if tables is None else tables
+            return stage_tables(conn, table_names, base_dir, workers, connect_sql_server, metrics=metrics,
+                                batch_sizes=batch_sizes, copy_data=copy_data)
+        finally:
+            conn.close()
+    if stage == 'load':
+        conn = connect_postgresql()
+        try:
+            return load_staged_tables(conn, schema, base_dir, tables, workers, connect_postgresql, metrics)
+        finally:
+            conn.close()
+    raise ValueError(f"Unknown columnar stage: {stage!r} (expected 'extract' or 'load')")
@@ -0,0 +1,228 @@
+import io
+import uuid
+from operator import methodcaller
+from decimal import Decimal
+from datetime import date, datetime, time
+
+
+COPY_NULL = '\\N'
+
+
+def encode_copy_text(value):
+    """Escape a string for the PostgreSQL COPY text format."""
+    # Caminho rápido: a maioria dos valores não tem nada para escapar.
+    # O NUL é removido, pois o PostgreSQL não aceita '\x00' em campos texto.
+    # replace encadeado é bem mais rápido que str.translate com dicionário.
+    if '\\' in value or '\t' in value or '\n' in value or '\r' in value or '\x00' in value:
+        return (value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+                .replace('\r', '\\r').replace('\x00', ''))
+    return value
+
+
+def encode_copy_bytea(value):
+    """Encode binary data as a bytea hex literal for the COPY text format."""
+    # '\\x' vira '\x' depois do unescape do COPY, que é o formato hex do bytea
+    return '\\\\x' + bytes(value).hex()
+
+
+def encode_copy_bool(value):
+    return 't' if value else 'f'
+
+
+def encode_copy_datetime(value):
+    return value.isoformat(sep=' ')
+
+
+def encode_copy_isoformat(value):
+    return value.isoformat()
+
+
+def encode_copy_str(value):
+    return str(value)
+
+
+COPY_ENCODERS = {
+    str: encode_copy_text,
+    bytes: encode_copy_bytea,
+    bytearray: encode_copy_bytea,
+    memoryview: encode_copy_bytea,
+    bool: encode_copy_bool,
+    int: encode_copy_str,
+    float: repr,
+    Decimal: encode_copy_str,
+    datetime: encode_copy_datetime,
+    date: encode_copy_isoformat,
+    time: encode_copy_isoformat,
+    uuid.UUID: encode_copy_str,
+}
+
+
+def encode_copy_value(value):
+    """Encode a single Python value for the PostgreSQL COPY text format."""
+    if value is None:
+        return COPY_NULL
+    encoder = COPY_ENCODERS.get(type(value))
+    if encoder is None:
+        return encode_copy_text(str(value))
+    return encoder(value)
+
+
+def encode_copy_rows(rows):
+    """Encode a batch of rows as a single COPY text payload."""
+    return ''.join(
+        '\t'.join([encode_copy_value(value) for value in row]) + '\n'
+        for row in rows
+    )
+
+
+def strip_nul(value):
+    return value.replace('\x00', '')
+
+
+# Encoder do COPY por tipo do SQL Server, escolhido uma vez por coluna.
+# Sempre que possível são funções em C (str, methodcaller) para evitar
+# uma chamada Python por célula.
+SQL_SERVER_COPY_ENCODERS = {
+    'bigint': str,
+    'int': str,
+    'smallint': str,
+    'tinyint': str,
+    'bit': {True: 't', False: 'f'}.__getitem__,
+    'decimal': str,
+    'numeric': str,
+    'money': str,
+    'smallmoney': str,
+    'float': repr,
+    'real': repr,
+    'date': methodcaller('isoformat'),
+    'time': methodcaller('isoformat'),
+    'datetime': methodcaller('isoformat', ' '),
+    'datetime2': methodcaller('isoformat', ' '),
+    'smalldatetime': methodcaller('isoformat', ' '),
+    'char': encode_copy_text,
+    'varchar': encode_copy_text,
+    'nchar': encode_copy_text,
+    'nvarchar': encode_copy_text,
+    'text': encode_copy_text,
+    'ntext': encode_copy_text,
+    'xml': encode_copy_text,
+    'uniqueidentifier': str,
+    'binary': encode_copy_bytea,
+    'varbinary': encode_copy_bytea,
+    'image': encode_copy_bytea,
+    'timestamp': encode_copy_bytea,
+}
+
+CHARACTER_SQL_SERVER_TYPES = {'char', 'varchar', 'nchar', 'nvarchar', 'text', 'ntext', 'xml'}
+
+
+def compile_copy_encoder(columns):
+    """
+    Compile the COPY encoder of a table from its column metadata.
+
+    The encoder for each column is picked once from its SQL Server type,
+    and batches are encoded column by column, so no per-cell type
+    dispatch or per-row list is needed. NOT NULL columns also skip the
+    NULL check. Types without a dedicated encoder, and columns whose
+    values turn out not to match their type (e.g. dates returned as
+    strings by older FreeTDS protocol versions), use `encode_copy_value`.
+
+    Args:
+        columns: Column details as returned by `get_table_columns`.
+
+    Returns:
+        callable: Function encoding a batch of rows into a COPY payload.
+    """
+    plan = []
+    for column_info in columns.values():
+        encoder = SQL_SERVER_COPY_ENCODERS.get(column_info['type'].lower())
+        if encoder is None:
+            plan.append((encode_copy_value, False))
+        else:
+            plan.append((encoder, column_info.get('nullable', True)))
+
+    def encode_column(position, values):
+        encoder, nullable = plan[position]
+        try:
+            if nullable:
+                return [COPY_NULL if value is None else encoder(value) for value in values]
+            return list(map(encoder, values))
+        except (AttributeError, TypeError, KeyError):
+            # O driver devolveu outro tipo: passa a usar o encoder genérico nessa coluna
+            plan[position] = (encode_copy_value, False)
+            return list(map(encode_copy_value, values))
+
+    def encode_rows(rows):
+        if not rows:
+            return ''
+        encoded_columns = [encode_column(position, values) for position, values in enumerate(zip(*rows))]
+        return '\n'.join(map('\t'.join, zip(*encoded_columns))) + '\n'
+
+    return encode_rows
+
+
+def compile_row_transform(columns):
+    """
+    Compile the row cleanup used by the INSERT fallback: NUL characters are
+    stripped only from character columns, every other column is passed
+    through to psycopg2 untouched.
+
+    Returns:
+        callable: Function transforming a batch of rows into a list of tuples.
+    """
+    character_positions = {
+        position for position, column_info in enumerate(columns.values())
+        if column_info['type'].lower() in CHARACTER_SQL_SERVER_TYPES
+    }
+
+    def transform_rows(rows):
+        if not rows or not character_positions:
+            return rows
+        transformed_columns = []
+        for position, values in enumerate(zip(*rows)):
+            if position in character_positions:
+                values = [None if value is None else strip_nul(value) for value in values]
+            transformed_columns.append(values)
+        return list(zip(*transformed_columns))
+
+    return transform_rows
+
+
+class CopyBuffer:
+    """
+    Reusable in-memory buffer that feeds `cursor.copy_expert`.
+
+    The same StringIO is rewound and truncated on every batch, so the
+    loader does not allocate a new file object per batch.
+
+    Args:
+        encode_rows: Batch encoder, e.g. from `compile_copy_encoder`;
+            defaults to the generic `encode_copy_rows`.
+    """
+
+    def __init__(self, encode_rows=None):
+        self.buffer = io.StringIO()
+        self.encode_rows = encode_rows or encode_copy_rows
+
+    def write(self, rows):
+        """Encode `rows` into the buffer, replacing the previous batch. Returns the payload size."""
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(self.encode_rows(rows))
+        return self.buffer.tell()
+
+    def send(self, cursor, copy_query):
+        """Stream the encoded batch with COPY FROM STDIN."""
+        self.buffer.seek(0)
+        cursor.copy_expert(copy_query, self.buffer)
+
+    def load(self, cursor, copy_query, rows):
+        """Encode `rows` into the buffer and stream it with COPY FROM STDIN."""
+        size = self.write(rows)
+        self.send(cursor, copy_query)
+        return size
+
+
+def build_copy_query(schema, table_name, dest_columns):
+    """Build the `COPY ... FROM STDIN` statement for a target table."""
+    return f"COPY {schema}.{table_name} ({dest_columns}) FROM STDIN WITH (FORMAT text)"
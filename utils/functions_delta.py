@@ -0,0 +1,215 @@
+from utils.functions_copy import CopyBuffer
+from utils.functions_checkpoint import encode_key, decode_key
+from utils.functions_extract import iter_cursor_batches
+
+DELTA_STATE_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS migracao_delta (
+    base_origem varchar(128) NOT NULL,
+    schema_destino varchar(63) NOT NULL,
+    tabela varchar(128) NOT NULL,
+    modo varchar(20) NOT NULL,
+    coluna varchar(128),
+    marca text NOT NULL,
+    updated_at timestamp NOT NULL DEFAULT now(),
+    PRIMARY KEY (base_origem, schema_destino, tabela)
+);
+"""
+
+
+class DeltaStateStore:
+    """
+    High-water mark of the last incremental sync of each table, kept in
+    the `migracao_delta` control table of the target database.
+
+    The mark is saved with the cursor that applied the changes, so both
+    commit together.
+    """
+
+    def __init__(self, base_origem, schema):
+        self.base_origem = base_origem
+        self.schema = schema
+
+    def ensure_table(self, postgresql_conn):
+        with postgresql_conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('migracao_delta'));")
+            cursor.execute(DELTA_STATE_TABLE_DDL)
+        postgresql_conn.commit()
+
+    def get(self, postgresql_conn, table_name):
+        """
+        Returns:
+            dict or None: {'mode', 'column', 'watermark'}
+        """
+        with postgresql_conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT modo, coluna, marca FROM migracao_delta
+                WHERE base_origem = %s AND schema_destino = %s AND tabela = %s;
+                """,
+                (self.base_origem, self.schema, table_name)
+            )
+            row = cursor.fetchone()
+        postgresql_conn.commit()
+        if row is None:
+            return None
+        mode, column, watermark = row
+        return {'mode': mode, 'column': column, 'watermark': decode_key(watermark)[0]}
+
+    def save(self, cursor, table_name, mode, column, watermark):
+        cursor.execute(
+            """
+            INSERT INTO migracao_delta (base_origem, schema_destino, tabela, modo, coluna, marca, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT (base_origem, schema_destino, tabela)
+            DO UPDATE SET modo = EXCLUDED.modo, coluna = EXCLUDED.coluna,
+                          marca = EXCLUDED.marca, updated_at = now();
+            """,
+            (self.base_origem, self.schema, table_name, mode, column, encode_key([watermark]))
+        )
+
+
+def detect_delta_mode(sql_server_conn, table_name, columns, updated_at_column=None):
+    """
+    Choose how changes of a table are detected, in order of preference:
+    SQL Server Change Tracking (also sees deletes), a rowversion column,
+    or the configured "updated at" column.
+
+    Returns:
+        tuple: (mode, column), or (None, None) when the table can only be
+        fully reloaded.
+    """
+    cursor = sql_server_conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID(?)", table_name)
+    change_tracking = cursor.fetchone()[0] > 0
+    cursor.close()
+    if change_tracking:
+        return 'change_tracking', None
+
+    for column_name, column_info in columns.items():
+        if column_info['type'].lower() in {'timestamp', 'rowversion'}:
+            return 'rowversion', column_name
+
+    if updated_at_column and updated_at_column in columns:
+        return 'updated_at', updated_at_column
+    return None, None
+
+
+def get_delta_watermark(sql_server_conn, table_name, mode, column):
+    """
+    Read the current high-water mark of a table, taken before copying so
+    that changes made during the copy are picked up by the next sync.
+    """
+    queries = {
+        'change_tracking': "SELECT CHANGE_TRACKING_CURRENT_VERSION()",
+        # Transações ainda abertas têm rowversion >= MIN_ACTIVE_ROWVERSION
+        'rowversion': "SELECT CONVERT(varchar(18), MIN_ACTIVE_ROWVERSION(), 1)",
+        'updated_at': f"SELECT MAX([{column}]) FROM [{table_name}]",
+    }
+    cursor = sql_server_conn.cursor()
+    cursor.execute(queries[mode])
+    watermark = cursor.fetchone()[0]
+    cursor.close()
+    return watermark
+
+
+def is_change_tracking_valid(sql_server_conn, table_name, since):
+    """Check that Change Tracking still retains every change after `since`."""
+    cursor = sql_server_conn.cursor()
+    cursor.execute("SELECT CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(?))", table_name)
+    min_valid_version = cursor.fetchone()[0]
+    cursor.close()
+    return min_valid_version is not None and since >= min_valid_version
+
+
+def iter_delta_batches(sql_server_conn, table_name, source_columns, key_columns, mode, column, since, until,
+                       batch_size=1000):
+    """
+    Stream the rows changed between two marks.
+
+    Yields:
+        tuple: (rows to upsert, keys to delete) for each batch.
+    """
+    select_list = ', '.join([f"t.[{col}]" for col in source_columns])
+
+    if mode == 'change_tracking':
+        ct_keys = ', '.join([f"ct.[{col}]" for col in key_columns])
+        join = ' AND '.join([f"t.[{col}] = ct.[{col}]" for col in key_columns])
+        query = f"""
+        SELECT ct.SYS_CHANGE_OPERATION, {ct_keys}, {select_list}
+        FROM CHANGETABLE(CHANGES [{table_name}], ?) AS ct
+        LEFT JOIN [{table_name}] AS t ON {join}
+        """
+        key_count = len(key_columns)
+        first_key = 1 + key_count + list(source_columns).index(key_columns[0])
+        for rows in iter_cursor_batches(sql_server_conn, query, batch_size, (since,)):
+            upserts = []
+            deletes = []
+            for row in rows:
+                # A linha pode ter sido apagada depois da mudança registrada
+                if row[0] == 'D' or row[first_key] is None:
+                    deletes.append(row[1:1 + key_count])
+                else:
+                    upserts.append(row[1 + key_count:])
+            yield upserts, deletes
+        return
+
+    if mode == 'rowversion':
+        query = f"""
+        SELECT {select_list} FROM [{table_name}] AS t
+        WHERE t.[{column}] >= CONVERT(binary(8), ?, 1) AND t.[{column}] < CONVERT(binary(8), ?, 1)
+        """
+        params = (since, until)
+    elif until is None:
+        # Tabela vazia: nada mudou
+        return
+    elif since is None:
+        query = f"SELECT {select_list} FROM [{table_name}] AS t WHERE t.[{column}] <= ?"
+        params = (until,)
+    else:
+        query = f"SELECT {select_list} FROM [{table_name}] AS t WHERE t.[{column}] > ? AND t.[{column}] <= ?"
+        params = (since, until)
+
+    for rows in iter_cursor_batches(sql_server_conn, query, batch_size, params):
+        yield rows, []
+
+
+def apply_delta(postgresql_conn, schema, table_name, dest_columns, dest_key_columns, batches):
+    """
+    Apply changed rows to a target table through staging tables.
+
+    Changed rows and deleted keys are COPYed into temporary tables, then
+    applied with one DELETE ... USING and one INSERT ... SELECT, so no
+    unique constraint is needed on the target. Nothing is committed here:
+    the caller commits together with the new high-water mark.
+
+    Args:
+        table_name: Normalized target table name.
+        dest_columns: Normalized (quoted) target columns, in source order.
+        dest_key_columns: Normalized (quoted) key columns.
+
+    Returns:
+        dict: Number of 'upserts' and 'deletes' applied.
+    """
+    target = f"{schema}.{table_name}"
+    column_list = ', '.join(dest_columns)
+    key_list = ', '.join(dest_key_columns)
+    match = ' AND '.join([f"t.{col} = s.{col}" for col in dest_key_columns])
+    copy_buffer = CopyBuffer()
+
+    upserts = 0
+    deletes = 0
+    with postgresql_conn.cursor() as cursor:
+        cursor.execute(f"CREATE TEMP TABLE delta_upserts ON COMMIT DROP AS SELECT {column_list} FROM {target} WITH NO DATA;")
+        cursor.execute(f"CREATE TEMP TABLE delta_deletes ON COMMIT DROP AS SELECT {key_list} FROM {target} WITH NO DATA;")
+        for upsert_rows, delete_keys in batches:
+            if upsert_rows:
+                copy_buffer.load(cursor, f"COPY delta_upserts ({column_list}) FROM STDIN WITH (FORMAT text)", upsert_rows)
+                upserts += len(upsert_rows)
+            if delete_keys:
+                copy_buffer.load(cursor, f"COPY delta_deletes ({key_list}) FROM STDIN WITH (FORMAT text)", delete_keys)
+                deletes += len(delete_keys)
+
+        cursor.execute(f"DELETE FROM {target} AS t USING delta_deletes AS s WHERE {match};")
+        cursor.execute(f"DELETE FROM {target} AS t USING delta_upserts AS s WHERE {match};")
+        cursor.execute(f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM delta_upserts;")
+    return {'upserts': upserts, 'deletes': deletes}
@@ -0,0 +1,369 @@
+import time
+import threading
+from queue import Queue, Full
+
+from utils.functions_catalog import load_catalog_snapshot
+
+
+def get_table_key_columns(sql_server_conn, table_name, catalog=None):
+    """
+    Get the columns of the primary key, or of the first unique index whose
+    columns are all NOT NULL, for a SQL Server table.
+
+    Returns:
+        list: Key column names in index order, or an empty list when the
+        table has no usable key.
+    """
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    return catalog.key_columns(table_name)
+
+
+# pyodbc envia datetime do Python como datetime2(7). A partir do nível de compatibilidade 130
+# o SQL Server compara uma coluna datetime com ele exatamente, e um valor .xx3/.xx7 (1/300 s)
+# fica maior que o próprio valor lido de volta: o parâmetro é convertido para o tipo da coluna
+CAST_PARAMETER_TYPES = {'datetime', 'smalldatetime'}
+
+
+def key_placeholder(column_type=None):
+    """Parameter marker for a value compared with a column of `column_type`."""
+    column_type = (column_type or '').lower()
+    return f"CAST(? AS {column_type})" if column_type in CAST_PARAMETER_TYPES else '?'
+
+
+def build_keyset_predicate(key_columns, key_types=None):
+    """
+    Build a row-value comparison `(k1, k2, ...) > (?, ?, ...)` for SQL Server,
+    which does not support tuple comparison natively.
+
+    Args:
+        key_types: SQL Server type of each key column, `{column: type}`,
+            to cast the parameters of datetime keys (see `key_placeholder`).
+
+    Returns:
+        tuple: (predicate SQL, function that expands the last key into
+        the parameter list expected by the predicate).
+    """
+    key_types = key_types or {}
+    placeholders = {column: key_placeholder(key_types.get(column)) for column in key_columns}
+    clauses = []
+    for position in range(len(key_columns)):
+        terms = [f"[{column}] = {placeholders[column]}" for column in key_columns[:position]]
+        terms.append(f"[{key_columns[position]}] > {placeholders[key_columns[position]]}")
+        clauses.append(f"({' AND '.join(terms)})")
+    predicate = ' OR '.join(clauses)
+
+    def expand(last_key):
+        params = []
+        for position in range(len(last_key)):
+            params.extend(last_key[:position + 1])
+        return params
+
+    return predicate, expand
+
+
+def iter_keyset_batches(sql_server_conn, table_name, source_columns, key_columns, batch_size=1000,
+                        where=None, where_params=(), start_after=None, select_list=None, key_types=None):
+    """
+    Stream a table in key order using keyset pagination.
+
+    Each page seeks directly past the last key read (`WHERE pk > last
+    ORDER BY pk`), so every page costs the same regardless of how deep
+    into the table it is.
+
+    Args:
+        source_columns: Names of the columns being selected, in order.
+        key_columns: Key columns as returned by `get_table_key_columns`.
+        batch_size: Rows per page, or an `AdaptiveBatchSize` read again
+            before every page.
+        where: Optional extra predicate (e.g. a key range) with `?`
+            placeholders bound from `where_params`.
+        start_after: Key to resume after (e.g. from a checkpoint).
+        select_list: SQL expressions selected instead of the plain
+            columns; they must start with `source_columns`, in order.
+        key_types: SQL Server type of each key column (see `build_keyset_predicate`).
+
+    Yields:
+        list: Rows of each page.
+    """
+    cursor = sql_server_conn.cursor()
+    select_list = ', '.join(select_list or [f"[{col}]" for col in source_columns])
+    order_by = ', '.join([f"[{col}]" for col in key_columns])
+    key_positions = [list(source_columns).index(col) for col in key_columns]
+    predicate, expand = build_keyset_predicate(key_columns, key_types)
+
+    if where:
+        first_page_filter = f" WHERE ({where})"
+        next_page_filter = f" WHERE ({where}) AND ({predicate})"
+    else:
+        first_page_filter = ""
+        next_page_filter = f" WHERE {predicate}"
+
+    def page_query(page_filter, page_size):
+        return f"SELECT TOP ({page_size}) {select_list} FROM [{table_name}]{page_filter} ORDER BY {order_by}"
+
+    try:
+        page_size = int(batch_size)
+        if start_after is None:
+            cursor.execute(page_query(first_page_filter, page_size), *where_params)
+        else:
+            cursor.execute(page_query(next_page_filter, page_size), *where_params, *expand(list(start_after)))
+        while True:
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            yield rows
+            if len(rows) < page_size:
+                break
+            last_row = rows[-1]
+            last_key = [last_row[position] for position in key_positions]
+            page_size = int(batch_size)
+            cursor.execute(page_query(next_page_filter, page_size), *where_params, *expand(last_key))
+    finally:
+        cursor.close()
+
+
+def iter_cursor_batches(sql_server_conn, select_query, batch_size=1000, params=()):
+    """
+    Stream a query through a single forward-only cursor with `fetchmany`.
+
+    Used for tables without a usable key: the query runs once and the
+    driver hands rows over as they arrive, so memory stays at one batch.
+    """
+    cursor = sql_server_conn.cursor()
+    try:
+        cursor.execute(select_query, *params)
+        while True:
+            rows = cursor.fetchmany(int(batch_size))
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def iter_table_batches(sql_server_conn, table_name, source_columns, batch_size=1000, key_range=None, catalog=None,
+                       start_after=None, select_list=None):
+    """
+    Pick the extract strategy for a table: keyset pagination when it has a
+    primary key or unique index, a single streaming cursor otherwise.
+
+    Args:
+        batch_size: Rows per batch, or an `AdaptiveBatchSize`.
+        key_range: Optional `KeyRange` restricting the rows read.
+        start_after: Key to resume after; only used with keyset pagination.
+        select_list: SQL expressions selected instead of the plain columns.
+    """
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    column_types = {column: info['type'] for column, info in catalog.columns(table_name).items()}
+    where, where_params = (None, ())
+    if key_range is not None:
+        where, where_params = key_range.predicate(f"[{key_range.column}]",
+                                                  key_placeholder(column_types.get(key_range.column)))
+
+    key_columns = get_table_key_columns(sql_server_conn, table_name, catalog)
+    if key_columns:
+        return iter_keyset_batches(sql_server_conn, table_name, source_columns, key_columns, batch_size,
+                                   where, where_params, start_after, select_list, column_types)
+
+    select_list = ', '.join(select_list or [f"[{col}]" for col in source_columns])
+    select_query = f"SELECT {select_list} FROM [{table_name}]"
+    if where:
+        select_query = f"{select_query} WHERE {where}"
+    return iter_cursor_batches(sql_server_conn, select_query, batch_size, where_params)
+
+
+# Marca de fim do leitor em prefetch_batches
+END_OF_BATCHES = object()
+
+
+def prefetch_batches(batches, depth=2):
+    """
+    Read `batches` ahead on a background thread, so the SQL Server fetch
+    of the next batches overlaps the PostgreSQL load of the current one.
+
+    The reader puts batches in a queue of at most `depth` batches and
+    blocks when it is full, so memory stays bounded at `depth + 1`
+    batches. An error in the reader is raised in the consumer; when the
+    consumer stops early (error or `close()`), the reader is told to stop
+    and joined, and the source generator is closed on the reader thread
+    (which closes its cursor). Close the returned generator explicitly,
+    e.g. with `contextlib.closing`, so this happens right away.
+
+    Args:
+        batches: Batch iterator, e.g. from `iter_table_batches`. It must
+            not be used by any other thread while being read.
+        depth: Batches read ahead; 0 reads inline without a thread.
+
+    Yields:
+        tuple: (rows, seconds spent fetching them).
+    """
+    if depth <= 0:
+        iterator = iter(batches)
+        while True:
+            started = time.perf_counter()
+            rows = next(iterator, None)
+            if rows is None:
+                return
+            yield rows, time.perf_counter() - started
+
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # Espera vaga na fila, desistindo se o consumidor parou
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def read():
+        try:
+            iterator = iter(batches)
+            while not stop.is_set():
+                started = time.perf_counter()
+                rows = next(iterator, None)
+                if rows is None:
+                    break
+                if not put((rows, time.perf_counter() - started)):
+                    break
+            put(END_OF_BATCHES)
+        except Exception as e:
+            put((None, e))
+        finally:
+            if hasattr(batches, 'close'):
+                batches.close()
+
+    reader = threading.Thread(target=read, name="batch-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is END_OF_BATCHES:
+                return
+            rows, fetch_seconds = item
+            if rows is None:
+                raise fetch_seconds
+            yield rows, fetch_seconds
+    finally:
+        stop.set()
+        reader.join()
+
+
+# Tipos que comparam igual no SQL Server e no PostgreSQL, permitindo
+# usar os mesmos limites de faixa nos dois lados
+RANGE_PARTITION_TYPES = {
+    'bigint', 'int', 'smallint', 'tinyint', 'decimal', 'numeric',
+    'date', 'datetime', 'datetime2', 'smalldatetime',
+}
+
+
+class KeyRange:
+    """
+    Half-open range `lower <= column < upper` of a table.
+
+    A missing bound is open. The first range of a table also takes the
+    rows where the column is NULL, so the ranges cover every row exactly once.
+    """
+
+    def __init__(self, column, lower, upper, include_nulls=False):
+        self.column = column
+        self.lower = lower
+        self.upper = upper
+        self.include_nulls = include_nulls
+
+    def predicate(self, column, placeholder):
+        """
+        Render the range as SQL.
+
+        Args:
+            column: Quoted column name on the server the SQL is for, e.g.
+                '[DtCad]' for SQL Server or '"dtcad"' for PostgreSQL.
+            placeholder: Parameter marker of the driver ('?' or '%s').
+
+        Returns:
+            tuple: (predicate SQL, parameters)
+        """
+        terms = []
+        params = []
+        if self.lower is not None:
+            terms.append(f"{column} >= {placeholder}")
+            params.append(self.lower)
+        if self.upper is not None:
+            terms.append(f"{column} < {placeholder}")
+            params.append(self.upper)
+        predicate = ' AND '.join(terms) if terms else '1 = 1'
+        if self.include_nulls:
+            predicate = f"({predicate}) OR {column} IS NULL"
+        return predicate, tuple(params)
+
+    def __repr__(self):
+        return f"{self.column}[{self.lower}, {self.upper})"
+
+
+def get_partition_column(sql_server_conn, table_name, columns, partition_column=None, catalog=None):
+    """
+    Choose the column used to split a table into ranges: the configured
+    one, or else the first primary key column when its type can be
+    compared the same way on both servers.
+
+    Returns:
+        str or None: Column name, or None when the table can't be split.
+    """
+    if partition_column is not None:
+        return partition_column
+    key_columns = get_table_key_columns(sql_server_conn, table_name, catalog)
+    if key_columns and columns[key_columns[0]]['type'].lower() in RANGE_PARTITION_TYPES:
+        return key_columns[0]
+    return None
+
+
+def compute_key_ranges(sql_server_conn, table_name, column, partitions, key_range=None):
+    """
+    Split a table into roughly equal ranges of `column` with NTILE.
+
+    Args:
+        key_range: Split only this range of the table (e.g. to drill down
+            into it); the result then covers exactly that range.
+
+    Returns:
+        list: `KeyRange` objects covering the whole table (or `key_range`).
+    """
+    where = f"[{column}] IS NOT NULL"
+    where_params = ()
+    if key_range is not None:
+        predicate, where_params = key_range.predicate(f"[{column}]", '?')
+        where = f"{where} AND ({predicate})"
+
+    cursor = sql_server_conn.cursor()
+    query = f"""
+    SELECT MIN([{column}])
+    FROM (
+        SELECT [{column}], NTILE(?) OVER (ORDER BY [{column}]) AS tile
+        FROM [{table_name}]
+        WHERE {where}
+    ) AS tiles
+    GROUP BY tile
+    ORDER BY tile
+    """
+    cursor.execute(query, int(partitions), *where_params)
+    # Valores repetidos podem cair em tiles vizinhos: deduplica os limites
+    boundaries = []
+    for (lower,) in cursor.fetchall():
+        if not boundaries or lower != boundaries[-1]:
+            boundaries.append(lower)
+    cursor.close()
+
+    lower, upper, include_nulls = (None, None, True) if key_range is None else (
+        key_range.lower, key_range.upper, key_range.include_nulls)
+    if len(boundaries) <= 1:
+        return [KeyRange(column, lower, upper, include_nulls=include_nulls)]
+
+    # O primeiro tile fica aberto embaixo, o último aberto em cima
+    bounds = [lower] + boundaries[1:] + [upper]
+    return [
+        KeyRange(column, bounds[i], bounds[i + 1], include_nulls=(include_nulls and i == 0))
+        for i in range(len(bounds) - 1)
+    ]
@@ -0,0 +1,234 @@
+import io
+import json
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from utils.functions_copy import build_copy_query, compile_copy_encoder
+from utils.functions_extract import iter_table_batches, prefetch_batches
+from utils.functions_parallel import run_with_connection_pool, close_connections
+from utils.functions_catalog import load_catalog_snapshot
+from utils.functions_metrics import MigrationMetrics
+from utils.functions_batch import AdaptiveBatchSize
+from utils.functions_pgsql import (get_table_columns, generate_pgsql_table_ddl, drop_table_if_exists, process_column,
+                                   normalize_name, sync_catalog_registry, summarize_table_results, LARGE_TABLES,
+                                   TABLE_BATCH_SIZES)
+
+
+class Sink:
+    """
+    A PostgreSQL database fed by a fan-out run, with its own selection of
+    tables.
+
+    Args:
+        base_destino: Target database.
+        tables: Only these tables; every table of the run when None.
+        exclude: Tables left out.
+        copy_data: Copy the data, not just create the tables.
+        base_dados_ids: Id of each source database (by `base_origem`) in
+            this target's `objetos`/`campos`; bases without one aren't synced.
+    """
+
+    def __init__(self, base_destino, tables=None, exclude=(), copy_data=True, base_dados_ids=None):
+        self.base_destino = base_destino
+        self.tables = set(tables) if tables is not None else None
+        self.exclude = set(exclude)
+        self.copy_data = copy_data
+        self.base_dados_ids = dict(base_dados_ids or {})
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec['base_destino'], spec.get('tables'), spec.get('exclude', ()), spec.get('copy_data', True),
+                   spec.get('base_dados_ids'))
+
+    def accepts(self, table_name):
+        return (self.tables is None or table_name in self.tables) and table_name not in self.exclude
+
+    def __repr__(self):
+        return self.base_destino
+
+
+class SinkConnections(dict):
+    """PostgreSQL connections of a worker, one per sink (`base_destino`), closed together."""
+
+    def close(self):
+        close_connections(self.values())
+
+
+def load_manifest(path):
+    """
+    Read a fan-out manifest: a JSON object with 'bases', a list of
+    `[base_origem, schema, instancia]`, and 'sinks', a list of `Sink`
+    specs (`{"base_destino": ..., "tables": [...], "copy_data": ...,
+    "base_dados_ids": {base_origem: id}}`).
+
+    Returns:
+        dict: 'bases' (tuples) and 'sinks' (`Sink` objects).
+    """
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not manifest.get('sinks'):
+        raise ValueError(f"Manifest {path} has no sinks")
+    return {
+        'bases': [tuple(base) for base in manifest.get('bases', [])],
+        'sinks': [Sink.from_dict(spec) for spec in manifest['sinks']],
+    }
+
+
+def fanout_copy_table(sql_server_conn, sink_conns, table_name, schema, columns, batch_size=None, catalog=None,
+                      metrics=None, prefetch=2):
+    """
+    Copy a table to several PostgreSQL databases at once, reading it from
+    SQL Server only once.
+
+    Every batch is encoded once and the same COPY payload is sent to all
+    sinks concurrently (one thread per sink); each sink commits its own
+    batches. The batch is timed once: 'load' is the slowest sink.
+
+    Args:
+        sink_conns: `{base_destino: postgresql_conn}` of the sinks to fill.
+
+    Returns:
+        dict: 'rows' read and 'bytes' of COPY payload per sink.
+    """
+    metrics = metrics or MigrationMetrics()
+    if not isinstance(batch_size, AdaptiveBatchSize):
+        batch_size = AdaptiveBatchSize(columns, fixed=batch_size)
+    normalized_table_name = normalize_name(table_name)
+    dest_columns = ', '.join([process_column(col, info)['normalized_name'] for col, info in columns.items()])
+    copy_query = build_copy_query(schema, normalized_table_name, dest_columns)
+    encode_rows = compile_copy_encoder(columns)
+
+    cursors = {base_destino: conn.cursor() for base_destino, conn in sink_conns.items()}
+
+    def send(base_destino, payload):
+        # Cada destino lê o mesmo payload com o seu próprio StringIO
+        cursors[base_destino].copy_expert(copy_query, io.StringIO(payload))
+
+    batches = prefetch_batches(iter_table_batches(sql_server_conn, table_name, list(columns), batch_size,
+                                                  catalog=catalog), prefetch)
+    copied_rows = 0
+    copied_bytes = 0
+    try:
+        with ThreadPoolExecutor(max_workers=len(sink_conns), thread_name_prefix='sink') as executor, closing(batches):
+            for rows, fetch_seconds in batches:
+                started = time.perf_counter()
+                payload = encode_rows(rows)
+                transformed = time.perf_counter()
+                for future in [executor.submit(send, base_destino, payload) for base_destino in cursors]:
+                    future.result()
+                loaded = time.perf_counter()
+                for conn in sink_conns.values():
+                    conn.commit()
+                committed = time.perf_counter()
+
+                copied_rows += len(rows)
+                copied_bytes += len(payload)
+                metrics.record_batch(table_name, len(rows), len(payload), {
+                    'fetch': fetch_seconds,
+                    'transform': transformed - started,
+                    'load': loaded - transformed,
+                    'commit': committed - loaded,
+                }, ','.join(sink_conns))
+                batch_size.observe(rows, len(payload), fetch_seconds + committed - started)
+                tqdm.write(f"Processed {copied_rows} rows for {table_name} -> {', '.join(sink_conns)}"
+                           f" (batch {len(rows)}, next {batch_size!r})")
+    finally:
+        for cursor in cursors.values():
+            cursor.close()
+    return {'rows': copied_rows, 'bytes': copied_bytes}
+
+
+def fanout_migrate_table(sql_server_conn, sink_conns, sinks, table_name, schema, catalog=None, metrics=None,
+                         batch_size=None):
+    """
+    Create a table in every sink that takes it, then copy its data once
+    to those with `copy_data` (see `fanout_copy_table`).
+    """
+    metrics = metrics or MigrationMetrics()
+    targets = [sink for sink in sinks if sink.accepts(table_name)]
+
+    with metrics.phase(table_name, 'ddl'):
+        create_table_query = generate_pgsql_table_ddl(sql_server_conn, table_name, schema, catalog)
+        for sink in targets:
+            postgresql_conn = sink_conns[sink.base_destino]
+            drop_table_if_exists(postgresql_conn, schema, table_name)
+            with postgresql_conn.cursor() as cursor:
+                cursor.execute(create_table_query)
+            postgresql_conn.commit()
+    print(f"Table {table_name} created in {', '.join(sink.base_destino for sink in targets)}.")
+
+    copy_conns = {sink.base_destino: sink_conns[sink.base_destino] for sink in targets if sink.copy_data}
+    if not copy_conns:
+        return {'rows': 0, 'bytes': 0}
+    if table_name in LARGE_TABLES:
+        # Mesmo critério de copy_table_data sem particionamento
+        print(f"Skipping data copy for table {table_name}")
+        return {'rows': 0, 'bytes': 0}
+    columns = get_table_columns(sql_server_conn, table_name, catalog)
+    return fanout_copy_table(sql_server_conn, copy_conns, table_name, schema, columns, batch_size, catalog, metrics)
+
+
+def fanout_create_tables(sql_server_conn, sink_conns, table_names, schema, sinks, workers=1, connect=None,
+                         catalog=None, metrics=None, batch_sizes=None):
+    """
+    Migrate tables from one SQL Server database to several PostgreSQL
+    databases, reading every table once.
+
+    Args:
+        sink_conns: `SinkConnections` with one connection per sink.
+        sinks: `Sink` objects, each with its own table selection.
+        workers: Tables migrated concurrently; with more than one,
+            `connect` must return a new (sql_server_conn, SinkConnections)
+            pair for each worker.
+        catalog: Catalog snapshot of the source database.
+        metrics: `MigrationMetrics` collecting per-table and per-batch timings.
+        batch_sizes: Fixed batch size per table, on top of `TABLE_BATCH_SIZES`.
+
+    Returns:
+        dict: Summary with 'rows' and 'bytes' read once, and 'failures'.
+    """
+    metrics = metrics or MigrationMetrics()
+    if catalog is None:
+        with metrics.phase(None, 'catalog'):
+            catalog = load_catalog_snapshot(sql_server_conn)
+
+    for sink in sinks:
+        postgresql_conn = sink_conns[sink.base_destino]
+        with postgresql_conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+        postgresql_conn.commit()
+        base_dados_id = sink.base_dados_ids.get(catalog.database)
+        if base_dados_id is not None:
+            with metrics.phase(None, 'catalog_sync'):
+                sink_tables = [table_name for table_name in table_names if sink.accepts(table_name)]
+                sync_catalog_registry(sql_server_conn, postgresql_conn, sink_tables, base_dados_id, catalog)
+
+    table_names = [table_name for table_name in table_names if any(sink.accepts(table_name) for sink in sinks)]
+    table_batch_sizes = {**TABLE_BATCH_SIZES, **(batch_sizes or {})}
+
+    def task(worker_sql_server_conn, worker_sink_conns, table_name):
+        metrics.start_table(table_name)
+        started = time.perf_counter()
+        try:
+            stats = fanout_migrate_table(worker_sql_server_conn, worker_sink_conns, sinks, table_name, schema, catalog,
+                                         metrics, table_batch_sizes.get(table_name))
+        except Exception as e:
+            metrics.finish_table(table_name, time.perf_counter() - started, e)
+            raise
+        metrics.finish_table(table_name, time.perf_counter() - started)
+        return stats
+
+    if workers <= 1:
+        results = {}
+        for table_name in tqdm(table_names, desc="Creating tables", unit="table"):
+            results[table_name] = task(sql_server_conn, sink_conns, table_name)
+        return summarize_table_results(results, {})
+
+    if connect is None:
+        raise ValueError("A connection factory is required when workers > 1")
+
+    results, failures = run_with_connection_pool(table_names, task, connect, workers, desc="Creating tables", unit="table")
+    return summarize_table_results(results, failures)
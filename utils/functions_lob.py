@@ -0,0 +1,244 @@
+import time
+import codecs
+
+from utils.functions_batch import AdaptiveBatchSize, estimate_row_size
+from utils.functions_copy import encode_copy_text
+from utils.functions_extract import key_placeholder
+
+# Valores até este tamanho (o que cabe numa página de dados do SQL Server) vêm
+# na própria página da extração; os maiores são lidos em pedaços
+LOB_INLINE_LIMIT = 8 * 1024
+# Tamanho de cada pedaço lido com SUBSTRING
+LOB_CHUNK_SIZE = 1024 * 1024
+# Teto de memória por worker para as linhas de um lote mais o pedaço em trânsito
+LOB_MEMORY_LIMIT = 64 * 1024 * 1024
+
+LOB_TYPES = {'image', 'text', 'ntext'}
+MAX_LENGTH_TYPES = {'varchar', 'nvarchar', 'varbinary'}
+UNICODE_LOB_TYPES = {'ntext', 'nvarchar'}
+BINARY_LOB_TYPES = {'image', 'varbinary'}
+# Tipos legados convertidos para (max) na página: CASE não aceita text/ntext/image
+LOB_SELECT_TYPES = {'image': 'varbinary(max)', 'text': 'varchar(max)', 'ntext': 'nvarchar(max)'}
+
+
+def get_lob_columns(columns):
+    """
+    Pick the large-object columns of a table from its catalog metadata:
+    text, ntext, image and the (max) types.
+
+    Returns:
+        list: Column names, in ordinal order.
+    """
+    lob_columns = []
+    for column_name, column_info in columns.items():
+        column_type = column_info['type'].lower()
+        if column_type in LOB_TYPES or (column_type in MAX_LENGTH_TYPES and column_info.get('length') == -1):
+            lob_columns.append(column_name)
+    return lob_columns
+
+
+def build_lob_select_list(columns, lob_columns, inline_limit=LOB_INLINE_LIMIT):
+    """
+    Build the select list of a page of a table with large objects.
+
+    Every LOB column is read only when it holds at most `inline_limit`
+    bytes (NULL otherwise), and its DATALENGTH is appended after the
+    table's columns, so a page never holds a large value.
+    """
+    select_list = []
+    for column_name, column_info in columns.items():
+        if column_name not in lob_columns:
+            select_list.append(f"[{column_name}]")
+            continue
+        value = f"[{column_name}]"
+        select_type = LOB_SELECT_TYPES.get(column_info['type'].lower())
+        if select_type:
+            value = f"CONVERT({select_type}, {value})"
+        select_list.append(f"CASE WHEN DATALENGTH([{column_name}]) <= {int(inline_limit)} THEN {value} END")
+    select_list += [f"DATALENGTH([{column_name}])" for column_name in lob_columns]
+    return select_list
+
+
+def lob_batch_size(columns, lob_columns, batch_size=None, memory_limit=LOB_MEMORY_LIMIT,
+                   inline_limit=LOB_INLINE_LIMIT, chunk_size=LOB_CHUNK_SIZE):
+    """
+    Batch size of a table with large objects, kept under `memory_limit`
+    whatever the size of the values: every LOB of a row counts as
+    `inline_limit` bytes three times (the value and its hex in the COPY
+    text of the page), and room is left for one chunk being read and
+    encoded.
+
+    Args:
+        batch_size: Fixed batch size, capped to the memory limit.
+
+    Returns:
+        AdaptiveBatchSize: Tuned within the memory limit.
+    """
+    regular_columns = {name: info for name, info in columns.items() if name not in lob_columns}
+    worst_row_size = ((estimate_row_size(regular_columns) if regular_columns else 0)
+                      + 3 * len(lob_columns) * inline_limit)
+    # Pedaço lido, mais o texto do COPY (o hex do bytea ocupa o dobro)
+    available = max(memory_limit - 3 * chunk_size, worst_row_size)
+    max_rows = max(1, available // worst_row_size)
+    if batch_size is not None:
+        return AdaptiveBatchSize(columns, fixed=min(int(batch_size), max_rows))
+    return AdaptiveBatchSize(columns, byte_budget=available, min_size=min(100, max_rows), max_size=max_rows)
+
+
+def iter_lob_chunks(sql_server_conn, table_name, column_name, column_type, key_columns, key, data_length,
+                    chunk_size=LOB_CHUNK_SIZE, key_types=None):
+    """
+    Read one large value in chunks with SUBSTRING, seeking its row by key,
+    until its `data_length` (DATALENGTH, in bytes) was read.
+
+    Unicode values are read as UTF-16LE bytes and decoded incrementally:
+    SUBSTRING would count UTF-16 code units, not characters, and a chunk
+    could end in the middle of a surrogate pair. `key_types` casts the
+    parameters of datetime keys (see `key_placeholder`).
+
+    Yields:
+        str or bytes: Consecutive chunks of the value.
+    """
+    value = f"[{column_name}]"
+    decoder = None
+    if column_type in UNICODE_LOB_TYPES:
+        # ntext só converte para varbinary passando por nvarchar(max)
+        if column_type in LOB_SELECT_TYPES:
+            value = f"CONVERT({LOB_SELECT_TYPES[column_type]}, {value})"
+        value = f"CONVERT(varbinary(max), {value})"
+        decoder = codecs.getincrementaldecoder('utf-16-le')()
+    key_types = key_types or {}
+    key_filter = ' AND '.join([f"[{col}] = {key_placeholder(key_types.get(col))}" for col in key_columns])
+    query = f"SELECT SUBSTRING({value}, ?, ?) FROM [{table_name}] WHERE {key_filter}"
+    cursor = sql_server_conn.cursor()
+    try:
+        offset = 1
+        while offset <= data_length:
+            cursor.execute(query, offset, chunk_size, *key)
+            row = cursor.fetchone()
+            if row is None or not row[0]:
+                break
+            offset += chunk_size
+            yield decoder.decode(bytes(row[0])) if decoder is not None else row[0]
+        if decoder is not None:
+            rest = decoder.decode(b'', final=True)
+            if rest:
+                yield rest
+    finally:
+        cursor.close()
+
+
+def timed_chunks(chunks, timings):
+    """Yield `chunks`, adding the time spent reading them to `timings['fetch']`."""
+    while True:
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        timings['fetch'] += time.perf_counter() - started
+        if chunk is None:
+            return
+        yield chunk
+
+
+def stream_lob_rows(sql_server_conn, table_name, columns, lob_columns, key_columns, rows, encode_rows,
+                    chunk_size=LOB_CHUNK_SIZE, timings=None):
+    """
+    Encode a page read with `build_lob_select_list` as COPY text, piece by
+    piece: small values come from the page, large ones are read in chunks
+    and encoded as they arrive, so no large value is ever whole in memory.
+
+    Args:
+        encode_rows: COPY encoder of the table (see `compile_copy_encoder`).
+        timings: Dict whose 'fetch' accumulates the time spent reading chunks.
+
+    Yields:
+        str: Pieces of the COPY payload.
+    """
+    source_columns = list(columns)
+    column_count = len(source_columns)
+    lob_positions = [source_columns.index(col) for col in lob_columns]
+    key_positions = [source_columns.index(col) for col in key_columns]
+    key_types = {col: columns[col]['type'] for col in key_columns}
+
+    # Colunas com DATALENGTH mas sem valor na página: valores grandes, lidos em pedaços
+    streamed_rows = {}
+    for row_number, row in enumerate(rows):
+        streamed = {
+            position: (lob_columns[index], row[column_count + index])
+            for index, position in enumerate(lob_positions)
+            if row[position] is None and row[column_count + index] is not None
+        }
+        if streamed:
+            streamed_rows[row_number] = streamed
+
+    payload = encode_rows([row[:column_count] for row in rows])
+    if not streamed_rows:
+        yield payload
+        return
+
+    # O COPY escapa quebras de linha e tabs dos valores: cada linha do payload é uma linha da tabela
+    for row_number, line in enumerate(payload[:-1].split('\n')):
+        streamed = streamed_rows.get(row_number)
+        if streamed is None:
+            yield line + '\n'
+            continue
+        key = [rows[row_number][position] for position in key_positions]
+        for position, field in enumerate(line.split('\t')):
+            if position:
+                yield '\t'
+            if position not in streamed:
+                yield field
+                continue
+            column_name, data_length = streamed[position]
+            column_type = columns[column_name]['type'].lower()
+            chunks = iter_lob_chunks(sql_server_conn, table_name, column_name, column_type, key_columns, key,
+                                     data_length, chunk_size, key_types)
+            if timings is not None:
+                chunks = timed_chunks(chunks, timings)
+            if column_type in BINARY_LOB_TYPES:
+                yield '\\\\x'
+                for chunk in chunks:
+                    yield bytes(chunk).hex()
+            else:
+                for chunk in chunks:
+                    yield encode_copy_text(chunk)
+        yield '\n'
+
+
+class LobCopyStream:
+    """
+    File-like object feeding `cursor.copy_expert` from a generator of
+    COPY text pieces (see `stream_lob_rows`), so the payload of a batch
+    is never built whole. `size` counts the characters sent and
+    `seconds` the time spent producing them (chunk reads and encoding),
+    which the COPY would otherwise count as load time.
+    """
+
+    def __init__(self, pieces):
+        self.pieces = iter(pieces)
+        self.piece = ''
+        self.offset = 0
+        self.size = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while remaining != 0:
+            if self.offset >= len(self.piece):
+                started = time.perf_counter()
+                piece = next(self.pieces, None)
+                self.seconds += time.perf_counter() - started
+                if piece is None:
+                    break
+                # Avança por índice: fatiar o restante de um pedaço de MB a cada leitura seria quadrático
+                self.piece, self.offset = piece, 0
+                continue
+            end = len(self.piece) if remaining < 0 else self.offset + remaining
+            part = self.piece[self.offset:end]
+            self.offset += len(part)
+            if remaining > 0:
+                remaining -= len(part)
+            parts.append(part)
+        data = ''.join(parts)
+        self.size += len(data)
+        return data
@@ -0,0 +1,231 @@
+import json
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tqdm import tqdm
+
+# Fases medidas em cada tabela, na ordem em que aparecem no resumo
+PHASES = ('ddl', 'catalog_sync', 'fetch', 'transform', 'load', 'commit', 'finalize')
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class MigrationMetrics:
+    """
+    Timings and throughput of one migration (one source base and schema).
+
+    Time is split per table into phases (see `PHASES`): DDL, the
+    objetos/campos sync, and for every batch the SQL Server fetch, the
+    Python transform, the PostgreSQL load and the commit. Phases of a
+    table copied in ranges are summed across its range workers.
+
+    With a `log_path`, every batch and every finished table is appended to
+    it as a JSON line; the same events are passed to `on_event`, which
+    subclasses override to stream progress, and to every callable in
+    `listeners` (e.g. a `PlanProgress`). One instance is shared by all
+    the workers of a migration, so every update holds a lock.
+    """
+
+    def __init__(self, base_origem=None, schema=None, log_path=None):
+        self.base_origem = base_origem
+        self.schema = schema
+        self.log_path = log_path
+        self.log_file = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.tables = {}
+        self.run_seconds = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def _table(self, table_name):
+        stats = self.tables.get(table_name)
+        if stats is None:
+            stats = {'rows': 0, 'bytes': 0, 'batches': 0, 'retries': 0, 'status': 'running', 'duration': None,
+                     'seconds': dict.fromkeys(PHASES, 0.0)}
+            self.tables[table_name] = stats
+        return stats
+
+    def _write(self, event):
+        event = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'base_origem': self.base_origem,
+                 'schema': self.schema, **event}
+        if self.log_file is not None:
+            self.log_file.write(json.dumps(event, default=str) + '\n')
+            self.log_file.flush()
+        self.on_event(event)
+        for listener in self.listeners:
+            listener(event)
+
+    def on_event(self, event):
+        """Called with every event, under the lock. Does nothing by default."""
+
+    def add_time(self, table_name, phase, seconds):
+        """Add time to a phase of a table, or of the whole run when `table_name` is None."""
+        with self.lock:
+            if table_name is None:
+                self.run_seconds[phase] = self.run_seconds.get(phase, 0.0) + seconds
+                self._write({'event': 'phase', 'phase': phase, 'seconds': seconds})
+            else:
+                self._table(table_name)['seconds'][phase] += seconds
+
+    @contextmanager
+    def phase(self, table_name, phase):
+        """Time the enclosed block as `phase` of a table."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(table_name, phase, time.perf_counter() - started)
+
+    def add(self, table_name, rows=0, size=0, retries=0):
+        with self.lock:
+            stats = self._table(table_name)
+            stats['rows'] += rows
+            stats['bytes'] += size
+            stats['retries'] += retries
+            if retries:
+                self._write({'event': 'retry', 'table': table_name, 'retries': retries})
+
+    def record_batch(self, table_name, rows, size, seconds, faixa=''):
+        """
+        Record one copied batch.
+
+        Args:
+            rows: Rows in the batch.
+            size: Bytes sent to PostgreSQL (COPY payload size).
+            seconds: Time per phase, e.g. {'fetch': ..., 'load': ...}.
+            faixa: Key range of the batch, when the table is partitioned.
+        """
+        with self.lock:
+            stats = self._table(table_name)
+            stats['rows'] += rows
+            stats['bytes'] += size
+            stats['batches'] += 1
+            for phase, elapsed in seconds.items():
+                stats['seconds'][phase] += elapsed
+            self._write({'event': 'batch', 'table': table_name, 'faixa': faixa, 'batch': stats['batches'],
+                         'rows': rows, 'bytes': size, 'seconds': seconds})
+
+    def start_table(self, table_name):
+        """Record the start of a table."""
+        with self.lock:
+            self._table(table_name)['status'] = 'running'
+            self._write({'event': 'table_start', 'table': table_name})
+
+    def finish_table(self, table_name, duration, error=None):
+        """Record the end of a table, with its wall-clock duration."""
+        with self.lock:
+            stats = self._table(table_name)
+            stats['status'] = 'failed' if error is not None else 'done'
+            stats['duration'] = duration
+            self._write({'event': 'table', 'table': table_name, 'status': stats['status'],
+                         'error': str(error) if error is not None else None, 'duration': duration,
+                         'rows': stats['rows'], 'bytes': stats['bytes'], 'batches': stats['batches'],
+                         'retries': stats['retries'], 'seconds': stats['seconds']})
+
+    def close(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+    def slowest_tables(self, limit=None):
+        """
+        Returns:
+            list: (table name, stats) pairs, slowest first.
+        """
+        with self.lock:
+            tables = [(name, {**stats, 'seconds': dict(stats['seconds'])}) for name, stats in self.tables.items()]
+        tables.sort(key=lambda item: item[1]['duration'] or sum(item[1]['seconds'].values()), reverse=True)
+        return tables[:limit] if limit else tables
+
+    def print_summary(self, limit=20):
+        """Print the slowest tables with rows, throughput and time per phase."""
+        tables = self.slowest_tables(limit)
+        if not tables:
+            return
+        tqdm.write(f"Slowest tables of {self.base_origem} -> {self.schema}:")
+        header = ''.join(f"{phase:>13}" for phase in PHASES)
+        tqdm.write(f"{'Table':<12} {'Rows':>10} {'Bytes':>10} {'Duration':>9} {'Rows/s':>9}{header} {'Retries':>7}")
+        for table_name, stats in tables:
+            duration = stats['duration'] or sum(stats['seconds'].values())
+            rate = stats['rows'] / duration if duration else 0
+            phases = ''.join(f"{stats['seconds'][phase]:>12.1f}s" for phase in PHASES)
+            tqdm.write(
+                f"{table_name:<12} {stats['rows']:>10} {format_bytes(stats['bytes']):>10} {duration:>8.1f}s "
+                f"{rate:>9.0f}{phases} {stats['retries']:>7}"
+                + (" FAILED" if stats['status'] == 'failed' else "")
+            )
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(metrics_list):
+    """Render the counters of several migrations in the Prometheus text format."""
+    samples = {
+        'migracao_table_rows_total': ('counter', 'Rows copied per table.', []),
+        'migracao_table_bytes_total': ('counter', 'Bytes sent to PostgreSQL per table.', []),
+        'migracao_table_batches_total': ('counter', 'Batches copied per table.', []),
+        'migracao_table_retries_total': ('counter', 'Range retries per table.', []),
+        'migracao_table_phase_seconds_total': ('counter', 'Time spent per table and phase.', []),
+        'migracao_table_duration_seconds': ('gauge', 'Wall-clock duration of finished tables.', []),
+    }
+    for metrics in metrics_list:
+        for table_name, stats in metrics.slowest_tables():
+            labels = (f'base="{escape_label(metrics.base_origem)}",schema="{escape_label(metrics.schema)}",'
+                      f'table="{escape_label(table_name)}"')
+            samples['migracao_table_rows_total'][2].append((labels, stats['rows']))
+            samples['migracao_table_bytes_total'][2].append((labels, stats['bytes']))
+            samples['migracao_table_batches_total'][2].append((labels, stats['batches']))
+            samples['migracao_table_retries_total'][2].append((labels, stats['retries']))
+            for phase, seconds in stats['seconds'].items():
+                samples['migracao_table_phase_seconds_total'][2].append((f'{labels},phase="{phase}"', seconds))
+            if stats['duration'] is not None:
+                samples['migracao_table_duration_seconds'][2].append((labels, stats['duration']))
+
+    lines = []
+    for name, (metric_type, description, values) in samples.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f"{name}{{{labels}}} {value}" for labels, value in values)
+    return '\n'.join(lines) + '\n'
+
+
+def serve_prometheus(metrics_list, port, host='127.0.0.1'):
+    """
+    Serve `render_prometheus(metrics_list)` on `/metrics` from a daemon
+    thread. `metrics_list` is read on every scrape, so migrations appended
+    to it later are exported too. Binds to localhost by default; pass
+    `host` (e.g. '0.0.0.0') to expose it to a remote Prometheus.
+
+    Returns:
+        ThreadingHTTPServer: The running server (call `shutdown()` to stop it).
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus(list(metrics_list)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Sem log por scrape no meio das barras de progresso
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    tqdm.write(f"Prometheus metrics on http://{host}:{port}/metrics")
+    return server
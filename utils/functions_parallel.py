@@ -0,0 +1,227 @@
+import os
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+from utils.functions_metrics import MigrationMetrics, format_bytes, serve_prometheus
+
+
+def close_connections(connections):
+    """Close every connection of a pair, ignoring errors from dead sockets."""
+    for conn in connections:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def run_with_connection_pool(items, task, connect, workers, desc="Processing", unit="item"):
+    """
+    Run `task(sql_server_conn, postgresql_conn, item)` for each item on a
+    thread pool where every worker thread owns its own connection pair.
+
+    The drivers release the GIL while waiting on the network, so threads
+    are enough to keep both servers busy. A failure in one item is
+    recorded and does not stop the others; the worker that hit it drops
+    its connections and reconnects for the next item.
+
+    Args:
+        items: Work items (table names, ranges, ...).
+        task: Callable run for each item.
+        connect: Callable returning a new (sql_server_conn, postgresql_conn).
+        workers: Number of worker threads.
+
+    Returns:
+        tuple: (results, failures) dicts keyed by item.
+    """
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    def get_connections():
+        connections = getattr(local, 'connections', None)
+        if connections is None:
+            connections = connect()
+            local.connections = connections
+            with opened_lock:
+                opened.append(connections)
+        return connections
+
+    def run(item):
+        sql_server_conn, postgresql_conn = get_connections()
+        try:
+            return task(sql_server_conn, postgresql_conn, item)
+        except Exception:
+            # Conexão pode ter ficado num estado inválido: descarta e reconecta no próximo item
+            with opened_lock:
+                opened.remove(local.connections)
+            close_connections(local.connections)
+            local.connections = None
+            raise
+
+    results = {}
+    failures = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run, item): item for item in items}
+            with tqdm(total=len(futures), desc=desc, unit=unit) as progress:
+                for future in as_completed(futures):
+                    item = futures[future]
+                    try:
+                        results[item] = future.result()
+                    except Exception as e:
+                        failures[item] = e
+                        tqdm.write(f"Failed {item}: {e}")
+                        tqdm.write(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+                    progress.update(1)
+    finally:
+        for connections in opened:
+            close_connections(connections)
+
+    return results, failures
+
+
+class SessionBudget:
+    """
+    Caps the number of concurrent sessions per SQL Server instance and per
+    PostgreSQL target database.
+
+    A migration reserves all the sessions it needs on both servers at once,
+    so two migrations never deadlock holding half of what they need.
+    """
+
+    def __init__(self, max_sql_server_sessions, max_pgsql_sessions):
+        self.limits = {'sqlserver': max_sql_server_sessions, 'postgresql': max_pgsql_sessions}
+        self.in_use = {}
+        self.condition = threading.Condition()
+
+    def check(self, request):
+        """Raise ValueError when a request asks for more sessions than a server allows: it would never fit."""
+        for (kind, name), sessions in request.items():
+            if sessions > self.limits[kind]:
+                raise ValueError(f"{sessions} sessions requested on {kind} {name}, above the cap of {self.limits[kind]}")
+
+    def _fits(self, request):
+        return all(self.in_use.get(key, 0) + sessions <= self.limits[key[0]] for key, sessions in request.items())
+
+    def acquire(self, request):
+        """Block until every `{(kind, name): sessions}` in the request is available."""
+        self.check(request)
+        with self.condition:
+            self.condition.wait_for(lambda: self._fits(request))
+            for key, sessions in request.items():
+                self.in_use[key] = self.in_use.get(key, 0) + sessions
+        return request
+
+    def release(self, request):
+        with self.condition:
+            for key, sessions in request.items():
+                self.in_use[key] -= sessions
+            self.condition.notify_all()
+
+
+def print_migration_summary(summaries):
+    """Print one line per migrated base with rows, bytes, duration and failures (and the projection of a dry run)."""
+    tqdm.write(f"{'Base':<20} {'Destino':<24} {'Rows':>12} {'Bytes':>12} {'Duration':>10} {'Failures':>8}")
+    for summary in summaries:
+        failures = summary['failures']
+        tqdm.write(
+            f"{summary['base_origem']:<20} {summary['base_destino'] + '.' + summary['schema']:<24} "
+            f"{summary['rows']:>12} {format_bytes(summary['bytes']):>12} "
+            f"{summary['duration']:>9.1f}s {len(failures):>8}"
+        )
+        if summary.get('projected') is not None:
+            # Simulação (dry-run): duração projetada pelo plano em vez da medida
+            tqdm.write(f"    projected: {summary['projected']:.1f}s")
+        for table_name, error in failures.items():
+            tqdm.write(f"    {table_name}: {error}")
+
+
+def run_migrations(migrar, bases_para_migrar, max_parallel=1, max_sql_server_sessions=8, max_pgsql_sessions=8,
+                   metrics_dir=None, metrics_port=None, metrics_host='127.0.0.1', metrics_class=MigrationMetrics,
+                   **options):
+    """
+    Run `migrar` for several bases at once.
+
+    Each entry of `bases_para_migrar` is `(base_origem, base_destino, schema,
+    instancia, *extra)` and is passed to `migrar(..., **options)` (e.g.
+    `workers`, `partitions`, `resume`), which must return the summary of
+    `create_pgsql_tables`. A migration uses `workers + 1` sessions (plus
+    `partitions` while its one large table at a time is split) on its SQL
+    Server instance and on its PostgreSQL database; it only starts when
+    both fit under the configured caps, and a migration that needs more
+    than a cap raises ValueError before anything runs. A fan-out run lists its databases in `base_destino`
+    separated by commas, and takes sessions on each of them.
+
+    Each migration gets its own `MigrationMetrics`, passed to `migrar` as
+    `metrics`. With `metrics_dir`, its batches and tables are logged to
+    `migracao_<base>_<schema>_<timestamp>.jsonl` there; with
+    `metrics_port`, the counters of every migration are served in the
+    Prometheus format on `/metrics` at `metrics_host` while the run lasts. The slowest
+    tables of each base are printed at the end. `metrics_class` builds
+    the collectors, called as `metrics_class(base_origem, schema, log_path)`.
+
+    Returns:
+        list: Per-base summaries, in the order of `bases_para_migrar`.
+    """
+    budget = SessionBudget(max_sql_server_sessions, max_pgsql_sessions)
+    workers = options.get('workers', 1)
+    partitions = options.get('partitions', 1)
+    sessions = workers + 1 if workers > 1 else 1
+    if partitions > 1:
+        # create_pgsql_tables particiona uma tabela grande de cada vez
+        sessions += partitions
+
+    def session_request(base):
+        base_destino, instancia = base[1], base[3]
+        return {('sqlserver', instancia): sessions,
+                **{('postgresql', destino): sessions for destino in base_destino.split(',')}}
+
+    # Falha logo, antes de migrar qualquer base, em vez de esperar por sessões que nunca vão sobrar
+    for base in bases_para_migrar:
+        budget.check(session_request(base))
+
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+    run_started = time.strftime('%Y%m%d_%H%M%S')
+    metrics_list = []
+    server = serve_prometheus(metrics_list, metrics_port, metrics_host) if metrics_port else None
+
+    def run(base):
+        base_origem, base_destino, schema, instancia = base[:4]
+        log_path = None
+        if metrics_dir:
+            log_path = os.path.join(metrics_dir, f"migracao_{base_origem}_{schema}_{run_started}.jsonl")
+        metrics = metrics_class(base_origem, schema, log_path)
+        metrics_list.append(metrics)
+        request = budget.acquire(session_request(base))
+        started = time.monotonic()
+        summary = {'base_origem': base_origem, 'base_destino': base_destino, 'schema': schema,
+                   'rows': 0, 'bytes': 0, 'failures': {}}
+        try:
+            tqdm.write(f"Migrando dados de {base_origem} para {base_destino}...")
+            result = migrar(*base, metrics=metrics, **options)
+            summary.update(result)
+            tqdm.write(f"Migração de {base_origem} para {base_destino} concluída.")
+        except Exception as e:
+            summary['failures'] = {'*': e}
+            tqdm.write(f"Migração de {base_origem} para {base_destino} falhou: {e}")
+        finally:
+            budget.release(request)
+            summary['duration'] = time.monotonic() - started
+            metrics.close()
+        return summary
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            summaries = list(executor.map(run, bases_para_migrar))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    for metrics in metrics_list:
+        metrics.print_summary()
+    print_migration_summary(summaries)
+    return summaries
@@ -1,10 +1,26 @@
 import re
+import time
+import hashlib
+import threading
 import psycopg2
 from tqdm import tqdm
+from contextlib import closing
 import psycopg2.extras
 from psycopg2 import sql
-from psycopg2.extras import execute_values
-from datetime import datetime
+from utils.functions_copy import CopyBuffer, build_copy_query, compile_copy_encoder, compile_row_transform
+from utils.functions_extract import (iter_table_batches, get_partition_column, compute_key_ranges, get_table_key_columns,
+                                     prefetch_batches)
+from utils.functions_parallel import run_with_connection_pool
+from utils.functions_catalog import load_catalog_snapshot
+from utils.functions_checkpoint import CheckpointJournal
+from utils.functions_registry import CatalogRegistry
+from utils.functions_metrics import MigrationMetrics
+from utils.functions_planner import PlanProgress
+from utils.functions_batch import AdaptiveBatchSize
+from utils.functions_lob import (get_lob_columns, build_lob_select_list, lob_batch_size, stream_lob_rows,
+                                 LobCopyStream)
+from utils.functions_delta import (DeltaStateStore, detect_delta_mode, get_delta_watermark,
+                                   is_change_tracking_valid, iter_delta_batches, apply_delta)
 
 VALID_PGSQL_TYPES_WITH_LENGTH = {'varchar', 'char', 'decimal', 'numeric'}
 VALID_PGSQL_TYPES_WITHOUT_LENGTH = {'int', 'text', 'date', 'timestamp', 'smallint', 'bigint', 'boolean', 'bytea', 'json', 'jsonb', 'uuid', 'serial', 'bigserial', 'real', 'double precision'}
@@ -87,27 +103,23 @@ def process_column(column_name, column_info):
         'pgsql_data_type': pgsql_data_type
     }
 
-def get_table_columns(sql_server_conn, table_name):
-    """Get column details from SQL Server."""
-    cursor = sql_server_conn.cursor()
-    query = f"""
-    SELECT column_name, data_type, character_maximum_length
-    FROM information_schema.columns
-    WHERE table_name = '{table_name}'
+def get_table_columns(sql_server_conn, table_name, catalog=None):
     """
-    cursor.execute(query)
-    columns = cursor.fetchall()
-    return {
-        column_name: {
-            'type': data_type,
-            'length': character_maximum_length
-        }
-        for column_name, data_type, character_maximum_length in columns
-    }
+    Get column details from SQL Server, in ordinal order.
 
-def generate_pgsql_table_ddl(sql_server_conn, table_name, schema):
+    Reads from the catalog snapshot (see `load_catalog_snapshot`), so the
+    whole schema is queried once instead of once per table.
+    """
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    return catalog.columns(table_name)
+
+def generate_pgsql_table_ddl(sql_server_conn, table_name, schema, catalog=None, unlogged=False):
     """Generate PostgreSQL table creation DDL."""
-    columns = get_table_columns(sql_server_conn, table_name)
+    columns = get_table_columns(sql_server_conn, table_name, catalog)
+    return build_pgsql_table_ddl(table_name, columns, schema, unlogged)
+
+def build_pgsql_table_ddl(table_name, columns, schema, unlogged=False):
+    """Build the PostgreSQL table creation DDL from column details (see `get_table_columns`)."""
     column_definitions = []
     
     for column_name, column_info in columns.items():
@@ -115,177 +127,659 @@ def generate_pgsql_table_ddl(sql_server_conn, table_name, schema):
         column_definitions.append(f"{processed_column['normalized_name']} {processed_column['pgsql_data_type']}")
     
     normalized_table_name = normalize_name(table_name)
+    create = "CREATE UNLOGGED TABLE" if unlogged else "CREATE TABLE"
     
-    return f"CREATE TABLE {schema}.{normalized_table_name} (\n    {',    '.join(column_definitions)}\n);"
+    return f"{create} {schema}.{normalized_table_name} (\n    {',    '.join(column_definitions)}\n);"
 
 
-def generate_pgsql_table_ddl_and_sync(sql_server_conn, postgresql_conn, table_name, schema):
+def build_registry_rows(sql_server_conn, table_names, catalog=None):
     """
-    Generate PostgreSQL table creation DDL and sync objects and fields manually.
-    
-    Args:
-        sql_server_conn: Connection to the SQL Server database.
-        postgresql_conn: Connection to the PostgreSQL database (efcontrol_migracao).
-        table_name: Name of the table in the SQL Server database.
-        schema: Target schema in PostgreSQL.
+    Build the desired `objetos` and `campos` rows of some tables (see
+    `CatalogRegistry.sync`). Tables with a column type that can't be
+    mapped are left out; their migration fails on its own.
 
     Returns:
-        str: PostgreSQL CREATE TABLE DDL statement.
+        tuple: (objetos rows, campos rows)
     """
-    columns = get_table_columns(sql_server_conn, table_name)
-    column_definitions = []
+    objetos = []
+    campos = []
+    for table_name in table_names:
+        columns = get_table_columns(sql_server_conn, table_name, catalog)
+        try:
+            processed_columns = {name: process_column(name, info) for name, info in columns.items()}
+        except ValueError as e:
+            print(f"Skipping {table_name} in objetos/campos: {e}")
+            continue
+
+        objetos.append((table_name, normalize_name(table_name), f"Tabela sincronizada: {table_name}"))
+        for column_name, column_info in columns.items():
+            processed_column = processed_columns[column_name]
+            campos.append((
+                table_name,                                  # tabela (objeto)
+                column_name,                                 # nome_origem
+                processed_column['normalized_name'],         # nome_destino
+                column_info['type'],                         # tipo_dados_origem
+                processed_column['pgsql_data_type'],         # tipo_dados_destino
+                column_info.get('length'),                   # tamanho_origem
+                column_info.get('length'),                   # tamanho_destino
+                column_info.get('precision'),                # precisao_origem
+                column_info.get('precision'),                # precisao_destino
+                column_info.get('nullable', True),           # aceita_nulo_origem
+                column_info.get('nullable', True),           # aceita_nulo_destino
+                column_info.get('default'),                  # valor_padrao_origem
+                column_info.get('default'),                  # valor_padrao_destino
+            ))
+    return objetos, campos
 
-    # Normalize table name for PostgreSQL
-    normalized_table_name = normalize_name(table_name)
 
-    # Prepare to insert into the `objetos` table
-    objeto_query = """
-    INSERT INTO objetos (nome_origem, nome_destino, tipo, migrar, copiar_dados, descricao, base_dados_id, created_at, updated_at)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, now(), now())
-    RETURNING id;
+def sync_catalog_registry(sql_server_conn, postgresql_conn, table_names, base_dados_id, catalog=None):
     """
-    objeto_values = (
-        table_name,                     # nome_origem
-        normalized_table_name,          # nome_destino
-        'tabela',                       # tipo (default 'tabela')
-        True,                           # migrar
-        True,                           # copiar_dados
-        f"Tabela sincronizada: {table_name}",  # descricao
-        1                          # base_dados_id (passar o ID da base de dados)
+    Register tables and their columns in `objetos`/`campos` under
+    `base_dados_id`, applying only what changed since the last sync.
+
+    Returns:
+        dict: Rows inserted, updated and soft-deleted (see `CatalogRegistry.sync`).
+    """
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    objetos, campos = build_registry_rows(sql_server_conn, table_names, catalog)
+    registry = CatalogRegistry(base_dados_id)
+    registry.check_columns(postgresql_conn)
+    return registry.sync(postgresql_conn, objetos, campos, catalog.table_names())
+
+
+def build_drop_table_query(schema, table_name):
+    """DROP TABLE IF EXISTS of a migrated table, to run in the caller's transaction."""
+    return sql.SQL("DROP TABLE IF EXISTS {schema}.{table_name} CASCADE;").format(
+        schema=sql.Identifier(schema),
+        table_name=sql.Identifier(normalize_name(table_name))
     )
 
-    # Insert the `objetos` record and get its ID
+
+def drop_table_if_exists(postgresql_conn, schema, table_name):
+    """Drop table if it exists in PostgreSQL."""
+    normalized_table_name = normalize_name(table_name)
     with postgresql_conn.cursor() as cursor:
-        print(objeto_query, objeto_values)
-        cursor.execute(objeto_query, objeto_values)
-        objeto_id = cursor.fetchone()[0]
-
-    # Prepare to insert columns into the `campos` table
-    campos_query = """
-    INSERT INTO campos (nome_origem, nome_destino, tipo_dados_origem, tipo_dados_destino,
-                        tamanho_origem, tamanho_destino, precisao_origem, precisao_destino,
-                        aceita_nulo_origem, aceita_nulo_destino, valor_padrao_origem,
-                        valor_padrao_destino, migrar, copiar_dados, objeto_id, created_at, updated_at)
-    VALUES %s;
+        cursor.execute(build_drop_table_query(schema, table_name))
+        postgresql_conn.commit()
+        print(f"Dropped table {schema}.{normalized_table_name}")
+
+def staging_schema_name(schema):
+    """Schema where tables are bulk-loaded before being swapped into `schema`."""
+    return f"carga_{schema}"
+
+# Tamanho máximo de um identificador no PostgreSQL (NAMEDATALEN - 1)
+MAX_IDENTIFIER_LENGTH = 63
+
+def build_index_name(table_name, index_name):
     """
-    campos_values = []
+    Name of an index in PostgreSQL: the table name and the SQL Server
+    index name. Names over `MAX_IDENTIFIER_LENGTH` are cut and end with a
+    hash of the full name, so two long names never collide.
+    """
+    name = normalize_name(f"{table_name}_{index_name}")
+    if len(name) <= MAX_IDENTIFIER_LENGTH:
+        return name
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+    return f"{name[:MAX_IDENTIFIER_LENGTH - len(digest) - 1]}_{digest}"
 
-    for column_name, column_info in columns.items():
-        processed_column = process_column(column_name, column_info)
-        column_definitions.append(f"{processed_column['normalized_name']} {processed_column['pgsql_data_type']}")
+def generate_pgsql_index_ddl(table_name, schema, catalog):
+    """
+    Generate PostgreSQL DDL for the primary key and indexes of a table,
+    taken from the SQL Server catalog.
 
-        campos_values.append((
-            column_name,                                 # nome_origem
-            processed_column['normalized_name'],         # nome_destino
-            column_info['type'],                         # tipo_dados_origem
-            processed_column['pgsql_data_type'],         # tipo_dados_destino
-            column_info.get('length'),                   # tamanho_origem
-            column_info.get('length'),                   # tamanho_destino
-            column_info.get('precision'),                # precisao_origem
-            column_info.get('precision'),                # precisao_destino
-            column_info.get('nullable', True),           # aceita_nulo_origem
-            column_info.get('nullable', True),           # aceita_nulo_destino
-            column_info.get('default'),                  # valor_padrao_origem
-            column_info.get('default'),                  # valor_padrao_destino
-            True,                                        # migrar
-            True,                                        # copiar_dados
-            objeto_id,                                   # objeto_id
-            datetime.now(),                              # created_at
-            datetime.now()                               # updated_at
-        ))
-
-    # Insert all `campos` records in a single batch
-    with postgresql_conn.cursor() as cursor:
-        execute_values(cursor, campos_query, campos_values)
+    Index names are prefixed with the table name, since PostgreSQL index
+    names are unique per schema (see `build_index_name`). Filtered
+    indexes are skipped. The primary key index is built in ascending
+    order: `ADD PRIMARY KEY USING INDEX` refuses DESC columns.
 
-    postgresql_conn.commit()
+    Returns:
+        list: (index name, CREATE INDEX statement, is primary key) tuples.
+    """
+    normalized_table_name = normalize_name(table_name)
+    columns = catalog.columns(table_name)
+    statements = []
+    for index in catalog.table_indexes(table_name):
+        if index['filtered']:
+            continue
+        index_name = build_index_name(table_name, index['name'])
+        key_columns = ', '.join([
+            process_column(column['name'], columns[column['name']])['normalized_name']
+            + (' DESC' if column['descending'] and not index['primary_key'] else '')
+            for column in index['columns']
+        ])
+        unique = 'UNIQUE ' if index['unique'] or index['primary_key'] else ''
+        create_index = f"CREATE {unique}INDEX IF NOT EXISTS {index_name} ON {schema}.{normalized_table_name} ({key_columns})"
+        if index['included']:
+            included = ', '.join([process_column(col, columns[col])['normalized_name'] for col in index['included']])
+            create_index = f"{create_index} INCLUDE ({included})"
+        statements.append((index_name, f"{create_index};", index['primary_key']))
+    return statements
 
-    # Generate the DDL statement
-    return f"CREATE TABLE {schema}.{normalized_table_name} (\n    {',    '.join(column_definitions)}\n);"
+def finalize_staged_table(postgresql_conn, table_name, schema, catalog, maintenance_workers=4,
+                          maintenance_work_mem='512MB'):
+    """
+    Turn a bulk-loaded staging table into the live table.
 
+    Sets the table LOGGED, builds its primary key and indexes (each build
+    using PostgreSQL's parallel maintenance workers), runs ANALYZE and
+    then, in one transaction, drops the old table from `schema` and moves
+    the new one in. Every step is idempotent, so an interrupted finalize
+    can run again.
 
-def drop_table_if_exists(postgresql_conn, schema, table_name):
-    """Drop table if it exists in PostgreSQL."""
+    The swap is left uncommitted: the caller commits it, together with
+    its own bookkeeping.
+    """
+    load_schema = staging_schema_name(schema)
     normalized_table_name = normalize_name(table_name)
+    load_table = f"{load_schema}.{normalized_table_name}"
+
     with postgresql_conn.cursor() as cursor:
-        query = sql.SQL("DROP TABLE IF EXISTS {schema}.{table_name} CASCADE;").format(
-            schema=sql.Identifier(schema),
-            table_name=sql.Identifier(normalized_table_name)
-        )
-        cursor.execute(query)
+        cursor.execute(f"ALTER TABLE {load_table} SET LOGGED;")
         postgresql_conn.commit()
-        print(f"Dropped table {schema}.{normalized_table_name}")
 
-def copy_table_data(sql_server_conn, postgresql_conn, table_name, schema, batch_size=1000):
-    # Lista de tabelas a serem excluídas da cópia de dados
-    excluded_tables = ['SFNH135',
-                       'SCDH001','SCDH002','SCDH003','SCDH004','SCDH005',
-                       'SCRH001','SCRH002','SCRH003','SCRH004','SCRH005']  # Adicione aqui as tabelas que você não quer copiar os dados
-    
-    if table_name in excluded_tables:
-        print(f"Skipping data copy for table {table_name}")
-        return
-    
-    """Copy table data in batches from SQL Server to PostgreSQL."""
-    source_cursor = sql_server_conn.cursor()
+        for index_name, create_index, primary_key in generate_pgsql_index_ddl(table_name, load_schema, catalog):
+            # SET LOCAL: vale só nesta transação, não sobra na conexão devolvida ao pool se o finalize falhar
+            cursor.execute(f"SET LOCAL max_parallel_maintenance_workers = {int(maintenance_workers)};")
+            cursor.execute(f"SET LOCAL maintenance_work_mem = '{maintenance_work_mem}';")
+            cursor.execute(create_index)
+            if primary_key:
+                cursor.execute(
+                    "SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p';",
+                    (load_table,)
+                )
+                if cursor.fetchone() is None:
+                    cursor.execute(f"ALTER TABLE {load_table} ADD CONSTRAINT {index_name} PRIMARY KEY USING INDEX {index_name};")
+            postgresql_conn.commit()
+
+        cursor.execute(f"ANALYZE {load_table};")
+        postgresql_conn.commit()
+
+        # Troca atômica: quem consulta nunca vê a tabela pela metade
+        cursor.execute(f"DROP TABLE IF EXISTS {schema}.{normalized_table_name} CASCADE;")
+        cursor.execute(f"ALTER TABLE {load_table} SET SCHEMA {schema};")
+    print(f"Table {schema}.{normalized_table_name} finalized.")
+
+# Tabelas de histórico muito grandes: só são copiadas quando a cópia é
+# particionada em faixas (partitions > 1), senão são puladas
+LARGE_TABLES = {'SFNH135',
+                'SCDH001','SCDH002','SCDH003','SCDH004','SCDH005',
+                'SCRH001','SCRH002','SCRH003','SCRH004','SCRH005'}
+
+def is_data_copied(table_name, partitions=1, connect=None):
+    """Whether `copy_table_data` copies the rows of a table: `LARGE_TABLES` are skipped unless split in ranges."""
+    return table_name not in LARGE_TABLES or (partitions > 1 and connect is not None)
+
+# Tamanho de lote fixo por tabela, por exemplo {'SFNH135': 20000}; as
+# demais tabelas têm o lote dimensionado e ajustado automaticamente
+TABLE_BATCH_SIZES = {}
+
+def copy_table_range(sql_server_conn, postgresql_conn, table_name, schema, columns, batch_size=None,
+                     load_mode='copy', key_range=None, catalog=None, journal=None, commit_every=1, metrics=None,
+                     prefetch=2):
+    """
+    Copy the rows of a table, or of one key range of it, in batches.
+
+    With a `journal`, every batch commits together with a checkpoint of the
+    last key copied, and a rerun resumes right after it. Without a usable
+    checkpoint, rows already in the target for the range are deleted first
+    (the whole table is truncated when resuming an unranged keyless copy),
+    so a failed copy can simply be run again.
+
+    `commit_every` groups that many batches in each transaction. Every
+    batch is recorded in `metrics` with its fetch, transform, load and
+    commit times.
+
+    Up to `prefetch` batches are read ahead on a reader thread (see
+    `prefetch_batches`), so the SQL Server fetch overlaps the PostgreSQL
+    load; with 0 both run in turn on the calling thread. Fetch time then
+    overlaps the other phases instead of adding to them.
+
+    With no `batch_size`, batches are sized by `AdaptiveBatchSize` from the
+    column metadata and tuned after every batch; an int fixes the size.
+
+    Keyed tables with large-object columns (text, ntext, image, (max))
+    are copied in 'copy' mode without holding large values in memory:
+    pages carry only the small values, each large one is read in chunks
+    and streamed into the COPY (see `stream_lob_rows`), and the batch
+    size is capped so a worker stays under `LOB_MEMORY_LIMIT`. Chunks are
+    read on the same connection as the pages, so there is no prefetch.
+
+    Returns:
+        dict: Copied 'rows' and 'bytes'.
+    """
+    metrics = metrics or MigrationMetrics()
     dest_cursor = postgresql_conn.cursor()
-    
-    columns = get_table_columns(sql_server_conn, table_name)
-    source_columns = ', '.join([f"[{col}]" for col in columns.keys()])
+    normalized_table_name = normalize_name(table_name)
     dest_columns = ', '.join([process_column(col, info)['normalized_name'] for col, info in columns.items()])
     
-    select_query = f"SELECT {source_columns} FROM {table_name}"
-    insert_query = f"INSERT INTO {schema}.{normalize_name(table_name)} ({dest_columns}) VALUES %s"
+    insert_query = f"INSERT INTO {schema}.{normalized_table_name} ({dest_columns}) VALUES %s"
+    copy_query = build_copy_query(schema, normalized_table_name, dest_columns)
+    # Conversões compiladas uma vez por tabela a partir dos tipos das colunas
+    copy_buffer = CopyBuffer(compile_copy_encoder(columns))
+    transform_rows = compile_row_transform(columns)
+
+    faixa = repr(key_range) if key_range is not None else ''
+    state = journal.get(postgresql_conn, table_name, faixa) if journal else None
+    if state and state['status'] in ('copied', 'done'):
+        tqdm.write(f"Skipping {table_name} {faixa}: already copied")
+        return {'rows': state['rows'], 'bytes': 0}
+
+    source_columns = list(columns.keys())
+    key_columns = get_table_key_columns(sql_server_conn, table_name, catalog)
+    key_positions = [source_columns.index(col) for col in key_columns]
+    start_after = state['last_key'] if state and key_columns else None
+
+    # Valores grandes são lidos em pedaços pela chave: só com COPY e tabela com chave
+    lob_columns = get_lob_columns(columns) if load_mode == 'copy' and key_columns else []
+    select_list = None
+    if lob_columns:
+        if not isinstance(batch_size, AdaptiveBatchSize):
+            batch_size = lob_batch_size(columns, lob_columns, batch_size)
+        select_list = build_lob_select_list(columns, lob_columns)
+        prefetch = 0
+    elif not isinstance(batch_size, AdaptiveBatchSize):
+        batch_size = AdaptiveBatchSize(columns, fixed=batch_size)
+
+    if start_after is None:
+        # Sem ponto de retomada: descarta o que já tinha sido copiado
+        if key_range is not None:
+            predicate, params = key_range.predicate(f'"{normalize_name(key_range.column)}"', '%s')
+            dest_cursor.execute(f"DELETE FROM {schema}.{normalized_table_name} WHERE {predicate}", params)
+        elif state is not None:
+            dest_cursor.execute(f"TRUNCATE {schema}.{normalized_table_name}")
+    else:
+        tqdm.write(f"Resuming {table_name} {faixa} after key {start_after}")
     
-    offset = 0
-    while True:
-        source_cursor.execute(f"{select_query} ORDER BY (SELECT NULL) OFFSET {offset} ROWS FETCH NEXT {batch_size} ROWS ONLY")
-        rows = source_cursor.fetchall()
-        if not rows:
-            break
-        
-        cleaned_rows = []
-        for row in rows:
-            cleaned_row = [col.replace('\x00', '') if isinstance(col, str) else col for col in row]
-            cleaned_rows.append(cleaned_row)
-        
-        psycopg2.extras.execute_values(dest_cursor, insert_query, cleaned_rows)
+    # Paginação por chave (PK/índice único) ou cursor único sem OFFSET, lida
+    # numa thread à frente da carga (fila de `prefetch` lotes)
+    batches = prefetch_batches(iter_table_batches(sql_server_conn, table_name, source_columns, batch_size, key_range,
+                                                  catalog, start_after, select_list), prefetch)
+
+    copied_rows = state['rows'] if start_after is not None else 0
+    copied_bytes = 0
+    with closing(batches):
+        # Cada lote é medido por fase: leitura no SQL Server, conversão, carga e commit
+        for batch_number, (rows, fetch_seconds) in enumerate(batches, start=1):
+            started = time.perf_counter()
+            size = 0
+            # Leitura e conversão dos valores grandes, feitas durante o COPY
+            lob_timings = {'fetch': 0.0}
+            lob_seconds = 0.0
+            if lob_columns:
+                stream = LobCopyStream(stream_lob_rows(sql_server_conn, table_name, columns, lob_columns, key_columns,
+                                                       rows, copy_buffer.encode_rows, timings=lob_timings))
+                transformed = time.perf_counter()
+                dest_cursor.copy_expert(copy_query, stream)
+                size = stream.size
+                lob_seconds = stream.seconds
+            elif load_mode == 'copy':
+                # O encoder do COPY já remove os NUL e escapa os valores
+                size = copy_buffer.write(rows)
+                transformed = time.perf_counter()
+                copy_buffer.send(dest_cursor, copy_query)
+            else:
+                values = transform_rows(rows)
+                transformed = time.perf_counter()
+                psycopg2.extras.execute_values(dest_cursor, insert_query, values)
+            copied_rows += len(rows)
+            copied_bytes += size
+            if journal:
+                last_key = [rows[-1][position] for position in key_positions] if key_columns else None
+                journal.save(dest_cursor, table_name, 'copying', copied_rows, last_key, faixa)
+            loaded = time.perf_counter()
+            if batch_number % commit_every == 0:
+                postgresql_conn.commit()
+            committed = time.perf_counter()
+            metrics.record_batch(table_name, len(rows), size, {
+                'fetch': fetch_seconds + lob_timings['fetch'],
+                'transform': transformed - started + lob_seconds - lob_timings['fetch'],
+                'load': loaded - transformed - lob_seconds,
+                'commit': committed - loaded,
+            }, faixa)
+            # Com valores grandes, mede só as linhas da página, que é o que ocupa memória
+            batch_size.observe(rows, 0 if lob_columns else size, fetch_seconds + committed - started)
+            tqdm.write(f"Processed {copied_rows} rows for {table_name}" + (f" {key_range}" if key_range else "")
+                       + f" (batch {len(rows)}, next {batch_size!r})")
+
+    with metrics.phase(table_name, 'commit'):
+        if journal:
+            # 'done' só depois do finalize, gravado por migrate_table
+            journal.save(dest_cursor, table_name, 'copied', copied_rows, faixa=faixa)
         postgresql_conn.commit()
-        offset += batch_size
-        tqdm.write(f"Processed {offset} rows for {table_name}")
-    
     dest_cursor.close()
-    source_cursor.close()
+    return {'rows': copied_rows, 'bytes': copied_bytes}
 
-def create_pgsql_tables(sql_server_conn, postgresql_conn, table_names, schema, copy_data=True):
-    """Create tables and copy data from SQL Server to PostgreSQL."""
+def copy_table_data(sql_server_conn, postgresql_conn, table_name, schema, batch_size=None, load_mode='copy',
+                    partitions=1, partition_column=None, connect=None, range_retries=1, catalog=None, journal=None,
+                    commit_every=1, metrics=None, prefetch=2):
+    """
+    Copy table data in batches from SQL Server to PostgreSQL.
+
+    Args:
+        batch_size: Rows per batch; sized and tuned automatically when None
+            (see `AdaptiveBatchSize`), separately for every range.
+        load_mode: 'copy' streams each batch with COPY FROM STDIN (default);
+            'insert' uses execute_values as a fallback.
+        partitions: Number of key ranges the table is split into. Each range
+            is copied by its own worker and connection pair from `connect`.
+        partition_column: Column used for the ranges (e.g. a date column);
+            defaults to the first primary key column.
+        range_retries: How many times failed ranges are copied again.
+        catalog: Catalog snapshot of the source database.
+        journal: `CheckpointJournal` used to resume the table or its ranges.
+        commit_every: Number of batches per transaction.
+        metrics: `MigrationMetrics` collecting per-batch timings and range retries.
+        prefetch: Batches read ahead of the load by each copy (0 disables
+            the reader thread).
+
+    Returns:
+        dict: Copied 'rows' and 'bytes' (size of the COPY payload; 0 in
+        'insert' mode).
+    """
+    if load_mode not in ('copy', 'insert'):
+        raise ValueError(f"Unknown load mode: '{load_mode}'")
+
+    partitioned = partitions > 1 and connect is not None
+    if not is_data_copied(table_name, partitions, connect):
+        print(f"Skipping data copy for table {table_name}")
+        return {'rows': 0, 'bytes': 0}
+
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    columns = get_table_columns(sql_server_conn, table_name, catalog)
+
+    column = get_partition_column(sql_server_conn, table_name, columns, partition_column, catalog) if partitioned else None
+    if column is None:
+        return copy_table_range(sql_server_conn, postgresql_conn, table_name, schema, columns, batch_size, load_mode,
+                                catalog=catalog, journal=journal, commit_every=commit_every, metrics=metrics,
+                                prefetch=prefetch)
+
+    key_ranges = compute_key_ranges(sql_server_conn, table_name, column, partitions)
+
+    def task(range_sql_server_conn, range_postgresql_conn, key_range):
+        return copy_table_range(range_sql_server_conn, range_postgresql_conn, table_name, schema, columns,
+                                batch_size, load_mode, key_range, catalog, journal, commit_every, metrics, prefetch)
+
+    metrics = metrics or MigrationMetrics()
+    results = {}
+    pending = key_ranges
+    for attempt in range(range_retries + 1):
+        if attempt:
+            metrics.add(table_name, retries=len(pending))
+        # Cada faixa é independente: só as que falharam são copiadas de novo
+        range_results, failures = run_with_connection_pool(pending, task, connect, partitions,
+                                                           desc=f"Copying {table_name}", unit="range")
+        results.update(range_results)
+        pending = list(failures)
+        if not pending:
+            break
+
+    if pending:
+        raise RuntimeError(f"Failed to copy ranges {pending} of {table_name}")
+
+    return {
+        'rows': sum(stats['rows'] for stats in results.values()),
+        'bytes': sum(stats['bytes'] for stats in results.values()),
+    }
+
+# Lotes por transação na carga em tabela de staging (os lotes automáticos
+# chegam a 50 mil linhas ou 16 MB cada)
+STAGED_COMMIT_EVERY = 20
+
+def migrate_table(sql_server_conn, postgresql_conn, table_name, schema, copy_data=True, load_mode='copy',
+                  partitions=1, connect=None, catalog=None, journal=None, staged=False, metrics=None, batch_size=None):
+    """
+    Drop, recreate and optionally copy a single table. Returns the copy stats.
+
+    With a `journal`, a table already migrated is skipped and a table
+    created by an interrupted run is kept and its copy resumed. The copy
+    records 'copied'; the table is only marked 'done' once its finalize
+    is committed, so a failed finalize runs again on resume.
+
+    With `staged`, the table is created UNLOGGED and without indexes in
+    the staging schema, loaded in large transactions and then finalized
+    (see `finalize_staged_table`); the live table is only replaced once
+    it is complete.
+
+    DDL, the copy and the finalize are timed in `metrics`. `batch_size` fixes the batch size of the copy; by default
+    it is tuned automatically.
+    """
+    metrics = metrics or MigrationMetrics()
+    state = journal.get(postgresql_conn, table_name) if journal else None
+    if state and state['status'] == 'done':
+        print(f"Skipping table {table_name}: already migrated")
+        return {'rows': state['rows'], 'bytes': 0}
+
+    load_schema = staging_schema_name(schema) if staged else schema
+
+    if state is None:
+        with metrics.phase(table_name, 'ddl'):
+            drop_table_if_exists(postgresql_conn, load_schema, table_name)
+            create_table_query = generate_pgsql_table_ddl(sql_server_conn, table_name, load_schema, catalog,
+                                                          unlogged=staged)
+            print(create_table_query)
+            with postgresql_conn.cursor() as cursor:
+                cursor.execute(create_table_query)
+                if journal:
+                    journal.save(cursor, table_name, 'created')
+            postgresql_conn.commit()
+        print(f"Table {table_name} created successfully.")
+    else:
+        print(f"Resuming table {table_name} from checkpoint.")
+
+    stats = {'rows': 0, 'bytes': 0}
+    if copy_data:
+        stats = copy_table_data(sql_server_conn, postgresql_conn, table_name, load_schema, batch_size=batch_size,
+                                load_mode=load_mode, partitions=partitions, connect=connect, catalog=catalog,
+                                journal=journal, commit_every=STAGED_COMMIT_EVERY if staged else 1, metrics=metrics)
+    if staged:
+        with metrics.phase(table_name, 'finalize'):
+            finalize_staged_table(postgresql_conn, table_name, schema, catalog or load_catalog_snapshot(sql_server_conn))
+    if journal:
+        with postgresql_conn.cursor() as cursor:
+            journal.save(cursor, table_name, 'done', stats['rows'])
+    postgresql_conn.commit()
+    return stats
+
+def sync_table_incremental(sql_server_conn, postgresql_conn, table_name, schema, delta_store, load_mode='copy',
+                           partitions=1, connect=None, catalog=None, journal=None, updated_at_column=None,
+                           batch_size=None, staged=False, metrics=None):
+    """
+    Sync a table with only the rows changed since its last sync.
+
+    Changes are detected with Change Tracking, a rowversion column or
+    `updated_at_column` (see `detect_delta_mode`) and applied through
+    staging tables; only Change Tracking propagates deletes. Tables
+    without a key or a way to detect changes, never synced before, or
+    whose Change Tracking history expired are fully reloaded with
+    `migrate_table`, recording the mark taken before the copy. No mark is
+    recorded when the reload skips the data (`is_data_copied`), so a
+    table left empty is never synced as if it had been copied.
+
+    Returns:
+        dict: 'rows' (changed rows applied or rows copied) and 'bytes'.
+    """
+    metrics = metrics or MigrationMetrics()
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    columns = get_table_columns(sql_server_conn, table_name, catalog)
+    key_columns = catalog.key_columns(table_name)
+    mode, column = detect_delta_mode(sql_server_conn, table_name, columns, updated_at_column) if key_columns else (None, None)
+
+    if mode is None:
+        return migrate_table(sql_server_conn, postgresql_conn, table_name, schema, True, load_mode,
+                             partitions, connect, catalog, journal, staged, metrics, batch_size)
+
+    state = delta_store.get(postgresql_conn, table_name)
+    reload = (
+        state is None
+        or (state['mode'], state['column']) != (mode, column)
+        or (mode == 'change_tracking' and not is_change_tracking_valid(sql_server_conn, table_name, state['watermark']))
+    )
+    until = get_delta_watermark(sql_server_conn, table_name, mode, column)
+
+    if reload:
+        stats = migrate_table(sql_server_conn, postgresql_conn, table_name, schema, True, load_mode,
+                              partitions, connect, catalog, journal, staged, metrics, batch_size)
+        if not is_data_copied(table_name, partitions, connect):
+            # Tabela recriada vazia: sem a marca, a próxima execução recarrega em vez de aplicar só as mudanças
+            return stats
+        with postgresql_conn.cursor() as cursor:
+            delta_store.save(cursor, table_name, mode, column, until)
+        postgresql_conn.commit()
+        return stats
+
+    dest_columns = [process_column(col, info)['normalized_name'] for col, info in columns.items()]
+    dest_key_columns = [process_column(col, columns[col])['normalized_name'] for col in key_columns]
+    batches = iter_delta_batches(sql_server_conn, table_name, list(columns.keys()), key_columns, mode, column,
+                                 state['watermark'], until, AdaptiveBatchSize(columns, fixed=batch_size))
+    # A leitura das mudanças acontece dentro do apply_delta: entra na fase de carga
+    with metrics.phase(table_name, 'load'):
+        result = apply_delta(postgresql_conn, schema, normalize_name(table_name), dest_columns, dest_key_columns, batches)
+    with metrics.phase(table_name, 'commit'):
+        with postgresql_conn.cursor() as cursor:
+            delta_store.save(cursor, table_name, mode, column, until)
+        postgresql_conn.commit()
+    metrics.add(table_name, rows=result['upserts'] + result['deletes'])
+    tqdm.write(f"Synced {table_name} ({mode}): {result['upserts']} upserts, {result['deletes']} deletes")
+    return {'rows': result['upserts'] + result['deletes'], 'bytes': 0}
+
+def summarize_table_results(results, failures):
+    """Add up the per-table copy stats of a migration."""
+    return {
+        'rows': sum(stats['rows'] for stats in results.values()),
+        'bytes': sum(stats['bytes'] for stats in results.values()),
+        'failures': failures,
+    }
+
+def create_pgsql_tables(sql_server_conn, postgresql_conn, table_names, schema, copy_data=True, load_mode='copy',
+                        workers=1, connect=None, partitions=1, catalog=None, resume=False,
+                        incremental=False, updated_at_column=None, staged=False, metrics=None, batch_sizes=None,
+                        base_dados_id=None, plan=None):
+    """
+    Create tables and copy data from SQL Server to PostgreSQL.
+
+    Args:
+        workers: Number of tables migrated concurrently. With more than one
+            worker, `connect` must return a new (sql_server_conn,
+            postgresql_conn) pair for each worker thread.
+        connect: Connection factory used by the workers.
+        partitions: Number of key ranges copied concurrently for each of the
+            `LARGE_TABLES`; requires `connect`. Only one table is split at
+            a time, so a migration never holds more than `workers + 1 +
+            partitions` connection pairs.
+        catalog: Catalog snapshot of the source database; loaded once here
+            when not given and shared by every worker.
+        resume: Keep the progress recorded in `migracao_checkpoints` by a
+            previous run: finished tables are skipped and partially copied
+            ones resume from their last checkpoint. Otherwise the progress
+            of this base and schema is cleared and everything is rebuilt.
+        incremental: Sync only changed rows of tables already migrated (see
+            `sync_table_incremental`) instead of dropping and reloading them.
+        updated_at_column: Column used to detect changes in incremental mode
+            for tables without Change Tracking or a rowversion column.
+        staged: Bulk-load each table UNLOGGED in the staging schema and swap
+            it in with its keys and indexes once loaded (see `migrate_table`).
+        metrics: `MigrationMetrics` collecting per-table and per-batch
+            timings; a throwaway in-memory one is used when not given.
+        batch_sizes: Fixed batch size per table, on top of
+            `TABLE_BATCH_SIZES`; other tables are sized automatically.
+        base_dados_id: Id of the source database in the `objetos`/`campos`
+            control tables; all tables are synced there at once before
+            migrating (see `sync_catalog_registry`). Not synced when None.
+        plan: `MigrationPlan` of these tables (see `plan_migration`); the
+            tables are migrated largest first and a progress bar in bytes
+            shows the ETA of the run.
+
+    Returns:
+        dict: Summary with copied 'rows' and 'bytes', and 'failures'
+        mapping each table that failed in parallel mode to its error.
+    """
     with postgresql_conn.cursor() as cursor:
         cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+        if staged:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {staging_schema_name(schema)};")
         postgresql_conn.commit()
-        
-        for table_name in tqdm(table_names, desc="Creating tables", unit="table"):
-            drop_table_if_exists(postgresql_conn, schema, table_name)
-            create_table_query = generate_pgsql_table_ddl_and_sync(sql_server_conn, postgresql_conn, table_name, schema)
-            print(create_table_query)
-            cursor.execute(create_table_query)
-            postgresql_conn.commit()
-            print(f"Table {table_name} created successfully.")
-            if copy_data:
-                copy_table_data(sql_server_conn, postgresql_conn, table_name, schema, batch_size=1000)
 
-def get_short_tables(sql_server_conn):
+    metrics = metrics or MigrationMetrics()
+    if catalog is None:
+        with metrics.phase(None, 'catalog'):
+            catalog = load_catalog_snapshot(sql_server_conn)
+
+    journal = CheckpointJournal(catalog.database, schema)
+    journal.ensure_table(postgresql_conn)
+    if not resume:
+        journal.reset(postgresql_conn)
+
+    delta_store = None
+    if incremental and copy_data:
+        delta_store = DeltaStateStore(catalog.database, schema)
+        delta_store.ensure_table(postgresql_conn)
+
+    if base_dados_id is not None:
+        with metrics.phase(None, 'catalog_sync'):
+            counts = sync_catalog_registry(sql_server_conn, postgresql_conn, table_names, base_dados_id, catalog)
+        print(f"objetos/campos synced: {counts}")
+
+    table_batch_sizes = {**TABLE_BATCH_SIZES, **(batch_sizes or {})}
+
+    progress = None
+    if plan is not None:
+        # As maiores primeiro: não ficam para o fim segurando um worker sozinhas
+        table_names = plan.order(table_names)
+        if plan.sized:
+            progress = PlanProgress(plan)
+            metrics.listeners.append(progress.on_event)
+
+    # Uma tabela particionada de cada vez: as faixas abrem `partitions` conexões além das dos workers
+    partition_slot = threading.Lock()
+
+    def migrate(worker_sql_server_conn, worker_postgresql_conn, table_name):
+        table_partitions = partitions if table_name in LARGE_TABLES else 1
+        if table_partitions > 1:
+            with partition_slot:
+                return migrate_table_or_delta(worker_sql_server_conn, worker_postgresql_conn, table_name,
+                                              table_partitions)
+        return migrate_table_or_delta(worker_sql_server_conn, worker_postgresql_conn, table_name, table_partitions)
+
+    def migrate_table_or_delta(worker_sql_server_conn, worker_postgresql_conn, table_name, table_partitions):
+        batch_size = table_batch_sizes.get(table_name)
+        if delta_store is not None:
+            return sync_table_incremental(worker_sql_server_conn, worker_postgresql_conn, table_name, schema, delta_store,
+                                          load_mode, table_partitions, connect, catalog, journal, updated_at_column,
+                                          batch_size, staged, metrics)
+        return migrate_table(worker_sql_server_conn, worker_postgresql_conn, table_name, schema, copy_data, load_mode,
+                             table_partitions, connect, catalog, journal, staged, metrics, batch_size)
+
+    def task(worker_sql_server_conn, worker_postgresql_conn, table_name):
+        metrics.start_table(table_name)
+        started = time.perf_counter()
+        try:
+            stats = migrate(worker_sql_server_conn, worker_postgresql_conn, table_name)
+        except Exception as e:
+            metrics.finish_table(table_name, time.perf_counter() - started, e)
+            raise
+        metrics.finish_table(table_name, time.perf_counter() - started)
+        return stats
+
+    try:
+        if workers <= 1:
+            results = {}
+            for table_name in tqdm(table_names, desc="Creating tables", unit="table"):
+                results[table_name] = task(sql_server_conn, postgresql_conn, table_name)
+            return summarize_table_results(results, {})
+
+        if connect is None:
+            raise ValueError("A connection factory is required when workers > 1")
+
+        results, failures = run_with_connection_pool(table_names, task, connect, workers, desc="Creating tables",
+                                                     unit="table")
+        return summarize_table_results(results, failures)
+    finally:
+        if progress is not None:
+            metrics.listeners.remove(progress.on_event)
+            progress.close()
+
+def get_short_tables(sql_server_conn, catalog=None):
     """Get tables with short names from SQL Server."""
-    cursor = sql_server_conn.cursor()
-    query = """
-    SELECT table_name 
-    FROM information_schema.tables 
-    WHERE table_type = 'BASE TABLE' 
-    AND table_schema = 'dbo' 
-    AND LEN(table_name) <= 7 
-    ORDER BY table_name
-    """
-    #AND (table_name LIKE 'SC%' OR table_name LIKE 'SF%')
-    cursor.execute(query)
-    tables = cursor.fetchall()
-    cursor.close()
-    return [table[0] for table in tables]
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    # Filtro opcional: table_name.startswith(('SC', 'SF'))
+    return [table_name for table_name in catalog.table_names() if len(table_name) <= 7]
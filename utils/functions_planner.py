@@ -0,0 +1,218 @@
+import os
+import glob
+import json
+import heapq
+import threading
+
+from tqdm import tqdm
+
+from utils.functions_catalog import fetch_table_stats
+from utils.functions_metrics import format_bytes
+
+# Vazão assumida sem histórico: bytes reservados no SQL Server copiados por segundo
+DEFAULT_BYTES_PER_SECOND = 8 * 1024 * 1024
+# Custo fixo de cada tabela (DDL, catálogo, commit), mesmo vazia
+TABLE_OVERHEAD_SECONDS = 1.0
+# Logs de execuções anteriores lidos para o histórico: só os mais recentes
+HISTORY_RUNS = 10
+# Trecho dos eventos 'table' no log (`MigrationMetrics._write`, que grava ts/base/schema antes):
+# as linhas de lote são puladas sem json.loads
+TABLE_EVENT_MARKER = '"event": "table",'
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def load_table_history(history_dir, base_origem, schema=None, runs=HISTORY_RUNS):
+    """
+    Read the tables finished by earlier runs of a base from their metrics
+    logs (`migracao_<base>_<schema>_<timestamp>.jsonl`, see `run_migrations`).
+    Only the `runs` most recent logs are read, and only their 'table'
+    events are parsed.
+
+    Returns:
+        dict: `{table: {'rows', 'duration'}}` from the latest successful run of each table.
+    """
+    pattern = f"migracao_{base_origem}_{schema}_*.jsonl" if schema else f"migracao_{base_origem}_*.jsonl"
+    history = {}
+    # O timestamp no nome ordena os arquivos: do mais recente para o mais antigo, o primeiro a ver a tabela vale
+    for path in sorted(glob.glob(os.path.join(history_dir, pattern)), reverse=True)[:runs]:
+        run = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if TABLE_EVENT_MARKER not in line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('status') == 'done' and event.get('duration'):
+                    run[event['table']] = {'rows': event.get('rows', 0), 'duration': event['duration']}
+        for table_name, entry in run.items():
+            history.setdefault(table_name, entry)
+    return history
+
+
+def project_duration(seconds, workers):
+    """Wall-clock time of running jobs of `seconds` largest-first on `workers` (LPT scheduling)."""
+    loads = [0.0] * max(workers, 1)
+    for job_seconds in sorted(seconds, reverse=True):
+        # Cada tabela vai para o worker que fica livre primeiro
+        heapq.heapreplace(loads, loads[0] + job_seconds)
+    return max(loads)
+
+
+class MigrationPlan:
+    """
+    Tables of a migration with their size and estimated copy time,
+    largest first; see `plan_migration`. Without `sized`, the sizes are
+    unknown and the tables keep the catalog order.
+    """
+
+    def __init__(self, base_origem, schema, tables, workers, bytes_per_second, sized=True):
+        self.base_origem = base_origem
+        self.sized = sized
+        self.schema = schema
+        self.tables = sorted(tables, key=lambda table: table['seconds'], reverse=True)
+        self.workers = workers
+        self.bytes_per_second = bytes_per_second
+        self.by_name = {table['table']: table for table in self.tables}
+
+    @property
+    def total_bytes(self):
+        return sum(table['reserved_bytes'] for table in self.tables)
+
+    @property
+    def projected_seconds(self):
+        return project_duration([table['seconds'] for table in self.tables], self.workers)
+
+    def order(self, table_names):
+        """Sort `table_names` largest first; tables missing from the plan go last."""
+        return sorted(table_names, key=lambda name: -self.by_name[name]['seconds'] if name in self.by_name else 0)
+
+    def print_plan(self, limit=20):
+        tqdm.write(
+            f"Plan {self.base_origem} -> {self.schema}: {len(self.tables)} tables, {format_bytes(self.total_bytes)}, "
+            f"projected {format_duration(self.projected_seconds)} with {self.workers} worker(s) "
+            f"at {format_bytes(self.bytes_per_second)}/s"
+        )
+        tqdm.write(f"{'Table':<12} {'Rows':>12} {'Reserved':>10} {'Estimate':>10} {'Source':>8}")
+        for table in self.tables[:limit]:
+            tqdm.write(
+                f"{table['table']:<12} {table['rows']:>12} {format_bytes(table['reserved_bytes']):>10} "
+                f"{format_duration(table['seconds']):>10} {table['estimate']:>8}"
+            )
+        if len(self.tables) > limit:
+            tqdm.write(f"... {len(self.tables) - limit} smaller tables")
+
+
+def plan_migration(sql_server_conn, table_names, base_origem=None, schema=None, workers=1, copy_data=True,
+                   partitioned_tables=(), partitions=1, history_dir=None, metrics=None):
+    """
+    Estimate the copy time of every table and order them largest first,
+    so the biggest tables start early instead of becoming the long tail.
+
+    Sizes (rows, reserved bytes, LOB pages included) come from
+    `sys.dm_db_partition_stats`. A table copied by an earlier run is
+    estimated from its last duration, scaled by its current row count;
+    the others from their reserved bytes at the throughput those runs
+    achieved (`DEFAULT_BYTES_PER_SECOND` without history).
+
+    Planning is best-effort: when the sizes can't be read (e.g. the login
+    lacks VIEW DATABASE STATE), the tables keep the catalog order.
+
+    Args:
+        workers: Tables migrated concurrently, for the projected duration.
+        copy_data: Whether data is copied; only the DDL is counted otherwise.
+        partitioned_tables: Tables split in `partitions` ranges copied
+            concurrently (`LARGE_TABLES`); without partitions their data
+            isn't copied.
+        history_dir: Directory of the metrics logs of earlier runs; by
+            default the one `metrics` logs to.
+
+    Returns:
+        MigrationPlan: The plan.
+    """
+    if history_dir is None and metrics is not None and metrics.log_path:
+        history_dir = os.path.dirname(metrics.log_path)
+    try:
+        stats = fetch_table_stats(sql_server_conn)
+    except Exception as e:
+        tqdm.write(f"Plan {base_origem} -> {schema}: table sizes unavailable, keeping catalog order ({e})")
+        tables = [{'table': table_name, 'rows': 0, 'reserved_bytes': 0, 'seconds': TABLE_OVERHEAD_SECONDS,
+                   'estimate': 'catalog'} for table_name in table_names]
+        return MigrationPlan(base_origem, schema, tables, workers, DEFAULT_BYTES_PER_SECOND, sized=False)
+    history = load_table_history(history_dir, base_origem, schema) if history_dir and base_origem else {}
+
+    # Calibra a vazão pelas tabelas com histórico: bytes reservados (na escala das linhas de então) por segundo
+    history_bytes = 0.0
+    history_seconds = 0.0
+    for table_name, entry in history.items():
+        table_stats = stats.get(table_name)
+        if table_stats and table_stats['rows']:
+            history_bytes += table_stats['reserved_bytes'] * entry['rows'] / table_stats['rows']
+            history_seconds += entry['duration']
+    bytes_per_second = history_bytes / history_seconds if history_bytes and history_seconds else DEFAULT_BYTES_PER_SECOND
+
+    tables = []
+    for table_name in table_names:
+        table_stats = stats.get(table_name, {'rows': 0, 'reserved_bytes': 0})
+        entry = history.get(table_name)
+        if not copy_data or (table_name in partitioned_tables and partitions <= 1):
+            seconds, estimate = TABLE_OVERHEAD_SECONDS, 'ddl'
+        elif entry and entry['rows']:
+            seconds, estimate = entry['duration'] * table_stats['rows'] / entry['rows'], 'history'
+        else:
+            seconds, estimate = TABLE_OVERHEAD_SECONDS + table_stats['reserved_bytes'] / bytes_per_second, 'size'
+        if table_name in partitioned_tables and partitions > 1 and estimate != 'ddl':
+            seconds /= partitions
+        tables.append({
+            'table': table_name,
+            'rows': table_stats['rows'],
+            'reserved_bytes': table_stats['reserved_bytes'],
+            'seconds': max(seconds, TABLE_OVERHEAD_SECONDS),
+            'estimate': estimate,
+        })
+    return MigrationPlan(base_origem, schema, tables, workers, bytes_per_second)
+
+
+class PlanProgress:
+    """
+    Progress bar of a migration in bytes of its plan, with the ETA tqdm
+    derives from them: a batch advances its table by its share of the
+    table's rows, a finished table completes its bytes. Register
+    `on_event` as a listener of the run's `MigrationMetrics`.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.done = {}
+        self.lock = threading.Lock()
+        self.progress = tqdm(total=plan.total_bytes, unit='B', unit_scale=True, unit_divisor=1024,
+                             desc=f"{plan.base_origem} -> {plan.schema}")
+
+    def _advance(self, table_name, size):
+        table = self.plan.by_name.get(table_name)
+        if table is None:
+            return
+        # Nunca passa do tamanho planejado da tabela (estatísticas podem estar defasadas)
+        current = self.done.get(table_name, 0)
+        size = max(0, min(size, table['reserved_bytes'] - current))
+        self.done[table_name] = current + size
+        self.progress.update(size)
+
+    def on_event(self, event):
+        with self.lock:
+            table = self.plan.by_name.get(event.get('table'))
+            if table is None:
+                return
+            if event['event'] == 'batch' and table['rows']:
+                self._advance(event['table'], table['reserved_bytes'] * event['rows'] / table['rows'])
+            elif event['event'] == 'table':
+                self._advance(event['table'], table['reserved_bytes'])
+
+    def close(self):
+        self.progress.close()
@@ -0,0 +1,251 @@
+from psycopg2.extras import execute_values
+
+# Exclusão lógica: objetos e campos que sumiram da origem ficam marcados, não são apagados.
+# A coluna é criada pela migração abaixo, aplicada uma vez pelo DBA, nunca em tempo de execução
+REGISTRY_MIGRATION = 'migrations/001_objetos_campos_deleted_at.sql'
+
+REGISTRY_COLUMNS_QUERY = """
+SELECT table_name
+FROM information_schema.columns
+WHERE table_schema = current_schema() AND table_name IN ('objetos', 'campos') AND column_name = 'deleted_at';
+"""
+
+DESIRED_TABLES_DDL = """
+CREATE TEMP TABLE objetos_desejados (
+    nome_origem text PRIMARY KEY,
+    nome_destino text,
+    descricao text
+) ON COMMIT DROP;
+CREATE TEMP TABLE campos_desejados (
+    tabela text,
+    nome_origem text,
+    nome_destino text,
+    tipo_dados_origem text,
+    tipo_dados_destino text,
+    tamanho_origem int,
+    tamanho_destino int,
+    precisao_origem int,
+    precisao_destino int,
+    aceita_nulo_origem boolean,
+    aceita_nulo_destino boolean,
+    valor_padrao_origem text,
+    valor_padrao_destino text,
+    PRIMARY KEY (tabela, nome_origem)
+) ON COMMIT DROP;
+"""
+
+# Objeto vigente de cada tabela da base: o de menor id (reruns antigos gravaram duplicatas)
+CURRENT_OBJETOS_QUERY = """
+CREATE TEMP TABLE objetos_atuais ON COMMIT DROP AS
+SELECT DISTINCT ON (nome_origem) id, nome_origem
+FROM objetos
+WHERE base_dados_id = %(base_dados_id)s AND tipo = 'tabela'
+ORDER BY nome_origem, id;
+"""
+
+DUPLICATE_OBJETOS_QUERY = """
+UPDATE objetos o SET deleted_at = now(), updated_at = now()
+WHERE o.base_dados_id = %(base_dados_id)s AND o.tipo = 'tabela' AND o.deleted_at IS NULL
+  AND NOT EXISTS (SELECT 1 FROM objetos_atuais a WHERE a.id = o.id);
+"""
+
+UPDATE_OBJETOS_QUERY = """
+UPDATE objetos o
+SET nome_destino = d.nome_destino, descricao = d.descricao, deleted_at = NULL, updated_at = now()
+FROM objetos_atuais a
+JOIN objetos_desejados d ON d.nome_origem = a.nome_origem
+WHERE o.id = a.id
+  AND ((o.nome_destino, o.descricao) IS DISTINCT FROM (d.nome_destino, d.descricao) OR o.deleted_at IS NOT NULL);
+"""
+
+INSERT_OBJETOS_QUERY = """
+WITH novos AS (
+    INSERT INTO objetos (nome_origem, nome_destino, tipo, migrar, copiar_dados, descricao, base_dados_id,
+                         created_at, updated_at)
+    SELECT d.nome_origem, d.nome_destino, 'tabela', true, true, d.descricao, %(base_dados_id)s, now(), now()
+    FROM objetos_desejados d
+    WHERE NOT EXISTS (SELECT 1 FROM objetos_atuais a WHERE a.nome_origem = d.nome_origem)
+    RETURNING id, nome_origem
+)
+INSERT INTO objetos_atuais (id, nome_origem) SELECT id, nome_origem FROM novos;
+"""
+
+# Só as tabelas que não existem mais na origem; as que ficaram fora desta execução são mantidas
+DROPPED_OBJETOS_QUERY = """
+UPDATE objetos SET deleted_at = now(), updated_at = now()
+WHERE base_dados_id = %(base_dados_id)s AND tipo = 'tabela' AND deleted_at IS NULL
+  AND NOT (nome_origem = ANY(%(source_tables)s));
+"""
+
+CURRENT_CAMPOS_QUERY = """
+CREATE TEMP TABLE campos_atuais ON COMMIT DROP AS
+SELECT DISTINCT ON (c.objeto_id, c.nome_origem) c.id, c.objeto_id, c.nome_origem
+FROM campos c
+JOIN objetos_atuais a ON a.id = c.objeto_id
+JOIN objetos_desejados d ON d.nome_origem = a.nome_origem
+ORDER BY c.objeto_id, c.nome_origem, c.id;
+"""
+
+DUPLICATE_CAMPOS_QUERY = """
+UPDATE campos c SET deleted_at = now(), updated_at = now()
+FROM objetos_atuais a
+JOIN objetos_desejados d ON d.nome_origem = a.nome_origem
+WHERE c.objeto_id = a.id AND c.deleted_at IS NULL
+  AND NOT EXISTS (SELECT 1 FROM campos_atuais ca WHERE ca.id = c.id);
+"""
+
+UPDATE_CAMPOS_QUERY = """
+UPDATE campos c
+SET nome_destino = d.nome_destino, tipo_dados_origem = d.tipo_dados_origem, tipo_dados_destino = d.tipo_dados_destino,
+    tamanho_origem = d.tamanho_origem, tamanho_destino = d.tamanho_destino,
+    precisao_origem = d.precisao_origem, precisao_destino = d.precisao_destino,
+    aceita_nulo_origem = d.aceita_nulo_origem, aceita_nulo_destino = d.aceita_nulo_destino,
+    valor_padrao_origem = d.valor_padrao_origem, valor_padrao_destino = d.valor_padrao_destino,
+    deleted_at = NULL, updated_at = now()
+FROM campos_atuais ca
+JOIN objetos_atuais a ON a.id = ca.objeto_id
+JOIN campos_desejados d ON d.tabela = a.nome_origem AND d.nome_origem = ca.nome_origem
+WHERE c.id = ca.id
+  AND ((c.nome_destino, c.tipo_dados_origem, c.tipo_dados_destino, c.tamanho_origem, c.tamanho_destino,
+        c.precisao_origem, c.precisao_destino, c.aceita_nulo_origem, c.aceita_nulo_destino,
+        c.valor_padrao_origem, c.valor_padrao_destino)
+       IS DISTINCT FROM
+       (d.nome_destino, d.tipo_dados_origem, d.tipo_dados_destino, d.tamanho_origem, d.tamanho_destino,
+        d.precisao_origem, d.precisao_destino, d.aceita_nulo_origem, d.aceita_nulo_destino,
+        d.valor_padrao_origem, d.valor_padrao_destino)
+       OR c.deleted_at IS NOT NULL);
+"""
+
+INSERT_CAMPOS_QUERY = """
+INSERT INTO campos (nome_origem, nome_destino, tipo_dados_origem, tipo_dados_destino,
+                    tamanho_origem, tamanho_destino, precisao_origem, precisao_destino,
+                    aceita_nulo_origem, aceita_nulo_destino, valor_padrao_origem,
+                    valor_padrao_destino, migrar, copiar_dados, objeto_id, created_at, updated_at)
+SELECT d.nome_origem, d.nome_destino, d.tipo_dados_origem, d.tipo_dados_destino,
+       d.tamanho_origem, d.tamanho_destino, d.precisao_origem, d.precisao_destino,
+       d.aceita_nulo_origem, d.aceita_nulo_destino, d.valor_padrao_origem,
+       d.valor_padrao_destino, true, true, a.id, now(), now()
+FROM campos_desejados d
+JOIN objetos_atuais a ON a.nome_origem = d.tabela
+WHERE NOT EXISTS (SELECT 1 FROM campos_atuais ca WHERE ca.objeto_id = a.id AND ca.nome_origem = d.nome_origem);
+"""
+
+DROPPED_CAMPOS_QUERY = """
+UPDATE campos c SET deleted_at = now(), updated_at = now()
+FROM objetos_atuais a
+JOIN objetos_desejados o ON o.nome_origem = a.nome_origem
+WHERE c.objeto_id = a.id AND c.deleted_at IS NULL
+  AND NOT EXISTS (SELECT 1 FROM campos_desejados d WHERE d.tabela = a.nome_origem AND d.nome_origem = c.nome_origem);
+"""
+
+# Campos das tabelas excluídas (sumiram da origem ou eram duplicatas): saem junto com o objeto
+DELETED_OBJETOS_CAMPOS_QUERY = """
+UPDATE campos c SET deleted_at = now(), updated_at = now()
+FROM objetos o
+WHERE c.objeto_id = o.id AND o.base_dados_id = %(base_dados_id)s AND o.tipo = 'tabela'
+  AND o.deleted_at IS NOT NULL AND c.deleted_at IS NULL;
+"""
+
+
+class CatalogRegistry:
+    """
+    The `objetos`/`campos` control tables of one source database
+    (`base_dados_id`), kept in step with its catalog.
+
+    `sync` loads the desired tables and columns into temporary tables and
+    reconciles them with a few set-based statements in one transaction:
+    changed rows are updated, new ones inserted, and tables or columns
+    that no longer exist at the source are soft-deleted (`deleted_at`),
+    a deleted table together with its columns.
+    Rerunning a migration changes nothing when the source didn't change,
+    and duplicates left by earlier runs are soft-deleted, keeping the
+    oldest row.
+    """
+
+    def __init__(self, base_dados_id):
+        self.base_dados_id = base_dados_id
+
+    def check_columns(self, postgresql_conn):
+        """
+        Raises:
+            RuntimeError: When `REGISTRY_MIGRATION` wasn't applied to the target database.
+        """
+        with postgresql_conn.cursor() as cursor:
+            cursor.execute(REGISTRY_COLUMNS_QUERY)
+            found = {row[0] for row in cursor.fetchall()}
+        postgresql_conn.rollback()
+        missing = {'objetos', 'campos'} - found
+        if missing:
+            raise RuntimeError(
+                f"Column deleted_at missing from {', '.join(sorted(missing))}: apply {REGISTRY_MIGRATION} first"
+            )
+
+    def sync(self, postgresql_conn, objetos, campos, source_tables):
+        """
+        Reconcile the control tables with the desired state.
+
+        Args:
+            objetos: `(nome_origem, nome_destino, descricao)` of every table synced.
+            campos: `(tabela, nome_origem, nome_destino, tipo_dados_origem,
+                tipo_dados_destino, tamanho_origem, tamanho_destino,
+                precisao_origem, precisao_destino, aceita_nulo_origem,
+                aceita_nulo_destino, valor_padrao_origem, valor_padrao_destino)`
+                of every column of those tables.
+            source_tables: Every table of the source database; registered
+                tables missing from it are soft-deleted.
+
+        Returns:
+            dict: Rows 'inserted', 'updated' and 'deleted' in 'objetos' and 'campos'.
+        """
+        params = {'base_dados_id': self.base_dados_id, 'source_tables': list(source_tables)}
+        counts = {'objetos': {}, 'campos': {}}
+        try:
+            with postgresql_conn.cursor() as cursor:
+                # Uma sincronização por base de cada vez
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext('objetos'), %(base_dados_id)s);", params)
+                cursor.execute(DESIRED_TABLES_DDL)
+                execute_values(cursor, "INSERT INTO objetos_desejados VALUES %s", objetos, page_size=1000)
+                execute_values(cursor, "INSERT INTO campos_desejados VALUES %s", campos, page_size=1000)
+
+                cursor.execute(CURRENT_OBJETOS_QUERY, params)
+                cursor.execute(DUPLICATE_OBJETOS_QUERY, params)
+                deleted = cursor.rowcount
+                cursor.execute(UPDATE_OBJETOS_QUERY, params)
+                counts['objetos']['updated'] = cursor.rowcount
+                cursor.execute(INSERT_OBJETOS_QUERY, params)
+                counts['objetos']['inserted'] = cursor.rowcount
+                cursor.execute(DROPPED_OBJETOS_QUERY, params)
+                counts['objetos']['deleted'] = deleted + cursor.rowcount
+
+                cursor.execute(CURRENT_CAMPOS_QUERY, params)
+                cursor.execute(DUPLICATE_CAMPOS_QUERY, params)
+                deleted = cursor.rowcount
+                cursor.execute(UPDATE_CAMPOS_QUERY, params)
+                counts['campos']['updated'] = cursor.rowcount
+                cursor.execute(INSERT_CAMPOS_QUERY, params)
+                counts['campos']['inserted'] = cursor.rowcount
+                cursor.execute(DROPPED_CAMPOS_QUERY, params)
+                deleted += cursor.rowcount
+                cursor.execute(DELETED_OBJETOS_CAMPOS_QUERY, params)
+                counts['campos']['deleted'] = deleted + cursor.rowcount
+            postgresql_conn.commit()
+        except Exception:
+            postgresql_conn.rollback()
+            raise
+        return counts
+
+
+def parse_base_dados_ids(values):
+    """
+    Parse `BASE=ID` command line entries into `{base_origem: base_dados_id}`.
+
+    Raises:
+        ValueError: When an entry is not in the `BASE=ID` form.
+    """
+    base_dados_ids = {}
+    for value in values or []:
+        base_origem, separator, base_dados_id = value.partition('=')
+        if not separator or not base_dados_id.strip().isdigit():
+            raise ValueError(f"Invalid base_dados_id '{value}', expected BASE=ID")
+        base_dados_ids[base_origem.strip()] = int(base_dados_id)
+    return base_dados_ids
@@ -0,0 +1,315 @@
+from tqdm import tqdm
+
+from utils.functions_extract import get_partition_column, compute_key_ranges
+from utils.functions_parallel import run_with_connection_pool
+from utils.functions_catalog import load_catalog_snapshot
+from utils.functions_pgsql import process_column, normalize_name
+
+# Collation do SQL Server que gera os mesmos bytes que convert_to() no PostgreSQL
+TEXT_ENCODING_COLLATIONS = {
+    'UTF8': 'Latin1_General_100_CI_AS_SC_UTF8',
+    'WIN1252': 'Latin1_General_CI_AS',
+}
+
+CHARACTER_TYPES = {'varchar', 'nvarchar', 'text', 'ntext'}
+PADDED_CHARACTER_TYPES = {'char', 'nchar'}
+# Sem collation UTF-8 (antes do 2019) o SQL Server troca por '?' o que não cabe no WIN1252, e o
+# convert_to do PostgreSQL dá erro: colunas unicode ficam fora do checksum, mas entram na contagem
+UNICODE_CHARACTER_TYPES = {'nvarchar', 'nchar', 'ntext'}
+BINARY_TYPES = {'binary', 'varbinary', 'image', 'timestamp'}
+# Tipos que o PostgreSQL reformata (xml) ficam fora do checksum, mas entram na contagem
+UNVERIFIABLE_TYPES = {'xml'}
+
+
+def detect_text_encoding(sql_server_conn):
+    """
+    Pick the encoding strings are hashed in: UTF-8 on SQL Server 2019+,
+    which has UTF-8 collations, else Windows-1252.
+    """
+    cursor = sql_server_conn.cursor()
+    cursor.execute("SELECT ISNULL(CONVERT(int, SERVERPROPERTY('ProductMajorVersion')), 0)")
+    major_version = cursor.fetchone()[0]
+    cursor.close()
+    return 'UTF8' if major_version >= 15 else 'WIN1252'
+
+
+def normalized_value_sql(column_name, column_info):
+    """
+    SQL rendering one column the same way on both servers, following what
+    the copier writes (see `SQL_SERVER_COPY_ENCODERS`): booleans as t/f,
+    numbers at the column's scale, timestamps to the millisecond, strings
+    without NUL characters and char(n) without its padding.
+
+    Returns:
+        tuple: (kind, SQL Server expression, PostgreSQL expression), kind
+        being 'text', 'binary' or 'ascii' (plain ASCII text); or None for
+        a column that can't be compared.
+    """
+    column_type = column_info['type'].lower()
+    if column_type in UNVERIFIABLE_TYPES:
+        return None
+    source = f"[{column_name}]"
+    target = process_column(column_name, column_info)['normalized_name']
+
+    if column_type in {'bigint', 'int', 'smallint', 'tinyint'}:
+        return 'ascii', f"CONVERT(varchar(20), {source})", f"{target}::text"
+    if column_type == 'bit':
+        return 'ascii', f"CASE {source} WHEN 1 THEN 't' WHEN 0 THEN 'f' END", \
+            f"CASE {target} WHEN true THEN 't' WHEN false THEN 'f' END"
+    if column_type in {'decimal', 'numeric'}:
+        scale = column_info.get('scale') or 0
+        return 'ascii', f"CONVERT(varchar(50), {source})", f"round({target}, {scale})::text"
+    if column_type in {'money', 'smallmoney'}:
+        return 'ascii', f"CONVERT(varchar(50), CAST({source} AS decimal(19, 4)))", f"round({target}, 4)::text"
+    if column_type in {'float', 'real'}:
+        # Ponto flutuante não tem a mesma representação textual nos dois servidores: compara com 6 casas
+        # do valor binário exato (float8::text é o texto mais curto que o reproduz; real::numeric ficaria
+        # com 6 dígitos). Acima de 1e32 o decimal(38, 6) estoura: compara os 8 bytes IEEE 754 em hex
+        return 'ascii', (
+            f"CASE WHEN ABS(CAST({source} AS float)) < 1e32 "
+            f"THEN CONVERT(varchar(50), CAST({source} AS decimal(38, 6))) "
+            f"ELSE CONVERT(varchar(18), CONVERT(binary(8), CAST({source} AS float)), 1) END"
+        ), (
+            f"CASE WHEN abs({target}::float8) < 1e32 "
+            f"THEN round({target}::float8::text::numeric, 6)::text "
+            f"ELSE '0x' || upper(encode(float8send({target}::float8), 'hex')) END"
+        )
+    if column_type == 'date':
+        return 'ascii', f"CONVERT(char(10), {source}, 23)", f"to_char({target}, 'YYYY-MM-DD')"
+    if column_type in {'datetime', 'datetime2', 'smalldatetime'}:
+        # datetime2(0-2) sairia só com a escala da coluna e espaços no lugar dos milissegundos
+        return 'ascii', f"CONVERT(char(23), CONVERT(datetime2(7), {source}), 121)", \
+            f"to_char({target}, 'YYYY-MM-DD HH24:MI:SS.MS')"
+    if column_type == 'datetimeoffset':
+        return 'ascii', f"CONVERT(char(19), SWITCHOFFSET({source}, '+00:00'), 120)", \
+            f"to_char({target} AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+    if column_type == 'time':
+        return 'ascii', f"CONVERT(char(8), {source}, 108)", f"substr({target}::text, 1, 8)"
+    if column_type == 'uniqueidentifier':
+        return 'ascii', f"LOWER(CONVERT(char(36), {source}))", f"{target}::text"
+    if column_type in CHARACTER_TYPES or column_type in PADDED_CHARACTER_TYPES:
+        # REPLACE de NCHAR(0) só funciona com collation binária
+        value = f"REPLACE(CONVERT(nvarchar(max), {source}) COLLATE Latin1_General_BIN, NCHAR(0), '')"
+        if column_type in PADDED_CHARACTER_TYPES:
+            # char(n)::text já descarta os espaços de preenchimento no PostgreSQL
+            value = f"RTRIM({value})"
+        return 'text', value, f"{target}::text"
+    if column_type in BINARY_TYPES:
+        return 'binary', f"CONVERT(varbinary(max), {source})", target
+    return None
+
+
+def build_checksum_queries(table_name, schema, columns, encoding):
+    """
+    Build the row count and checksum queries of a table for both servers.
+
+    Each column is hashed with MD5 (a NULL becomes a single 0x00 byte),
+    the row hash is the MD5 of the column hashes, and the checksum is the
+    sum of the first 8 bytes of every row hash as a signed bigint. The sum
+    doesn't depend on the row order, so no sort is needed on either side,
+    and unlike CHECKSUM_AGG it is computed the same way by both servers.
+
+    With the WIN1252 encoding, nvarchar, nchar and ntext columns are
+    skipped: they may hold characters Windows-1252 can't represent, which
+    SQL Server turns into '?' and PostgreSQL refuses to convert. Their
+    rows are still counted.
+
+    Returns:
+        tuple: (SQL Server query, PostgreSQL query, skipped columns); both
+        queries take the range predicate in place of `{where}`.
+    """
+    collation = TEXT_ENCODING_COLLATIONS[encoding]
+    source_hashes = []
+    target_hashes = []
+    skipped = []
+    for column_name, column_info in columns.items():
+        try:
+            rendered = normalized_value_sql(column_name, column_info)
+        except ValueError:
+            rendered = None
+        if rendered is None:
+            skipped.append(column_name)
+            continue
+        kind, source, target = rendered
+        if kind == 'text' and encoding == 'WIN1252' and column_info['type'].lower() in UNICODE_CHARACTER_TYPES:
+            skipped.append(column_name)
+            continue
+        if kind == 'text':
+            source = f"CONVERT(varbinary(max), CONVERT(varchar(max), {source} COLLATE {collation}))"
+            target = f"convert_to({target}, '{encoding}')"
+        elif kind == 'ascii':
+            source = f"CONVERT(varbinary(max), {source})"
+            target = f"convert_to({target}, 'UTF8')"
+        source_hashes.append(f"ISNULL(HASHBYTES('MD5', {source}), 0x00)")
+        target_hashes.append(f"coalesce(decode(md5({target}), 'hex'), '\\x00'::bytea)")
+
+    if not source_hashes:
+        source_row_hash = "CAST(0 AS bigint)"
+        target_row_hash = "0::bigint"
+    else:
+        source_row_hash = f"CONVERT(bigint, SUBSTRING(HASHBYTES('MD5', {' + '.join(source_hashes)}), 1, 8))"
+        target_row_hash = f"('x' || substr(md5({' || '.join(target_hashes)}), 1, 16))::bit(64)::bigint"
+
+    source_query = (
+        f"SELECT COUNT_BIG(*), SUM(CAST({source_row_hash} AS decimal(38, 0))) "
+        f"FROM [{table_name}] WHERE {{where}}"
+    )
+    target_query = (
+        f"SELECT count(*), sum(({target_row_hash})::numeric) "
+        f"FROM {schema}.{normalize_name(table_name)} WHERE {{where}}"
+    )
+    return source_query, target_query, skipped
+
+
+def compare_range(sql_server_conn, postgresql_conn, queries, key_range=None):
+    """
+    Count and checksum one key range (the whole table when None) on both servers.
+
+    Returns:
+        dict: 'source_rows', 'target_rows', 'source_checksum',
+        'target_checksum' and 'match'.
+    """
+    source_query, target_query, _ = queries
+    source_where, source_params = ('1 = 1', ()) if key_range is None else \
+        key_range.predicate(f"[{key_range.column}]", '?')
+    target_where, target_params = ('true', ()) if key_range is None else \
+        key_range.predicate(f'"{normalize_name(key_range.column)}"', '%s')
+
+    cursor = sql_server_conn.cursor()
+    cursor.execute(source_query.format(where=source_where), *source_params)
+    source_rows, source_checksum = cursor.fetchone()
+    cursor.close()
+    sql_server_conn.commit()
+
+    with postgresql_conn.cursor() as cursor:
+        cursor.execute(target_query.format(where=target_where), target_params)
+        target_rows, target_checksum = cursor.fetchone()
+    postgresql_conn.commit()
+
+    # SUM de zero linhas é NULL nos dois lados
+    source_checksum = int(source_checksum or 0)
+    target_checksum = int(target_checksum or 0)
+    return {
+        'source_rows': source_rows,
+        'target_rows': target_rows,
+        'source_checksum': source_checksum,
+        'target_checksum': target_checksum,
+        'match': source_rows == target_rows and source_checksum == target_checksum,
+    }
+
+
+def verify_tables(sql_server_conn, postgresql_conn, table_names, schema, workers=1, connect=None, partitions=8,
+                  min_range_rows=10000, max_depth=4, catalog=None, encoding=None):
+    """
+    Check that the migrated tables hold the same data as the source,
+    without moving the rows: both servers count and checksum each key
+    range (see `build_checksum_queries`) and only the results are compared.
+
+    Tables are compared whole first. A table that doesn't match is split
+    into `partitions` ranges of its partition column, and every range
+    that doesn't match is split again, down to ranges of about
+    `min_range_rows` rows or `max_depth` levels, so matching data is read
+    once and the mismatches end up narrowed to small ranges. Each level
+    runs every table and range in parallel.
+
+    Args:
+        workers: Number of ranges compared concurrently; with more than one,
+            `connect` must return a new (sql_server_conn, postgresql_conn) pair.
+        connect: Connection factory used by the workers.
+        partitions: Ranges a mismatching table or range is split into.
+        min_range_rows: Ranges with at most this many source rows aren't split.
+        max_depth: Maximum number of splits of a table.
+        catalog: Catalog snapshot of the source database.
+        encoding: Encoding strings are hashed in ('UTF8' or 'WIN1252');
+            detected from the SQL Server version when not given.
+
+    Returns:
+        dict: Per table, 'match', 'source_rows', 'target_rows',
+        'mismatched_ranges' (the narrowest ranges that differ, as text),
+        'skipped_columns' and 'error' (when the comparison failed).
+    """
+    catalog = catalog or load_catalog_snapshot(sql_server_conn)
+    encoding = encoding or detect_text_encoding(sql_server_conn)
+
+    plans = {}
+    for table_name in table_names:
+        columns = catalog.columns(table_name)
+        plans[table_name] = {
+            'queries': build_checksum_queries(table_name, schema, columns, encoding),
+            'column': get_partition_column(sql_server_conn, table_name, columns, catalog=catalog),
+        }
+
+    def task(worker_sql_server_conn, worker_postgresql_conn, item):
+        table_name, key_range, depth = item
+        plan = plans[table_name]
+        result = compare_range(worker_sql_server_conn, worker_postgresql_conn, plan['queries'], key_range)
+        result['children'] = []
+        if (not result['match'] and plan['column'] is not None and depth < max_depth
+                and max(result['source_rows'], result['target_rows']) > min_range_rows):
+            # Divide pela distribuição da origem; linhas que só existem no destino caem nas faixas abertas
+            children = compute_key_ranges(worker_sql_server_conn, table_name, plan['column'], partitions, key_range)
+            worker_sql_server_conn.commit()
+            if len(children) > 1:
+                result['children'] = children
+        return result
+
+    report = {table_name: {'match': None, 'source_rows': None, 'target_rows': None, 'mismatched_ranges': [],
+                           'skipped_columns': plans[table_name]['queries'][2], 'error': None}
+              for table_name in table_names}
+
+    items = [(table_name, None, 0) for table_name in table_names]
+    depth = 0
+    while items:
+        desc = "Verifying tables" if depth == 0 else f"Verifying ranges (level {depth})"
+        if workers <= 1:
+            results, failures = {}, {}
+            for item in tqdm(items, desc=desc, unit="range"):
+                try:
+                    results[item] = task(sql_server_conn, postgresql_conn, item)
+                except Exception as e:
+                    sql_server_conn.rollback()
+                    postgresql_conn.rollback()
+                    failures[item] = e
+        else:
+            if connect is None:
+                raise ValueError("A connection factory is required when workers > 1")
+            results, failures = run_with_connection_pool(items, task, connect, workers, desc=desc, unit="range")
+
+        next_items = []
+        for (table_name, key_range, item_depth), error in failures.items():
+            report[table_name]['match'] = False
+            report[table_name]['error'] = str(error)
+        for (table_name, key_range, item_depth), result in results.items():
+            table_report = report[table_name]
+            if key_range is None:
+                table_report['match'] = result['match']
+                table_report['source_rows'] = result['source_rows']
+                table_report['target_rows'] = result['target_rows']
+            if result['match']:
+                continue
+            if result['children']:
+                next_items += [(table_name, child, item_depth + 1) for child in result['children']]
+            else:
+                table_report['mismatched_ranges'].append(
+                    f"{key_range!r}: {result['source_rows']} rows on SQL Server, {result['target_rows']} on PostgreSQL"
+                    if key_range is not None else "whole table"
+                )
+        items = next_items
+        depth += 1
+
+    return report
+
+
+def print_verification_report(report):
+    mismatched = {table_name: result for table_name, result in report.items() if not result['match']}
+    print(f"Verification: {len(report) - len(mismatched)}/{len(report)} tables match")
+    for table_name, result in sorted(mismatched.items()):
+        if result['error']:
+            print(f"  {table_name}: error: {result['error']}")
+            continue
+        print(f"  {table_name}: {result['source_rows']} rows on SQL Server, {result['target_rows']} on PostgreSQL")
+        for mismatched_range in result['mismatched_ranges']:
+            print(f"    {mismatched_range}")
+    for table_name, result in sorted(report.items()):
+        if result['skipped_columns']:
+            print(f"  {table_name}: not checksummed: {', '.join(result['skipped_columns'])}")